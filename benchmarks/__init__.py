@@ -0,0 +1,3 @@
+# benchmarks
+# Micro and macro benchmarks for IP mapper
+# Run with: python -m benchmarks --help
\ No newline at end of file
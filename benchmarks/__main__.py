@@ -0,0 +1,49 @@
+# __main__.py
+# Command line for the benchmarks
+# Usage: python -m benchmarks [names...] [--quick] [--out results.json] [--compare old.json]
+
+
+# Imports
+import argparse
+import sys
+
+import benchmarks.macro
+import benchmarks.micro
+from benchmarks import runner
+
+
+# Definitions
+def main() -> None:
+    parser = argparse.ArgumentParser(prog="python -m benchmarks", description="Run the IP mapper benchmarks")
+    parser.add_argument("names", nargs='*', help="Benchmarks to run, by name or prefix (default: all)")
+    parser.add_argument("--list", action="store_true", help="List the benchmarks and exit")
+    parser.add_argument("--quick", action="store_true", help="Run every benchmark only a few times")
+    parser.add_argument("--out", help="Write the results to this json file")
+    parser.add_argument("--compare", help="Compare the results to this json file")
+    parser.add_argument("--threshold", type=float, default=0.1, help="Slowdown that counts as a regression (default: 0.1)")
+    args = parser.parse_args()
+
+    if args.list:
+        print('\n'.join(runner.BENCHMARKS))
+        return
+
+    # Get benchmarks to run
+    names = [name for name in runner.BENCHMARKS if not args.names or any(name.startswith(prefix) for prefix in args.names)]
+    if not names:
+        sys.exit("No benchmarks match")
+
+    # Run
+    print(f"{'Benchmark':<32}{'Min':>12}{'Median':>12}")
+    results = runner.run(names, args.quick)
+
+    if args.out:
+        runner.save(args.out, results)
+
+    if args.compare:
+        if not runner.compare(runner.load(args.compare), {"results": results}, args.threshold):
+            sys.exit(1)
+
+
+# Run
+if __name__ == "__main__":
+    main()
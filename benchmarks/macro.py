@@ -0,0 +1,102 @@
+# macro.py
+# Macro benchmarks of the image pipeline and the checkpoint
+
+
+# Imports
+import os
+import random
+import tempfile
+
+import numpy as np
+from PIL import Image
+
+import src.image as image
+from benchmarks.runner import benchmark
+from src.checkpoint import load_checked_ranges, save_checked_ranges
+from src.ip import IP, ComplexIPrange
+from src.layout import OctetLayout
+
+
+# Definitions
+RESULT_AMOUNT = 1000000
+
+
+def _tile_results() -> list[tuple[IP, bool]]:
+    """Returns random results that all land on the first tile, so only one image has to be in memory"""
+
+    return [(IP(random.randrange(32), random.randrange(256), random.randrange(32), random.randrange(256)), random.random() < 0.1) for _ in range(RESULT_AMOUNT)]
+
+
+def _pix_maps() -> tuple[Image.Image, list]:
+    img = Image.new(mode='RGB', size=(image.TILE_SIZE, image.TILE_SIZE), color=image.BLANK_COLOR)
+    return img, [img.load()] + [None] * (image.TILE_AMOUNT - 1)
+
+
+def _random_tile() -> Image.Image:
+    """Returns a tile with about 10% of pixels responding, which compresses like a real one"""
+
+    pixels = np.random.default_rng(0).random((image.TILE_SIZE, image.TILE_SIZE)) < 0.1
+    array = np.where(pixels[..., None], np.uint8(255), np.uint8(0)).repeat(3, axis=2)
+    return Image.fromarray(array, mode='RGB')
+
+
+@benchmark("write_pix_1m", number=1, repeat=3)
+def _():
+    results = _tile_results()
+    img, pix_maps = _pix_maps()
+    layout = OctetLayout()
+
+    def run():
+        for result in results:
+            image.write_pix(pix_maps, result, layout)
+
+    return run
+
+
+@benchmark("write_pixels_1m", number=1, repeat=3)
+def _():
+    results = _tile_results()
+    indexes = np.array([ip.to_index for ip, _ in results], dtype=np.uint32)
+    responses = np.array([response for _, response in results])
+    img, pix_maps = _pix_maps()
+    layout = OctetLayout()
+    return lambda: image.write_pixels(pix_maps, indexes, responses, layout)
+
+
+@benchmark("tile_save", number=1, repeat=3)
+def _():
+    tile = _random_tile()
+    out_dir = tempfile.TemporaryDirectory()
+    path = os.path.join(out_dir.name, "map1.png")
+    return lambda: image.save(tile, 1, path), out_dir.cleanup
+
+
+@benchmark("tile_load", number=1, repeat=3)
+def _():
+    out_dir = tempfile.TemporaryDirectory()
+    path = os.path.join(out_dir.name, "map1.png")
+    _random_tile().save(path)
+
+    def run():
+        with Image.open(path) as img:
+            img.load()
+
+    return run, out_dir.cleanup
+
+
+@benchmark("checkpoint_roundtrip_16", number=1, repeat=3)
+def _():
+    """A natural /16 is 65536 separate index runs, the checkpoint has to stay linear in them"""
+
+    checked = ComplexIPrange.from_cidrs(["10.0.0.0/16"])
+    out_dir = tempfile.TemporaryDirectory()
+    path = os.path.join(out_dir.name, "checked_ranges.npy")
+    legacy_path = os.path.join(out_dir.name, "checked_ranges.txt")
+
+    def run():
+        save_checked_ranges(checked, path, legacy_path)
+        loaded = load_checked_ranges(path, legacy_path)
+        if not all((new == old).all() for new, old in zip(loaded.to_arrays(), checked.to_arrays())):
+            raise AssertionError("The checkpoint changed the checked ranges")
+
+    return run, out_dir.cleanup
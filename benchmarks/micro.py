@@ -0,0 +1,122 @@
+# micro.py
+# Micro benchmarks of ip.py and global_methods.py
+
+
+# Imports
+import random
+
+from benchmarks.runner import benchmark
+from src.global_methods import flatten_iter, lazy_split, transpose_iter
+from src.ip import IP, ComplexIPrange, IPrange
+
+
+# Definitions
+RANGE_AMOUNT = 300 # Construction is quadratic, so keep this small
+
+
+def _random_ip() -> IP:
+    return IP(*(random.randrange(256) for _ in range(4)))
+
+
+def _disjoint_ranges(amount: int) -> list[IPrange]:
+    """Returns ranges with gaps between them, so they won't merge"""
+
+    ranges = []
+    start = IP(0,0,0,0)
+    for _ in range(amount):
+        start += random.randrange(1, 1000)
+        stop = start + random.randrange(1, 1000)
+        ranges.append(IPrange(start, stop))
+        start = stop
+
+    return ranges
+
+
+def _adjacent_ranges(amount: int) -> list[IPrange]:
+    """Returns ranges that all touch, so they merge into one"""
+
+    ranges = []
+    start = IP(0,0,0,0)
+    for _ in range(amount):
+        stop = start + random.randrange(1, 1000)
+        ranges.append(IPrange(start, stop))
+        start = stop
+
+    return ranges
+
+
+# IP
+@benchmark("ip_add", number=100000)
+def _():
+    ip = _random_ip()
+    return lambda: ip + 123456
+
+
+@benchmark("ip_from_index", number=100000)
+def _():
+    return lambda: IP.from_index(123456789)
+
+
+# IPrange
+@benchmark("iprange_iter_10k", number=10)
+def _():
+    range_ = IPrange(IP(0,0,0,0), IP(0,0,0,0) + 10000)
+    return lambda: [ip for ip in range_]
+
+
+@benchmark("iprange_slice", number=100000)
+def _():
+    range_ = IPrange(IP(0,0,0,0), IP.last_ip)
+    return lambda: range_[1000:2**31]
+
+
+# ComplexIPrange
+@benchmark("complex_construct", number=1, repeat=3)
+def _():
+    ranges = _disjoint_ranges(RANGE_AMOUNT)
+    return lambda: ComplexIPrange(ranges)
+
+
+@benchmark("complex_merge", number=5)
+def _():
+    ranges = _adjacent_ranges(RANGE_AMOUNT)
+    return lambda: ComplexIPrange(ranges, _trust_contain=True)
+
+
+@benchmark("complex_inverted", number=1, repeat=3)
+def _():
+    crange = ComplexIPrange(_disjoint_ranges(RANGE_AMOUNT))
+    return crange.inverted
+
+
+@benchmark("complex_index", number=1000)
+def _():
+    crange = ComplexIPrange(_disjoint_ranges(RANGE_AMOUNT))
+    middle = len(crange) // 2
+    return lambda: crange[middle]
+
+
+@benchmark("complex_contains", number=1000)
+def _():
+    crange = ComplexIPrange(_disjoint_ranges(RANGE_AMOUNT))
+    ip = crange[-1]
+    return lambda: ip in crange
+
+
+# global_methods
+@benchmark("lazy_split_complex", number=3)
+def _():
+    crange = ComplexIPrange(_disjoint_ranges(RANGE_AMOUNT))
+    return lambda: lazy_split(crange, 16)
+
+
+@benchmark("transpose_iter_10k", number=100)
+def _():
+    iter_ = [(random.random(), random.random()) for _ in range(10000)]
+    return lambda: transpose_iter(iter_)
+
+
+@benchmark("flatten_iter_10k", number=100)
+def _():
+    iter_ = [[random.random() for _ in range(100)] for _ in range(100)]
+    return lambda: flatten_iter(iter_)
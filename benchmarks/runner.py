@@ -0,0 +1,147 @@
+# runner.py
+# Registers, runs and compares benchmarks
+
+
+# Imports
+from __future__ import annotations
+
+import json
+import platform
+import random
+import subprocess
+from collections.abc import Callable
+from datetime import datetime
+from statistics import median
+from time import perf_counter
+
+
+# Definitions
+BENCHMARKS = {} # name: (setup, number, repeat)
+
+
+def benchmark(name: str, number: int = 1000, repeat: int = 5) -> Callable:
+    """
+    Registers a benchmark.
+    The decorated function is the setup, it must return the callable to be timed,
+    or the callable and a cleanup that is called after the repeats.
+
+    Usage:
+    >>> @benchmark("ip_add", number=10000)
+    ... def _():
+    ...     ip = IP(1,2,3,4)
+    ...     return lambda: ip + 1
+    """
+
+    def decorator(setup: Callable[[], Callable[[], object]]) -> Callable:
+        BENCHMARKS[name] = (setup, number, repeat)
+        return setup
+
+    return decorator
+
+
+def run(names: list[str], quick: bool = False) -> dict:
+    """
+    Runs benchmarks and returns their results.
+    Every benchmark is seeded the same way, so runs are comparable.
+
+    Parameters:
+        names: list[str] # The names of the benchmarks to run
+        quick: bool = False # Run every benchmark once instead of its full amount
+
+    Returns:
+        dict # The results, keyed by benchmark name
+    """
+
+    results = {}
+    for name in names:
+        setup, number, repeat = BENCHMARKS[name]
+        if quick:
+            number, repeat = max(1, number // 100), 1
+
+        random.seed(0)
+        func = setup()
+        cleanup = None
+        if isinstance(func, tuple):
+            func, cleanup = func
+
+        # Time the repeats
+        times = []
+        try:
+            for _ in range(repeat):
+                start = perf_counter()
+                for _ in range(number):
+                    func()
+                times.append((perf_counter() - start) / number)
+        finally:
+            if cleanup != None:
+                cleanup()
+
+        results[name] = {"min": min(times), "median": median(times), "number": number, "repeat": repeat}
+        print(f"{name:<32}{format_time(min(times)):>12}{format_time(median(times)):>12}")
+
+    return results
+
+
+def metadata() -> dict:
+    """Returns information about the machine and code the benchmarks ran on"""
+
+    try:
+        commit = subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True).stdout.strip() or None
+    except OSError:
+        commit = None
+
+    return {
+        "timestamp": datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "processor": platform.processor(),
+        "commit": commit
+    }
+
+
+def format_time(seconds: float) -> str:
+    """Formats a time with a fitting unit"""
+
+    for unit, scale in (("s", 1), ("ms", 1e-3), ("us", 1e-6)):
+        if seconds >= scale:
+            return f"{seconds / scale:.2f}{unit}"
+
+    return f"{seconds / 1e-9:.2f}ns"
+
+
+def compare(old: dict, new: dict, threshold: float = 0.1) -> bool:
+    """
+    Prints how the new results compare to the old ones
+
+    Parameters:
+        old: dict # The old results file contents
+        new: dict # The new results file contents
+        threshold: float = 0.1 # A slowdown bigger than this fraction is a regression
+
+    Returns:
+        bool # If there were no regressions
+    """
+
+    ok = True
+    print(f"\n{'Benchmark':<32}{'Old':>12}{'New':>12}{'Change':>10}")
+    for name, result in new["results"].items():
+        if name not in old["results"]:
+            continue
+
+        old_time = old["results"][name]["min"]
+        change = result["min"] / old_time - 1
+        regressed = change > threshold
+        ok = ok and not regressed
+        print(f"{name:<32}{format_time(old_time):>12}{format_time(result['min']):>12}{change:>+10.1%}{'  REGRESSION' if regressed else ''}")
+
+    return ok
+
+
+def save(path: str, results: dict) -> None:
+    with open(path, 'wt') as file:
+        json.dump({"meta": metadata(), "results": results}, file, indent=4)
+
+
+def load(path: str) -> dict:
+    with open(path, 'rt') as file:
+        return json.load(file)
@@ -6,10 +6,21 @@
 
 
 # Imports
-import src.mapper
-import src.reset_submaps
-import src.settings
-import src.stitch
+import sys
+
+import src.cluster as cluster
+import src.diff as diff
+import src.export as export
+import src.ingest as ingest
+import src.mapper as mapper
+import src.pool as pool
+import src.query as query
+import src.refresh as refresh
+import src.render as render
+import src.reset_submaps as reset_submaps
+import src.settings as settings
+import src.stitch as stitch
+import src.targets as targets
 
 
 # Definitions
@@ -18,10 +29,23 @@ Please select one of the following options:
 1) Map IPs
 2) Stitch Map together
 3) Reset all maps
-4) Change settings"""
+4) Change settings
+5) Render latency map
+6) Refresh responsive space
+7) Diff two scans
+8) Start query server
+9) Ping a target list
+10) Import results
+11) Export responding IPs
+12) Coordinate workers
+13) Work for a coordinator
+14) Map IPs with worker processes"""
 
 
 def main() -> None:
+    # Profile the run if asked to
+    profile = "--profile" in sys.argv
+
     # Print greeting and get command
     print(START_MESSAGE)
     inp = input()
@@ -32,19 +56,70 @@ def main() -> None:
         # Mapper
         case '1':
             settings_ = settings.load_settings()
-            mapper.main(settings_)
+            mapper.main(settings_, profile)
         
         # Stitch
         case '2':
-            stitch.main()
+            stitch.main(profile)
         
         # Reset submaps
         case '3':
-            reset_submaps.main()
+            reset_submaps.main(profile)
 
         # Change settings
         case '4':
             settings.main()
+
+        # Render latency map
+        case '5':
+            render.main("latency", profile)
+
+        # Refresh responsive space
+        case '6':
+            refresh.main(profile)
+
+        # Diff two scans
+        case '7':
+            old = input("Old result store or maps directory: ")
+            new = input("New result store or maps directory: ")
+            diff.main(old, new, profile)
+
+        # Query server
+        case '8':
+            query.main()
+
+        # Target list
+        case '9':
+            path = input("Target list file, - for stdin: ")
+            targets.main(path, profile)
+
+        # Import results
+        case '10':
+            format_ = input(f"Format ({', '.join(ingest.FORMATS)}): ")
+            path = input("File, - for stdin: ")
+            checked = input("CIDR blocks or a file of them the scan covered, blank for none: ").split()
+            ingest.main(format_, path, checked, profile)
+
+        # Export responding IPs
+        case '11':
+            format_ = input(f"Format ({', '.join(export.FORMATS)}): ")
+            path = input("File, - for stdout: ")
+            cidrs = input("Only these CIDR blocks, blank for all: ").split()
+            export.main(format_, path, cidrs)
+
+        # Coordinator
+        case '12':
+            cidrs = input("Only these CIDR blocks, blank for everything not checked yet: ").split()
+            cluster.main(["coordinator", *cidrs])
+
+        # Worker
+        case '13':
+            address = input("Coordinator host:port or Unix socket: ")
+            cluster.main(["worker", address])
+
+        # Process pool mapper
+        case '14':
+            pool.main(profile)
         
         case other:
             print("Invalid command")
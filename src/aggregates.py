@@ -0,0 +1,191 @@
+# aggregates.py
+# Counts of responding IPs per /8, /16 and /24, kept up to date as results are written to the result store
+# Saved next to the checkpoint, so summaries never need the maps decoded
+
+
+# Imports
+from __future__ import annotations
+
+import csv
+import json
+import os
+import sys
+
+import numpy as np
+
+from src.cidr import format_cidr
+from src.layout import index_to_natural
+from src.store import NO_RESPONSE, SCAN_CHUNK, ResultStore
+
+
+# Definitions
+AGGREGATES_PATH = "aggregates.npz"
+PREFIX_LENGTHS = (8, 16, 24)
+
+
+def prefix_name(prefix: int, prefix_length: int) -> str:
+    """
+    Returns the CIDR name of a prefix
+
+    Usage:
+    >>> prefix_name(0x010203, 24)
+    '1.2.3.0/24'
+    """
+
+    return format_cidr(prefix << (32 - prefix_length), prefix_length)
+
+
+class PrefixCounts:
+    """
+    Responding IPs per /8, /16 and /24.
+    The /24 counts use uint16 to keep them at 32MB.
+
+    Usage:
+    >>> counts = PrefixCounts.load()
+    >>> old = store.write(indexes, buckets)
+    >>> counts.update(indexes, old, buckets)
+    >>> counts.counts[8][1]
+    1204
+    """
+
+    def __init__(self, counts: dict[int, np.ndarray] | None = None) -> None:
+        """
+        Parameters:
+            counts: dict[int, np.ndarray] | None = None # The counts per prefix length, empty if None
+        """
+
+        if counts == None:
+            counts = {
+                8: np.zeros(256, dtype=np.uint32),
+                16: np.zeros(65536, dtype=np.uint32),
+                24: np.zeros(1 << 24, dtype=np.uint16)
+            }
+
+        self.counts = counts
+
+
+    def _add(self, naturals: np.ndarray, amount: int) -> None:
+        """Adds an amount to the prefixes of every natural order IP, negative amounts wrap around to a subtract"""
+
+        # bincount is fastest for the small arrays, the /24 array is too large to bincount every batch
+        for prefix_length in (8, 16):
+            counts = np.bincount(naturals >> np.uint32(32 - prefix_length), minlength=1 << prefix_length)
+            self.counts[prefix_length] += (counts * amount).astype(np.uint32)
+
+        blocks, counts = np.unique(naturals >> np.uint32(8), return_counts=True)
+        self.counts[24][blocks] += (counts * amount).astype(np.uint16)
+
+
+    def update(self, indexes: np.ndarray, old_buckets: np.ndarray, new_buckets: np.ndarray) -> None:
+        """
+        Updates the counts for a batch of writes to the result store
+
+        Parameters:
+            indexes: np.ndarray # The written IP indexes, without duplicates
+            old_buckets: np.ndarray # The buckets before the write, returned by ResultStore.write
+            new_buckets: np.ndarray # The written buckets
+        """
+
+        old_responded = np.asarray(old_buckets) != NO_RESPONSE
+        new_responded = np.asarray(new_buckets) != NO_RESPONSE
+        naturals = index_to_natural(np.asarray(indexes, dtype=np.uint32))
+
+        self._add(naturals[new_responded & ~old_responded], 1)
+        self._add(naturals[old_responded & ~new_responded], -1)
+
+
+    @staticmethod
+    def from_store(store: ResultStore) -> PrefixCounts:
+        """Counts everything in a result store, for stores from before the counts were kept"""
+
+        counts = PrefixCounts()
+        for start in range(0, len(store.rtts), SCAN_CHUNK):
+            indexes = np.flatnonzero(store.read(start, start + SCAN_CHUNK) != NO_RESPONSE).astype(np.uint32) + np.uint32(start)
+            if len(indexes) > 0:
+                counts._add(index_to_natural(indexes), 1)
+
+        return counts
+
+
+    @staticmethod
+    def load(path: str = AGGREGATES_PATH, store: ResultStore | None = None) -> PrefixCounts:
+        """
+        Loads the saved counts
+
+        Parameters:
+            path: str = AGGREGATES_PATH # The saved counts
+            store: ResultStore | None = None # Counted instead if there are no saved counts, otherwise the counts start empty
+        """
+
+        try:
+            with np.load(path) as data:
+                return PrefixCounts({prefix_length: data[f"prefix{prefix_length}"] for prefix_length in PREFIX_LENGTHS})
+        except FileNotFoundError:
+            return PrefixCounts() if store == None else PrefixCounts.from_store(store)
+
+
+    def save(self, path: str = AGGREGATES_PATH) -> None:
+        """Atomically saves the counts"""
+
+        tmp_path = path + ".tmp.npz"
+        np.savez(tmp_path, **{f"prefix{prefix_length}": counts for prefix_length, counts in self.counts.items()})
+        os.replace(tmp_path, path)
+
+
+    def nonzero(self, prefix_length: int) -> tuple[np.ndarray, np.ndarray]:
+        """Returns the prefixes where something responded and their counts"""
+
+        prefixes = np.flatnonzero(self.counts[prefix_length])
+        return prefixes, self.counts[prefix_length][prefixes]
+
+
+    def to_csv(self, path: str, prefix_length: int = 24) -> None:
+        """Writes the counts of every prefix where something responded to a csv"""
+
+        with open(path, 'wt', newline='') as file:
+            writer = csv.writer(file)
+            writer.writerow(("prefix", "responded"))
+            writer.writerows((prefix_name(prefix, prefix_length), count) for prefix, count in zip(*(array.tolist() for array in self.nonzero(prefix_length))))
+
+
+    def to_json(self, path: str, prefix_length: int = 24) -> None:
+        """Writes the counts of every prefix where something responded to a json object"""
+
+        with open(path, 'wt') as file:
+            json.dump({prefix_name(prefix, prefix_length): count for prefix, count in zip(*(array.tolist() for array in self.nonzero(prefix_length)))}, file, indent=4)
+
+
+def reset_aggregates(path: str = AGGREGATES_PATH) -> None:
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+def main(args: list[str]) -> None:
+    """
+    Command line interface
+
+    Usage:
+    python -m src.aggregates rebuild
+    python -m src.aggregates csv <8|16|24> <path>
+    python -m src.aggregates json <8|16|24> <path>
+    """
+
+    match args:
+        case ["rebuild"]:
+            PrefixCounts.from_store(ResultStore(readonly=True)).save()
+
+        case ["csv", prefix_length, path]:
+            PrefixCounts.load().to_csv(path, int(prefix_length))
+
+        case ["json", prefix_length, path]:
+            PrefixCounts.load().to_json(path, int(prefix_length))
+
+        case other:
+            print(main.__doc__)
+
+
+# Run
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,130 @@
+# bitmap.py
+# A compact set of IP indexes
+# The index space is split into chunks of 65536 indexes, and only chunks that hold something take memory (8KB each)
+
+
+# Imports
+from __future__ import annotations
+
+from collections.abc import Iterator
+
+import numpy as np
+
+
+# Definitions
+CHUNK_BITS = 16
+CHUNK_SIZE = 1 << CHUNK_BITS
+CHUNK_BYTES = CHUNK_SIZE // 8
+
+
+def _split_by_chunk(indexes: np.ndarray) -> Iterator[tuple[int, np.ndarray]]:
+    """Yields each chunk number with the offsets inside it, for sorted indexes"""
+
+    chunks = indexes >> np.uint32(CHUNK_BITS)
+    bounds = np.flatnonzero(np.diff(chunks)) + 1
+    for start, stop in zip(np.concatenate(([0], bounds)), np.concatenate((bounds, [len(indexes)]))):
+        if start == stop:
+            continue
+        yield int(chunks[start]), indexes[start:stop] & np.uint32(CHUNK_SIZE - 1)
+
+
+class IndexBitmap:
+    """
+    A set of IP indexes stored as a sparse bitmap
+
+    Usage:
+    >>> bitmap = IndexBitmap()
+    >>> bitmap.add(np.array([IP(1,1,1,1).to_index, IP(2,2,2,2).to_index]))
+    >>> len(bitmap)
+    2
+    >>> IP(1,1,1,1).to_index in bitmap
+    True
+    """
+
+    def __init__(self, indexes: np.ndarray | None = None) -> None:
+        self._chunks = {} # Chunk number: packed bits
+
+        if indexes is not None:
+            self.add(indexes)
+
+
+    def _set(self, indexes: np.ndarray, value: bool) -> None:
+        indexes = np.sort(np.asarray(indexes, dtype=np.uint32))
+
+        for chunk, offsets in _split_by_chunk(indexes):
+            if chunk not in self._chunks:
+                if not value:
+                    continue
+                self._chunks[chunk] = np.zeros(CHUNK_BYTES, dtype=np.uint8)
+
+            bits = np.unpackbits(self._chunks[chunk], bitorder='little')
+            bits[offsets] = value
+            if bits.any():
+                self._chunks[chunk] = np.packbits(bits, bitorder='little')
+            else:
+                del self._chunks[chunk]
+
+
+    def add(self, indexes: np.ndarray) -> None:
+        """Adds indexes to the set"""
+
+        self._set(indexes, True)
+
+
+    def remove(self, indexes: np.ndarray) -> None:
+        """Removes indexes from the set, indexes that are not in it are ignored"""
+
+        self._set(indexes, False)
+
+
+    def contains(self, indexes: np.ndarray) -> np.ndarray:
+        """Returns a bool array of which indexes are in the set"""
+
+        indexes = np.asarray(indexes, dtype=np.uint32)
+        out = np.zeros(indexes.shape, dtype=bool)
+        order = np.argsort(indexes, kind='stable')
+
+        position = 0
+        for chunk, offsets in _split_by_chunk(indexes[order]):
+            if chunk in self._chunks:
+                bits = self._chunks[chunk]
+                out[order[position:position + len(offsets)]] = (bits[offsets >> np.uint32(3)] >> (offsets & np.uint32(7)).astype(np.uint8)) & 1
+            position += len(offsets)
+
+        return out
+
+
+    def __contains__(self, index: int) -> bool:
+        bits = self._chunks.get(index >> CHUNK_BITS)
+        if bits is None:
+            return False
+
+        offset = index & (CHUNK_SIZE - 1)
+        return bool((bits[offset >> 3] >> (offset & 7)) & 1)
+
+
+    def __len__(self) -> int:
+        return sum(int(np.unpackbits(bits).sum()) for bits in self._chunks.values())
+
+
+    def __bool__(self) -> bool:
+        return bool(self._chunks)
+
+
+    def to_indexes(self) -> np.ndarray:
+        """Returns every index in the set, sorted"""
+
+        if not self._chunks:
+            return np.zeros(0, dtype=np.uint32)
+
+        return np.concatenate([
+            np.flatnonzero(np.unpackbits(self._chunks[chunk], bitorder='little')).astype(np.uint32) + np.uint32(chunk << CHUNK_BITS)
+            for chunk in sorted(self._chunks)
+        ])
+
+
+    @property
+    def nbytes(self) -> int:
+        """Memory used by the bits"""
+
+        return len(self._chunks) * CHUNK_BYTES
@@ -0,0 +1,118 @@
+# checkpoint.py
+# Reading and writing the checked ranges checkpoint
+
+
+# Imports
+import os
+import re
+
+import numpy as np
+
+from src.cidr import merge_intervals
+from src.ip import ComplexIPrange, IPrange
+
+
+# Definitions
+CHECKED_RANGES_PATH = "checked_ranges.npy" # The start and stop index of every range, a (n, 2) uint64 array
+LEGACY_CHECKED_RANGES_PATH = "checked_ranges.txt" # The repr of the checked ranges, from before the array checkpoint
+
+# An IP in the repr of a range, its octets are a, b, c and d
+_IP_PATTERN = re.compile(rb"IP\((\d+),\s*(\d+),\s*(\d+),\s*(\d+)\)")
+
+
+def load_checked_ranges(path: str = CHECKED_RANGES_PATH, legacy_path: str = LEGACY_CHECKED_RANGES_PATH) -> ComplexIPrange | None:
+    """
+    Loads the checked ranges from the checkpoint file in O(n), an old text checkpoint is read if there is no array one
+
+    Parameters:
+        path: str = CHECKED_RANGES_PATH # The checkpoint file
+        legacy_path: str = LEGACY_CHECKED_RANGES_PATH # The old text checkpoint file
+
+    Returns:
+        ComplexIPrange | None # The checked ranges, or None if nothing was checked yet
+    """
+
+    try:
+        table = np.load(path)
+    except FileNotFoundError:
+        return _load_legacy_checked_ranges(legacy_path)
+    except ValueError:
+        return None
+
+    return ComplexIPrange.from_arrays(table[:, 0], table[:, 1])
+
+
+def _load_legacy_checked_ranges(path: str) -> ComplexIPrange | None:
+    """
+    Loads a text checkpoint.
+    The repr is parsed into index arrays instead of evaluated, building the ranges one by one is quadratic
+    and natural CIDR blocks are thousands of ranges in index order.
+    """
+
+    try:
+        with open(path, 'rb') as file:
+            text = file.read()
+    except FileNotFoundError:
+        return None
+
+    if not text.startswith((b"IPrange(", b"ComplexIPrange(")):
+        return None
+
+    octets = np.array(_IP_PATTERN.findall(text), dtype=np.uint64).reshape(-1, 4)
+    if len(octets) % 2 != 0:
+        return None
+
+    # Same order as IP.to_index
+    indexes = octets[:, 1] + (octets[:, 0] << np.uint64(8)) + (octets[:, 3] << np.uint64(16)) + (octets[:, 2] << np.uint64(24))
+    return ComplexIPrange.from_arrays(*merge_intervals(indexes[0::2], indexes[1::2]))
+
+
+def save_checked_ranges(checked_ranges: IPrange | ComplexIPrange | None, path: str = CHECKED_RANGES_PATH, legacy_path: str = LEGACY_CHECKED_RANGES_PATH) -> None:
+    """
+    Atomically writes the checked ranges to the checkpoint file.
+    The checkpoint is written to a temporary file first and then moved over the old one,
+    so an interrupted write never leaves a half written checkpoint behind.
+
+    Parameters:
+        checked_ranges: IPrange | ComplexIPrange | None # The checked ranges, None resets the checkpoint
+        path: str = CHECKED_RANGES_PATH # The checkpoint file
+        legacy_path: str = LEGACY_CHECKED_RANGES_PATH # The old text checkpoint file, removed once the new one is written
+    """
+
+    if checked_ranges == None:
+        for old_path in (path, legacy_path):
+            try:
+                os.remove(old_path)
+            except FileNotFoundError:
+                pass
+        return
+
+    tmp_path = path + ".tmp"
+    with open(tmp_path, 'wb') as file:
+        np.save(file, np.stack(checked_ranges.to_arrays(), axis=1).astype(np.uint64))
+        file.flush()
+        os.fsync(file.fileno())
+
+    os.replace(tmp_path, path)
+
+    # The array checkpoint replaces the text one
+    try:
+        os.remove(legacy_path)
+    except FileNotFoundError:
+        pass
+
+
+def add_checked_ranges(checked_ranges: ComplexIPrange | None, new: IPrange | ComplexIPrange) -> ComplexIPrange:
+    """
+    Returns the checked ranges with new ranges added, the new ranges may overlap the checked ones
+
+    Parameters:
+        checked_ranges: ComplexIPrange | None # The checked ranges, None if nothing was checked yet
+        new: IPrange | ComplexIPrange # The ranges to add
+    """
+
+    if checked_ranges == None:
+        return ComplexIPrange.from_arrays(*merge_intervals(*new.to_arrays()))
+
+    (checked_starts, checked_stops), (new_starts, new_stops) = checked_ranges.to_arrays(), new.to_arrays()
+    return ComplexIPrange.from_arrays(*merge_intervals(np.concatenate((checked_starts, new_starts)), np.concatenate((checked_stops, new_stops))))
@@ -0,0 +1,395 @@
+# cidr.py
+# CIDR blocks in the index order of IP.to_index
+# An index is the natural IP value rotated by 16 bits, so seen as a 65536 x 65536 grid
+# (row = the last two octets, column = the first two octets), every CIDR block is a rectangle of the grid
+
+
+# Imports
+from __future__ import annotations
+
+from collections.abc import Iterator
+from typing import BinaryIO
+
+import numpy as np
+
+
+# Definitions
+GRID_SIZE = 65536
+
+
+def parse_cidr(text: str) -> tuple[int, int]:
+    """
+    Parses a CIDR block, a lone IP is a /32
+
+    Parameters:
+        text: str # The CIDR block, like "10.0.0.0/8"
+
+    Returns:
+        tuple[int, int] # The natural value of the first IP and the prefix length
+
+    Raises:
+        ValueError # If the text is not a CIDR block or has host bits set
+
+    Usage:
+    >>> parse_cidr("10.0.0.0/8")
+    (167772160, 8)
+    """
+
+    address, _, prefix_length = text.strip().partition('/')
+    octets = address.split('.')
+    if len(octets) != 4 or not all(octet.isdigit() and int(octet) < 256 for octet in octets):
+        raise ValueError(f"Invalid IP: {address!r}")
+
+    prefix_length = int(prefix_length) if prefix_length else 32
+    if not 0 <= prefix_length <= 32:
+        raise ValueError(f"Invalid prefix length: /{prefix_length}")
+
+    natural = int(octets[0]) << 24 | int(octets[1]) << 16 | int(octets[2]) << 8 | int(octets[3])
+    if natural & ((1 << (32 - prefix_length)) - 1):
+        raise ValueError(f"{text} has host bits set")
+
+    return natural, prefix_length
+
+
+def cidr_size(prefix_length: int) -> int:
+    return 1 << (32 - prefix_length)
+
+
+def cidr_rect(natural: int, prefix_length: int) -> tuple[slice, slice]:
+    """
+    Returns the rows and columns a CIDR block covers in the index grid
+
+    Usage:
+    >>> grid = store.rtts.reshape(GRID_SIZE, GRID_SIZE)
+    >>> grid[cidr_rect(*parse_cidr("10.0.0.0/8"))]
+    """
+
+    high, low = natural >> 16, natural & 0xFFFF
+
+    # Blocks of /16 or larger cover whole columns, smaller blocks part of one column
+    if prefix_length <= 16:
+        return slice(0, GRID_SIZE), slice(high, high + (1 << (16 - prefix_length)))
+    else:
+        return slice(low, low + (1 << (32 - prefix_length))), slice(high, high + 1)
+
+
+def rect_indexes(rows: slice, columns: slice, row_offsets: np.ndarray, column_offsets: np.ndarray) -> np.ndarray:
+    """Returns the indexes of cells of a rectangle of the index grid, given their offsets inside it"""
+
+    return (np.asarray(row_offsets, dtype=np.uint32) + np.uint32(rows.start)) << np.uint32(16) | (np.asarray(column_offsets, dtype=np.uint32) + np.uint32(columns.start))
+
+
+def format_cidr(natural: int, prefix_length: int) -> str:
+    """
+    Returns the text of a CIDR block
+
+    Usage:
+    >>> format_cidr(167772160, 8)
+    '10.0.0.0/8'
+    """
+
+    return f"{natural >> 24}.{natural >> 16 & 255}.{natural >> 8 & 255}.{natural & 255}/{prefix_length}"
+
+
+# Every octet as text, zero padded, and its length
+_OCTET_TEXT = np.array([list(str(octet).encode().ljust(3, b"\0")) for octet in range(256)], dtype=np.uint8)
+_OCTET_LENGTHS = np.array([len(str(octet)) for octet in range(256)], dtype=np.int64)
+
+
+def parse_dotted(fields: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Parses a matrix of zero padded dotted IPs, one per row
+
+    Returns:
+        tuple[np.ndarray, np.ndarray] # The uint32 natural values and which rows were valid IPs
+
+    Usage:
+    >>> parse_dotted(np.array([b"1.2.3.4", b"300.1.1.1"], dtype="S10").view(np.uint8).reshape(2, 10))
+    (array([16909060, 0], dtype=uint32), array([ True, False]))
+    """
+
+    rows = np.arange(len(fields))
+    is_digit = (fields >= ord('0')) & (fields <= ord('9'))
+    is_dot = fields == ord('.')
+    octet_of = np.cumsum(is_dot, axis=1)
+    valid = ((is_digit | is_dot | (fields == 0)).all(axis=1)) & (octet_of[:, -1] == 3)
+
+    # Add up the digits column by column
+    octets = np.zeros((len(fields), 4), dtype=np.int64)
+    digits = np.zeros((len(fields), 4), dtype=np.int64)
+    for column in range(fields.shape[1]):
+        digit = is_digit[:, column] & valid
+        octet = np.minimum(octet_of[digit, column], 3)
+        octets[rows[digit], octet] = octets[rows[digit], octet] * 10 + (fields[digit, column] - ord('0'))
+        digits[rows[digit], octet] += 1
+
+    valid &= (digits >= 1).all(axis=1) & (digits <= 3).all(axis=1) & (octets <= 255).all(axis=1)
+    naturals = octets[:, 0] << 24 | octets[:, 1] << 16 | octets[:, 2] << 8 | octets[:, 3]
+    return np.where(valid, naturals, 0).astype(np.uint32), valid
+
+
+def dotted_parts(naturals: np.ndarray) -> list[tuple[np.ndarray, np.ndarray] | bytes]:
+    """Returns the parts of the dotted text of IPs, see join_parts"""
+
+    naturals = np.asarray(naturals, dtype=np.uint32)
+    parts = []
+    for shift in (24, 16, 8, 0):
+        octets = (naturals >> np.uint32(shift)) & np.uint32(255)
+        parts += [(_OCTET_TEXT[octets], _OCTET_LENGTHS[octets]), b"."]
+
+    return parts[:-1]
+
+
+def join_parts(parts: list[tuple[np.ndarray, np.ndarray] | bytes], amount: int) -> bytes:
+    """
+    Joins columns of text into one line per row, all at once
+
+    Parameters:
+        parts: list[tuple[np.ndarray, np.ndarray] | bytes] # Text the same for every row, or a (rows, width) matrix and the length of each row's text
+        amount: int # The amount of rows
+
+    Returns:
+        bytes # The joined text of every row, one after the other
+
+    Usage:
+    >>> join_parts(dotted_parts(np.array([16909060, 134744072])) + [b"\n"], 2)
+    b'1.2.3.4\n8.8.8.8\n'
+    """
+
+    chars, masks = [], []
+    for part in parts:
+        if isinstance(part, bytes):
+            chars.append(np.broadcast_to(np.frombuffer(part, dtype=np.uint8), (amount, len(part))))
+            masks.append(np.ones((amount, len(part)), dtype=bool))
+        else:
+            part_chars, lengths = part
+            chars.append(part_chars)
+            masks.append(np.arange(part_chars.shape[1])[None, :] < lengths[:, None])
+
+    return np.hstack(chars)[np.hstack(masks)].tobytes()
+
+
+def parse_cidr_lines(data: bytes, first_line: int = 1) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Parses lines of CIDR blocks or lone IPs all at once.
+    Blank lines and everything after a # are ignored.
+
+    Parameters:
+        data: bytes # The lines
+        first_line: int = 1 # The line number of the first line, for errors
+
+    Returns:
+        tuple[np.ndarray, np.ndarray] # The uint32 natural values of the first IPs and the uint8 prefix lengths
+
+    Raises:
+        ValueError # If a line is not a CIDR block or an IP, or has host bits set
+
+    Usage:
+    >>> parse_cidr_lines(b"10.0.0.0/8\\n# Comment\\n1.1.1.1\\n")
+    (array([167772160,  16843009], dtype=uint32), array([ 8, 32], dtype=uint8))
+    """
+
+    chars = np.frombuffer(data, dtype=np.uint8)
+    if len(chars) == 0:
+        return np.zeros(0, dtype=np.uint32), np.zeros(0, dtype=np.uint8)
+    if chars[-1] != ord('\n'):
+        chars = np.append(chars, np.uint8(ord('\n')))
+
+    newline = chars == ord('\n')
+    line_of = np.cumsum(newline) - newline
+    line_amount = int(line_of[-1]) + 1
+
+    def error(line: int, message: str) -> ValueError:
+        return ValueError(f"Line {first_line + line}: {message}")
+
+    # Blank out comments
+    hashes = np.flatnonzero(chars == ord('#'))
+    if len(hashes) > 0:
+        comment_start = np.full(line_amount, len(chars))
+        np.minimum.at(comment_start, line_of[hashes], hashes)
+        chars = np.where((np.arange(len(chars)) >= comment_start[line_of]) & ~newline, np.uint8(ord(' ')), chars)
+
+    is_digit = (chars >= ord('0')) & (chars <= ord('9'))
+    is_dot = chars == ord('.')
+    is_slash = chars == ord('/')
+    bad = ~(is_digit | is_dot | is_slash | newline | (chars == ord(' ')) | (chars == ord('\t')) | (chars == ord('\r')))
+    if bad.any():
+        raise error(int(line_of[bad.argmax()]), f"Invalid character {chr(chars[bad.argmax()])!r}")
+
+    # Get the value of every run of digits
+    digit_positions = np.flatnonzero(is_digit)
+    starts_run = is_digit & ~np.concatenate(([False], is_digit[:-1]))
+    run_of_digit = (np.cumsum(starts_run) - 1)[digit_positions]
+    run_lengths = np.bincount(run_of_digit)
+    if len(run_lengths) > 0 and run_lengths.max() > 3:
+        run = int(run_lengths.argmax())
+        raise error(int(line_of[digit_positions[run_of_digit == run][0]]), "Number too long")
+
+    run_ends = np.cumsum(run_lengths)
+    from_end = run_ends[run_of_digit] - 1 - np.arange(len(digit_positions))
+    values = np.bincount(run_of_digit, weights=(chars[digit_positions] - ord('0')) * 10.0 ** from_end).astype(np.int64)
+
+    # Group the runs by line
+    run_starts = digit_positions[run_ends - run_lengths]
+    run_stops = digit_positions[run_ends - 1] + 1
+    run_lines = line_of[run_starts]
+    tokens = np.bincount(run_lines, minlength=line_amount)
+    dots = np.bincount(line_of[is_dot], minlength=line_amount)
+    slashes = np.bincount(line_of[is_slash], minlength=line_amount)
+    is_ip = (tokens == 4) & (dots == 3) & (slashes == 0)
+    is_block = (tokens == 5) & (dots == 3) & (slashes == 1)
+    is_blank = (tokens == 0) & (dots == 0) & (slashes == 0)
+    if not (is_ip | is_block | is_blank).all():
+        raise error(int(np.argmin(is_ip | is_block | is_blank)), "Not an IP or CIDR block")
+
+    # Every number has to be followed right away by the right separator
+    token_of_run = np.arange(len(run_lines)) - (np.cumsum(tokens) - tokens)[run_lines]
+    inner = token_of_run < tokens[run_lines] - 1
+    expected = np.where(token_of_run[inner] < 3, ord('.'), ord('/'))
+    following = np.flatnonzero(inner)
+    in_place = (chars[run_stops[following]] == expected) & (run_starts[following + 1] == run_stops[following] + 1)
+    if not in_place.all():
+        raise error(int(run_lines[following[np.argmin(in_place)]]), "Not an IP or CIDR block")
+
+    # Build the blocks
+    first_runs = (np.cumsum(tokens) - tokens)[~is_blank]
+    octets = values[first_runs[:, None] + np.arange(4)[None, :]]
+    prefix_lengths = np.where(is_block[~is_blank], values[np.minimum(first_runs + 4, len(values) - 1)], 32)
+    lines = np.flatnonzero(~is_blank)
+
+    if (octets > 255).any():
+        raise error(int(lines[(octets > 255).any(axis=1).argmax()]), "Octet out of range")
+    if (prefix_lengths > 32).any():
+        raise error(int(lines[(prefix_lengths > 32).argmax()]), "Prefix length out of range")
+
+    naturals = (octets[:, 0] << 24 | octets[:, 1] << 16 | octets[:, 2] << 8 | octets[:, 3]).astype(np.uint64)
+    host_bits = naturals & ((np.uint64(1) << (32 - prefix_lengths).astype(np.uint64)) - np.uint64(1))
+    if host_bits.any():
+        raise error(int(lines[np.flatnonzero(host_bits)[0]]), "Host bits set")
+
+    return naturals.astype(np.uint32), prefix_lengths.astype(np.uint8)
+
+
+def iter_line_chunks(file: BinaryIO, chunk_size: int = 1 << 24) -> Iterator[tuple[bytes, int]]:
+    """Yields chunks of whole lines of a binary file, with the line number of the first line of each chunk"""
+
+    leftover = b""
+    line = 1
+    while chunk := file.read(chunk_size):
+        data = leftover + chunk
+        end = data.rfind(b"\n") + 1
+        data, leftover = data[:end], data[end:]
+        if data:
+            yield data, line
+            line += data.count(b"\n")
+
+    if leftover:
+        yield leftover, line
+
+
+def iter_cidr_file(file: BinaryIO, chunk_size: int = 1 << 24) -> Iterator[tuple[np.ndarray, np.ndarray]]:
+    """Parses a binary file of CIDR blocks or IPs chunk by chunk, see parse_cidr_lines"""
+
+    for data, line in iter_line_chunks(file, chunk_size):
+        yield parse_cidr_lines(data, line)
+
+
+def cidrs_to_intervals(naturals: np.ndarray, prefix_lengths: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """Returns the half open natural intervals of CIDR blocks, as uint64 so the last stop fits"""
+
+    starts = np.asarray(naturals, dtype=np.uint64)
+    return starts, starts + (np.uint64(1) << (32 - np.asarray(prefix_lengths, dtype=np.uint64)))
+
+
+def merge_intervals(starts: np.ndarray, stops: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """Sorts half open intervals and merges the ones that overlap or touch"""
+
+    if len(starts) == 0:
+        return np.zeros(0, dtype=np.uint64), np.zeros(0, dtype=np.uint64)
+
+    order = np.argsort(starts, kind='stable')
+    starts, stops = np.asarray(starts, dtype=np.uint64)[order], np.asarray(stops, dtype=np.uint64)[order]
+    reach = np.maximum.accumulate(stops)
+    new = np.concatenate(([True], starts[1:] > reach[:-1]))
+    return starts[new], np.maximum.reduceat(stops, np.flatnonzero(new))
+
+
+def rotate_intervals(starts: np.ndarray, stops: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Turns half open natural intervals into index intervals, or index intervals into natural intervals.
+    Both orders are the other rotated by 16 bits, so it's the same operation.
+    In the grid, an interval is up to three rectangles of whole columns, which turn into a run per row.
+
+    Returns:
+        tuple[np.ndarray, np.ndarray] # The sorted and merged uint64 intervals
+    """
+
+    starts, stops = merge_intervals(starts, stops)
+    lasts = stops - np.uint64(1)
+    start_highs, start_lows = starts >> np.uint64(16), starts & np.uint64(0xFFFF)
+    last_highs, last_lows = lasts >> np.uint64(16), lasts & np.uint64(0xFFFF)
+    single = start_highs == last_highs
+    max_low = np.uint64(0xFFFF)
+
+    # Split the intervals into rectangles of rows first_low..last_low and columns first_high..last_high
+    middle_firsts = start_highs + (start_lows > 0)
+    middle_lasts = last_highs - (last_lows < max_low)
+    head = ~single & (start_lows > 0)
+    tail = ~single & (last_lows < max_low)
+    middle = ~single & (middle_firsts <= middle_lasts)
+    first_lows = np.concatenate((start_lows[single], start_lows[head], np.zeros(int(tail.sum()), dtype=np.uint64), np.zeros(int(middle.sum()), dtype=np.uint64)))
+    last_lows = np.concatenate((last_lows[single], np.full(int(head.sum()), max_low), last_lows[tail], np.full(int(middle.sum()), max_low)))
+    first_highs = np.concatenate((start_highs[single], start_highs[head], last_highs[tail], middle_firsts[middle]))
+    last_highs = np.concatenate((start_highs[single], start_highs[head], last_highs[tail], middle_lasts[middle]))
+
+    # Rectangles with the same rows and neighbouring columns are one rectangle
+    keys = (first_lows << np.uint64(16) | last_lows) << np.uint64(17)
+    rect_starts, rect_stops = merge_intervals(keys | first_highs, keys | (last_highs + np.uint64(1)))
+    first_lows, last_lows = rect_starts >> np.uint64(33), rect_starts >> np.uint64(17) & max_low
+    first_highs, stop_highs = rect_starts & np.uint64(0x1FFFF), rect_stops & np.uint64(0x1FFFF)
+
+    # Every row of a rectangle is a run, a few rectangles at a time to bound memory
+    heights = (last_lows - first_lows + np.uint64(1)).astype(np.int64)
+    out_starts, out_stops = [], []
+    for first in range(0, len(heights), 256):
+        part = slice(first, first + 256)
+        repeats = heights[part]
+        rows = np.repeat(first_lows[part], repeats) + (np.arange(int(repeats.sum())) - np.repeat(np.cumsum(repeats) - repeats, repeats)).astype(np.uint64)
+        out_starts.append(rows << np.uint64(16) | np.repeat(first_highs[part], repeats))
+        out_stops.append((rows << np.uint64(16)) + np.repeat(stop_highs[part], repeats))
+
+    if not out_starts:
+        return starts, stops
+
+    return merge_intervals(np.concatenate(out_starts), np.concatenate(out_stops))
+
+
+def intervals_to_cidrs(starts: np.ndarray, stops: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Splits half open natural intervals into the fewest CIDR blocks
+
+    Returns:
+        tuple[np.ndarray, np.ndarray] # The uint32 natural values of the first IPs and the uint8 prefix lengths, sorted
+    """
+
+    starts, stops = merge_intervals(starts, stops)
+    naturals, prefix_lengths = [], []
+
+    # Take the largest aligned block from the start of every interval until they are used up
+    while len(starts) > 0:
+        alignment = np.where(starts == 0, np.uint64(1 << 32), starts & (~starts + np.uint64(1)))
+        fits = np.uint64(1) << np.floor(np.log2((stops - starts).astype(np.float64))).astype(np.uint64)
+        sizes = np.minimum(alignment, fits)
+
+        naturals.append(starts)
+        prefix_lengths.append(32 - np.log2(sizes.astype(np.float64)).astype(np.int64))
+        starts = starts + sizes
+        left = starts < stops
+        starts, stops = starts[left], stops[left]
+
+    if not naturals:
+        return np.zeros(0, dtype=np.uint32), np.zeros(0, dtype=np.uint8)
+
+    naturals, prefix_lengths = np.concatenate(naturals), np.concatenate(prefix_lengths)
+    order = np.argsort(naturals, kind='stable')
+    return naturals[order].astype(np.uint32), prefix_lengths[order].astype(np.uint8)
@@ -0,0 +1,460 @@
+# cluster.py
+# Splits a scan over many machines, a coordinator leases shards of the range to workers over TCP or a Unix socket
+# Workers ping their shard and stream the results back in compact chunks, which the coordinator writes to the central store
+# A shard whose lease runs out without a result chunk is given to another worker
+#
+# Every message is a JSON line, a results message is followed by its payload:
+# worker      {"type": "hello", "worker": name}
+# worker      {"type": "lease"}                                  Asks for a shard
+# coordinator {"type": "lease", "shard": id, "starts": [...], "stops": [...], "lease_seconds": s}
+# coordinator {"type": "wait", "seconds": s}                     Every shard is leased, ask again later
+# coordinator {"type": "done"}                                   Every shard is done
+# worker      {"type": "results", "shard": id, "count": n, "final": bool} + n uint32 indexes + n uint8 buckets, little endian
+# coordinator {"type": "ok"} or {"type": "expired"}              Expired shards were given to another worker, drop them
+
+
+# Imports
+from __future__ import annotations
+
+import asyncio
+import json
+import os
+import socket
+import subprocess
+import sys
+from collections import deque
+from collections.abc import Callable
+from time import monotonic, sleep
+
+import numpy as np
+
+import src.settings as settings
+from src.aggregates import PrefixCounts
+from src.cidr import merge_intervals, parse_cidr
+from src.checkpoint import add_checked_ranges, load_checked_ranges, save_checked_ranges
+from src.exclusions import AddressFilter
+from src.exclusions import from_settings as exclusions_from_settings
+from src.ip import IP, ComplexIPrange, IPrange
+from src.layout import get_layout
+from src.metrics import REGISTRY
+from src.rank import RankIndex
+from src.sampling import ping_indexes
+from src.store import ResultStore, results_to_arrays
+from src.timeout import AdaptiveTimeout
+from src.timeout import from_settings as timeouts_from_settings
+from src.writer import BatchWriter
+
+
+# Definitions
+WAIT_SECONDS = 1.0
+CONNECT_RETRIES = 30 # Seconds a worker waits for the coordinator to listen
+
+
+def split_runs(starts: np.ndarray, stops: np.ndarray, size: int) -> list[tuple[np.ndarray, np.ndarray]]:
+    """
+    Splits sorted index runs into parts of size IPs, in index order
+
+    Returns:
+        list[tuple[np.ndarray, np.ndarray]] # The start and stop indexes of the runs of each part
+    """
+
+    starts, stops = np.asarray(starts, dtype=np.int64), np.asarray(stops, dtype=np.int64)
+    offsets = np.concatenate(([0], np.cumsum(stops - starts)))
+
+    parts = []
+    for first in range(0, int(offsets[-1]), size):
+        last = min(first + size, int(offsets[-1]))
+
+        # The runs the part overlaps, cut to the part
+        first_run = int(np.searchsorted(offsets, first, side='right')) - 1
+        stop_run = int(np.searchsorted(offsets, last, side='left'))
+        part_starts = starts[first_run:stop_run].copy()
+        part_stops = stops[first_run:stop_run].copy()
+        part_starts[0] += first - offsets[first_run]
+        part_stops[-1] -= offsets[stop_run] - last
+        parts.append((part_starts, part_stops))
+
+    return parts
+
+
+def split_shards(range_: IPrange | ComplexIPrange, shard_size: int) -> list[tuple[np.ndarray, np.ndarray]]:
+    """
+    Splits a range into shards of shard_size IPs, in index order
+
+    Returns:
+        list[tuple[np.ndarray, np.ndarray]] # The start and stop indexes of the ranges of each shard
+
+    Usage:
+    >>> len(split_shards(IPrange(IP(0,0,0,0), IP.last_ip), 65536))
+    65536
+    """
+
+    return split_runs(*range_.to_arrays(), shard_size)
+
+
+def shard_indexes(starts: np.ndarray, stops: np.ndarray) -> np.ndarray:
+    """Returns every index of a shard"""
+
+    lengths = np.asarray(stops, dtype=np.int64) - np.asarray(starts, dtype=np.int64)
+    offsets = np.arange(int(lengths.sum())) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+    return (np.repeat(np.asarray(starts, dtype=np.int64), lengths) + offsets).astype(np.uint32)
+
+
+class Coordinator:
+    """
+    Leases shards to workers and writes the results they send back
+
+    Usage:
+    >>> coordinator = Coordinator(split_shards(ping_range, 65536), BatchWriter(ResultStore()))
+    >>> asyncio.run(coordinator.serve("127.0.0.1", 8643))
+    >>> save_checked_ranges(add_checked_ranges(checked_ranges, coordinator.done_ranges()))
+    """
+
+    def __init__(self, shards: list[tuple[np.ndarray, np.ndarray]], writer: BatchWriter, lease_seconds: float = 60.0) -> None:
+        """
+        Parameters:
+            shards: list[tuple[np.ndarray, np.ndarray]] # The shards, see split_shards
+            writer: BatchWriter # Writes the results
+            lease_seconds: float = 60.0 # Time a worker has between result chunks before its shard is given to another worker
+        """
+
+        self.shards = shards
+        self.writer = writer
+        self.lease_seconds = lease_seconds
+
+        self.pending = deque(range(len(shards)))
+        self.leases = {} # Shard id: (worker, deadline)
+        self.writing = set() # Shards whose results are being written, their leases don't expire meanwhile
+        self.done = np.zeros(len(shards), dtype=bool)
+        self.finished = None
+        self.write_lock = None
+
+
+    # Shard bookkeeping
+    def lease(self, worker: str) -> int | None:
+        """Leases the next shard to a worker, None if every shard is leased or done"""
+
+        self.expire()
+        if not self.pending:
+            return None
+
+        shard = self.pending.popleft()
+        self.leases[shard] = (worker, monotonic() + self.lease_seconds)
+        REGISTRY.counter("cluster_leases").inc()
+        return shard
+
+
+    def renew(self, shard: int, worker: str) -> bool:
+        """Extends the lease of a shard, returns False if the worker doesn't hold it anymore"""
+
+        lease = self.leases.get(shard)
+        if lease == None or lease[0] != worker:
+            return False
+
+        self.leases[shard] = (worker, monotonic() + self.lease_seconds)
+        return True
+
+
+    def complete(self, shard: int) -> None:
+        """Marks a shard as done"""
+
+        self.leases.pop(shard, None)
+        if shard in self.pending:
+            self.pending.remove(shard)
+        self.done[shard] = True
+        if self.done.all() and self.finished != None:
+            self.finished.set()
+
+
+    def expire(self) -> None:
+        """Puts shards with expired leases back in the queue"""
+
+        now = monotonic()
+        expired = sorted(shard for shard, (_, deadline) in self.leases.items() if deadline < now and shard not in self.writing)
+        for shard in expired:
+            print(f"Lease of shard {shard} held by {self.leases.pop(shard)[0]} expired, it will be given to another worker")
+        self.pending.extendleft(reversed(expired))
+        REGISTRY.counter("cluster_expired_leases").inc(len(expired))
+
+
+    def release(self, worker: str) -> None:
+        """Puts every shard a disconnected worker held back in the queue"""
+
+        held = sorted(shard for shard, (holder, _) in self.leases.items() if holder == worker)
+        for shard in held:
+            del self.leases[shard]
+        self.pending.extendleft(reversed(held))
+
+
+    def done_ranges(self) -> ComplexIPrange:
+        """Returns the ranges of every shard that is done"""
+
+        done = np.flatnonzero(self.done).tolist()
+        if not done:
+            return ComplexIPrange([])
+
+        starts = np.concatenate([self.shards[shard][0] for shard in done])
+        stops = np.concatenate([self.shards[shard][1] for shard in done])
+        return ComplexIPrange.from_arrays(*merge_intervals(starts, stops))
+
+
+    # Protocol
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        """Talks to one worker until it disconnects"""
+
+        worker = None
+        try:
+            while line := await reader.readline():
+                message = json.loads(line)
+
+                match message["type"]:
+                    case "hello":
+                        worker = message["worker"]
+                        print(f"Worker {worker} connected")
+
+                    case "lease":
+                        shard = self.lease(worker)
+                        if self.done.all():
+                            out = {"type": "done"}
+                        elif shard == None:
+                            out = {"type": "wait", "seconds": WAIT_SECONDS}
+                        else:
+                            starts, stops = self.shards[shard]
+                            out = {"type": "lease", "shard": shard, "starts": starts.tolist(), "stops": stops.tolist(), "lease_seconds": self.lease_seconds}
+                        writer.write(json.dumps(out).encode() + b"\n")
+
+                    case "results":
+                        shard, count = message["shard"], message["count"]
+                        payload = await reader.readexactly(count * 5)
+
+                        # Renew before writing, writes can wait for other workers' writes and map updates
+                        if not self.renew(shard, worker):
+                            writer.write(b'{"type": "expired"}\n')
+                        else:
+                            indexes = np.frombuffer(payload, dtype='<u4', count=count)
+                            buckets = np.frombuffer(payload, dtype=np.uint8, offset=count * 4)
+                            if count > 0:
+                                self.writing.add(shard)
+                                try:
+                                    async with self.write_lock:
+                                        await asyncio.to_thread(self.writer.write, indexes, buckets)
+                                finally:
+                                    self.writing.discard(shard)
+                                    self.renew(shard, worker)
+                            REGISTRY.counter("cluster_results").inc(count)
+                            if message["final"]:
+                                self.complete(shard)
+                                print(f"Shard {shard} done by {worker}; {int(self.done.sum())}/{len(self.done)} shards done")
+                            writer.write(b'{"type": "ok"}\n')
+
+                await writer.drain()
+
+        except (ConnectionError, asyncio.IncompleteReadError, json.JSONDecodeError, KeyError):
+            pass
+
+        finally:
+            if worker != None:
+                self.release(worker)
+                print(f"Worker {worker} disconnected")
+            writer.close()
+
+
+    async def serve(self, host: str = "127.0.0.1", port: int = 8643, unix_socket: str | None = None, on_listening: Callable[[], None] | None = None) -> None:
+        """Serves workers until every shard is done, on_listening is called once workers can connect"""
+
+        self.finished = asyncio.Event()
+        self.write_lock = asyncio.Lock()
+        if self.done.all():
+            return
+
+        if unix_socket != None:
+            server = await asyncio.start_unix_server(self.handle, unix_socket)
+            print(f"Coordinating on {unix_socket}")
+        else:
+            server = await asyncio.start_server(self.handle, host, port)
+            print(f"Coordinating on {host}:{port}")
+
+        if on_listening != None:
+            on_listening()
+
+        async with server:
+            await self.finished.wait()
+
+            # Give workers a moment to hear that everything is done
+            await asyncio.sleep(WAIT_SECONDS * 2)
+
+
+def _connect(address: str, retries: int = CONNECT_RETRIES) -> socket.socket:
+    """Connects to a coordinator at host:port or a Unix socket path, waiting for it to start listening"""
+
+    host, _, port = address.rpartition(':')
+    for attempt in range(retries + 1):
+        try:
+            if host and port.isdigit():
+                return socket.create_connection((host, int(port)))
+
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            try:
+                sock.connect(address)
+            except OSError:
+                sock.close()
+                raise
+            return sock
+
+        except (ConnectionRefusedError, FileNotFoundError):
+            if attempt == retries:
+                raise
+            sleep(WAIT_SECONDS)
+
+
+def work(address: str, name: str, ping_thread_amount: int, timeouts: AdaptiveTimeout | None = None, exclusions: AddressFilter | None = None, chunk_size: int = 4096) -> int:
+    """
+    Works for a coordinator until every shard is done
+
+    Parameters:
+        address: str # host:port or the path of a Unix socket
+        name: str # The name of the worker
+        ping_thread_amount: int # The amount of ping threads
+        timeouts: AdaptiveTimeout | None = None # The adaptive timeout to use, if any
+        exclusions: AddressFilter | None = None # IPs that may not be pinged, they are still reported as done
+        chunk_size: int = 4096 # IPs pinged per result chunk, each chunk renews the lease
+
+    Returns:
+        int # The amount of IPs pinged
+    """
+
+    with _connect(address) as sock, sock.makefile('rwb') as connection:
+        def send(message: dict, payload: bytes = b"") -> dict:
+            connection.write(json.dumps(message).encode() + b"\n" + payload)
+            connection.flush()
+            return json.loads(connection.readline())
+
+        connection.write(json.dumps({"type": "hello", "worker": name}).encode() + b"\n")
+        pinged = 0
+
+        while True:
+            message = send({"type": "lease"})
+            if message["type"] == "done":
+                return pinged
+            if message["type"] == "wait":
+                sleep(message["seconds"])
+                continue
+
+            shard = message["shard"]
+            indexes = shard_indexes(np.array(message["starts"]), np.array(message["stops"]))
+            if exclusions != None:
+                indexes = indexes[exclusions.allows_indexes(indexes)]
+
+            # Ping a chunk at a time and send every chunk right away, an empty final chunk if everything was excluded
+            for start in range(0, max(len(indexes), 1), chunk_size):
+                chunk_indexes, buckets = results_to_arrays(ping_indexes(indexes[start:start + chunk_size], ping_thread_amount, timeouts, None))
+                final = start + chunk_size >= len(indexes)
+                reply = send({"type": "results", "shard": shard, "count": len(chunk_indexes), "final": final}, chunk_indexes.astype('<u4').tobytes() + buckets.tobytes())
+                pinged += len(chunk_indexes)
+                if reply["type"] == "expired":
+                    print(f"Lease of shard {shard} expired, dropping it")
+                    break
+
+
+def coordinate(address: str, cidrs: list[str] | None = None, worker_amount: int = 0) -> None:
+    """
+    Coordinates a scan of everything that isn't checked yet, or of CIDR blocks, and saves the results.
+    Scans of CIDR blocks aren't added to the checked ranges, a natural block is thousands of separate ranges in index order.
+
+    Parameters:
+        address: str # host:port or the path of a Unix socket to listen on
+        cidrs: list[str] | None = None # Scan these blocks instead of everything that isn't checked
+        worker_amount: int = 0 # Local worker processes to start, for testing on one machine
+    """
+
+    settings_ = settings.load_settings()
+    cluster_settings = settings.get_setting(settings_, "cluster")
+    checked_ranges = load_checked_ranges()
+
+    if cidrs:
+        ping_range = ComplexIPrange.from_cidrs(cidrs)
+    elif checked_ranges == None:
+        ping_range = IPrange(IP(0,0,0,0), IP.last_ip)
+    else:
+        ping_range = checked_ranges.inverted()
+
+    store = ResultStore()
+    counts = PrefixCounts.load(store=store)
+    rank = RankIndex.load(store)
+    writer = BatchWriter(store, counts, rank, get_layout(settings.get_setting(settings_, "layout")), cluster_settings["map_batch"])
+    coordinator = Coordinator(split_shards(ping_range, cluster_settings["shard_size"]), writer, cluster_settings["lease_seconds"])
+
+    host, _, port = address.rpartition(':')
+    unix_socket = None if host and port.isdigit() else address
+    # Local workers start once the coordinator listens
+    workers = []
+    def start_workers() -> None:
+        workers.extend(subprocess.Popen([sys.executable, "-m", "src.cluster", "worker", address, f"local-{num + 1}"]) for num in range(worker_amount))
+
+    try:
+        asyncio.run(coordinator.serve(host, int(port) if unix_socket == None else 0, unix_socket, start_workers))
+    except KeyboardInterrupt:
+        print("Stopping, shards that aren't done will be scanned next time" if not cidrs else "Stopping")
+    finally:
+        for worker in workers:
+            worker.wait()
+        if unix_socket != None and os.path.exists(unix_socket):
+            os.remove(unix_socket)
+
+    # Save the results and the shards that are done
+    writer.flush()
+    counts.save()
+    rank.save()
+    if not cidrs:
+        save_checked_ranges(add_checked_ranges(checked_ranges, coordinator.done_ranges()))
+    store.close()
+
+
+def _is_cidr(text: str) -> bool:
+    """Returns if a command line argument is a CIDR block or an IP, not an address to listen on"""
+
+    try:
+        parse_cidr(text)
+        return True
+    except ValueError:
+        return False
+
+
+def main(args: list[str]) -> None:
+    """
+    Command line interface
+
+    Usage:
+    python -m src.cluster coordinator [address] [cidr]...
+    python -m src.cluster worker <address> [name]
+    python -m src.cluster local <workers> [cidr]...    A coordinator and local worker processes, on a Unix socket
+    """
+
+    settings_ = settings.load_settings()
+    cluster_settings = settings.get_setting(settings_, "cluster")
+    default_address = cluster_settings["unix_socket"] or f"{cluster_settings['host']}:{cluster_settings['port']}"
+
+    match args:
+        case ["coordinator", *rest]:
+            cidrs = [arg for arg in rest if _is_cidr(arg)]
+            addresses = [arg for arg in rest if not _is_cidr(arg)]
+            coordinate(addresses[0] if addresses else default_address, cidrs or None)
+
+        case ["worker", address, *name]:
+            ping_thread_amount = settings.get_setting(settings_, "thread_amounts")["ping"]
+            timeouts = timeouts_from_settings(settings.get_setting(settings_, "timeout"))
+            exclusions = exclusions_from_settings(settings.get_setting(settings_, "exclusions"))
+            name = name[0] if name else f"{socket.gethostname()}-{os.getpid()}"
+            pinged = work(address, name, ping_thread_amount, timeouts, exclusions, cluster_settings["chunk_size"])
+            print(f"Worker {name} pinged {pinged} ips")
+
+        case ["local", worker_amount, *cidrs]:
+            coordinate(os.path.abspath("cluster.sock"), cidrs or None, int(worker_amount))
+
+        case other:
+            print(main.__doc__)
+
+
+# Run
+if __name__ == "__main__":
+    main(sys.argv[1:])
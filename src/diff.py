@@ -0,0 +1,259 @@
+# diff.py
+# Compares two scans, from two result stores or two sets of map files
+# Writes bitmaps of the IPs that came up and went down, counts per /16 and a set of diff tiles
+
+
+# Imports
+from __future__ import annotations
+
+import csv
+import os
+import sys
+
+import numpy as np
+from PIL import Image
+
+import src.image as image
+import src.settings as settings
+from src.layout import Layout, get_layout
+from src.profiling import Profiler
+from src.render import render_tile
+from src.store import INDEX_SPACE, NO_RESPONSE, SCAN_CHUNK, ResultStore
+
+
+# Definitions
+DIFF_DIR = "diffs"
+
+# Codes of an IP in a diff, old response | new response << 1
+NEITHER = 0
+DOWN = 1
+UP = 2
+UNCHANGED = 3
+
+UP_COLOR = (0, 255, 0)
+DOWN_COLOR = (255, 0, 0)
+
+
+def diff_lut() -> np.ndarray:
+    """Returns the color table of the diff tiles"""
+
+    lut = np.zeros((256, 3), dtype=np.uint8)
+    lut[NEITHER] = image.NO_RESPONSE_COLOR
+    lut[DOWN] = DOWN_COLOR
+    lut[UP] = UP_COLOR
+    lut[UNCHANGED] = image.RESPONSE_COLOR
+    return lut
+
+
+class DiffCodes:
+    """The diff code of every IP of two result stores, computed when indexed"""
+
+    def __init__(self, old: ResultStore, new: ResultStore) -> None:
+        self.old = old
+        self.new = new
+
+
+    def __getitem__(self, indexes: np.ndarray) -> np.ndarray:
+        return (self.old.rtts[indexes] != NO_RESPONSE).astype(np.uint8) | (self.new.rtts[indexes] != NO_RESPONSE).astype(np.uint8) << 1
+
+
+class ScanDiff:
+    """
+    A diff of two scans.
+    The IPs that came up and went down are kept as packed bitmaps in index order on disk, so memory stays bounded.
+    Counts are kept per natural /16, which is the low 16 bits of an index.
+
+    Usage:
+    >>> diff = diff_stores(ResultStore("old/rtt.u8", readonly=True), ResultStore(readonly=True))
+    >>> diff.totals()
+    {'up': 1204, 'down': 877, 'unchanged': 40211}
+    """
+
+    def __init__(self, out_dir: str = DIFF_DIR) -> None:
+        """
+        Creates empty sparse bitmaps in the out directory
+
+        Parameters:
+            out_dir: str = DIFF_DIR # Where the bitmaps, counts and tiles go
+        """
+
+        self.out_dir = out_dir
+        os.makedirs(out_dir, exist_ok=True)
+
+        self.bitmaps = {}
+        for kind in ("up", "down"):
+            path = os.path.join(out_dir, f"{kind}.bits")
+            with open(path, 'wb') as file:
+                file.truncate(INDEX_SPACE // 8)
+            self.bitmaps[kind] = np.memmap(path, dtype=np.uint8, mode='r+', shape=(INDEX_SPACE // 8,))
+
+        self.counts = {kind: np.zeros(65536, dtype=np.uint64) for kind in ("up", "down", "unchanged")}
+
+
+    def add_chunk(self, start: int, old: np.ndarray, new: np.ndarray) -> None:
+        """
+        Adds a chunk of the index space, compared on packed bits
+
+        Parameters:
+            start: int # The first index of the chunk, a multiple of 65536
+            old: np.ndarray # If each IP of the chunk responded in the old scan, the length is a multiple of 65536
+            new: np.ndarray # If each IP of the chunk responded in the new scan
+        """
+
+        old_bits, new_bits = np.packbits(old), np.packbits(new)
+        changed = old_bits ^ new_bits
+        packed = {"up": changed & new_bits, "down": changed & old_bits, "unchanged": old_bits & new_bits}
+
+        # Chunks without changes are left as holes in the sparse files
+        for kind in ("up", "down"):
+            if packed[kind].any():
+                self.bitmaps[kind][start // 8:start // 8 + len(changed)] = packed[kind]
+
+        for kind, bits in packed.items():
+            if bits.any():
+                self.counts[kind] += np.unpackbits(bits).reshape(-1, 65536).sum(axis=0, dtype=np.uint64)
+
+
+    def add_indexes(self, kind: str, indexes: np.ndarray) -> None:
+        """Adds scattered indexes of one kind, for diffs of map files"""
+
+        indexes = np.asarray(indexes, dtype=np.uint32)
+        if kind in self.bitmaps:
+            np.bitwise_or.at(self.bitmaps[kind], indexes >> np.uint32(3), (np.uint8(0x80) >> (indexes & np.uint32(7)).astype(np.uint8)))
+        self.counts[kind] += np.bincount(indexes & np.uint32(0xFFFF), minlength=65536).astype(np.uint64)
+
+
+    def per_prefix(self, kind: str, prefix_length: int = 16) -> np.ndarray:
+        """Returns the counts of a kind per /8 or /16"""
+
+        if prefix_length == 16:
+            return self.counts[kind]
+        elif prefix_length == 8:
+            return self.counts[kind].reshape(256, 256).sum(axis=1)
+        else:
+            raise ValueError(f"Counts are kept per /8 or /16, not /{prefix_length}")
+
+
+    def totals(self) -> dict[str, int]:
+        return {kind: int(counts.sum()) for kind, counts in self.counts.items()}
+
+
+    def save_counts(self, prefix_length: int = 16) -> str:
+        """Writes the counts of every prefix where something responded to a csv, returns its path"""
+
+        path = os.path.join(self.out_dir, f"prefix_counts_{prefix_length}.csv")
+        counts = np.stack([self.per_prefix(kind, prefix_length) for kind in ("up", "down", "unchanged")], axis=1)
+
+        with open(path, 'wt', newline='') as file:
+            writer = csv.writer(file)
+            writer.writerow(("prefix", "up", "down", "unchanged"))
+            for prefix in np.flatnonzero(counts.any(axis=1)).tolist():
+                octets = (prefix,) if prefix_length == 8 else divmod(prefix, 256)
+                writer.writerow((f"{'.'.join(map(str, octets + (0,) * (4 - len(octets))))}/{prefix_length}", *counts[prefix].tolist()))
+
+        return path
+
+
+    def close(self) -> None:
+        for bitmap in self.bitmaps.values():
+            bitmap.flush()
+        self.bitmaps = {}
+
+
+def diff_stores(old: ResultStore, new: ResultStore, out_dir: str = DIFF_DIR) -> ScanDiff:
+    """Diffs two result stores chunk by chunk"""
+
+    diff = ScanDiff(out_dir)
+    for start in range(0, INDEX_SPACE, SCAN_CHUNK):
+        diff.add_chunk(start, old.read(start, start + SCAN_CHUNK) != NO_RESPONSE, new.read(start, start + SCAN_CHUNK) != NO_RESPONSE)
+        print(f"Compared {start // SCAN_CHUNK + 1}/{INDEX_SPACE // SCAN_CHUNK} chunks", end='\r')
+
+    print()
+    return diff
+
+
+def _tile_responses(maps_dir: str, tile: int) -> np.ndarray:
+    """Returns which pixels of a map file are responses"""
+
+    with Image.open(os.path.join(maps_dir, f"map{tile + 1}.png")) as img:
+        return (np.asarray(img.convert('RGB')) == image.RESPONSE_COLOR).all(axis=2)
+
+
+def diff_tiles(old_dir: str, new_dir: str, layout: Layout, out_dir: str = DIFF_DIR) -> ScanDiff:
+    """Diffs two sets of map files tile by tile, and writes the diff tiles"""
+
+    diff = ScanDiff(out_dir)
+    lut = diff_lut()
+    for tile in range(image.TILE_AMOUNT):
+        codes = _tile_responses(old_dir, tile).astype(np.uint8) | _tile_responses(new_dir, tile).astype(np.uint8) << 1
+
+        for kind, code in (("up", UP), ("down", DOWN), ("unchanged", UNCHANGED)):
+            ys, xs = np.nonzero(codes == code)
+            diff.add_indexes(kind, layout.inverse(np.full(xs.shape, tile, dtype=np.uint32), xs.astype(np.uint32), ys.astype(np.uint32)))
+
+        Image.fromarray(lut[codes], mode='RGB').save(os.path.join(out_dir, f"diff{tile + 1}.png"))
+        print(f"Compared {tile + 1}/{image.TILE_AMOUNT} tiles", end='\r')
+
+    print()
+    return diff
+
+
+def render_diff_tiles(old: ResultStore, new: ResultStore, layout: Layout, out_dir: str = DIFF_DIR) -> None:
+    """Renders the diff tiles of two result stores"""
+
+    codes = DiffCodes(old, new)
+    lut = diff_lut()
+    for tile in range(image.TILE_AMOUNT):
+        render_tile(codes, layout, tile, lut).save(os.path.join(out_dir, f"diff{tile + 1}.png"))
+        print(f"Rendered {tile + 1}/{image.TILE_AMOUNT} diff tiles", end='\r')
+
+    print()
+
+
+def main(old: str, new: str, profile: bool = False) -> None:
+    """
+    Diffs two scans, each given as a result store file or a directory of map files
+
+    Parameters:
+        old: str # The old scan
+        new: str # The new scan
+        profile: bool = False # Profile each phase
+    """
+
+    settings_ = settings.load_settings()
+    layout = get_layout(settings.get_setting(settings_, "layout"))
+    profile_settings = settings.get_setting(settings_, "profile")
+    profiler = Profiler(profile or profile_settings["enabled"], profile_settings["dir"])
+
+    if os.path.isdir(old) != os.path.isdir(new):
+        raise ValueError("Both scans have to be result stores or both have to be map directories")
+
+    if os.path.isdir(old):
+        with profiler.phase("diff"):
+            diff = diff_tiles(old, new, layout)
+
+    else:
+        old_store, new_store = ResultStore(old, readonly=True), ResultStore(new, readonly=True)
+        with profiler.phase("diff"):
+            diff = diff_stores(old_store, new_store)
+        with profiler.phase("render"):
+            render_diff_tiles(old_store, new_store, layout)
+
+    with profiler.phase("save"):
+        for prefix_length in (8, 16):
+            diff.save_counts(prefix_length)
+        diff.close()
+
+    totals = diff.totals()
+    print(f"{totals['up']} ips came up, {totals['down']} went down, {totals['unchanged']} still respond; see {DIFF_DIR}")
+    profiler.print_summary()
+
+
+# Run
+if __name__ == "__main__":
+    args = [arg for arg in sys.argv[1:] if arg != "--profile"]
+    if len(args) != 2:
+        print("Usage: python -m src.diff <old store or maps dir> <new store or maps dir> [--profile]")
+        sys.exit(1)
+
+    main(args[0], args[1], "--profile" in sys.argv)
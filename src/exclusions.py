@@ -0,0 +1,141 @@
+# exclusions.py
+# Exclusion and inclusion lists of CIDR blocks, so reserved space and networks that asked not to be scanned are never pinged
+# The blocks are compiled into a sorted array of intervals in natural order, where the longest matching prefix decides
+
+
+# Imports
+from __future__ import annotations
+
+from bisect import bisect_right
+
+import numpy as np
+
+from src.cidr import cidr_size, parse_cidr, parse_cidr_lines
+from src.ip import IP
+from src.layout import index_to_natural
+
+
+# Definitions
+# Special purpose space that never answers from the internet (RFC 6890 and friends)
+RESERVED_CIDRS = (
+    "0.0.0.0/8",        # This network
+    "10.0.0.0/8",       # Private
+    "100.64.0.0/10",    # Carrier grade NAT
+    "127.0.0.0/8",      # Loopback
+    "169.254.0.0/16",   # Link local
+    "172.16.0.0/12",    # Private
+    "192.0.0.0/24",     # IETF protocol assignments
+    "192.0.2.0/24",     # Documentation
+    "192.88.99.0/24",   # 6to4 relay anycast
+    "192.168.0.0/16",   # Private
+    "198.18.0.0/15",    # Benchmarking
+    "198.51.100.0/24",  # Documentation
+    "203.0.113.0/24",   # Documentation
+    "224.0.0.0/4",      # Multicast
+    "240.0.0.0/4"       # Reserved and broadcast
+)
+
+
+def load_cidr_file(path: str) -> list[tuple[int, int]]:
+    """
+    Loads CIDR blocks from a file, one per line. Everything after a # is a comment.
+
+    Returns:
+        list[tuple[int, int]] # The natural value of the first IP and the prefix length of each block
+
+    Raises:
+        ValueError # If a line is not a CIDR block
+    """
+
+    with open(path, 'rb') as file:
+        try:
+            naturals, prefix_lengths = parse_cidr_lines(file.read())
+        except ValueError as error:
+            raise ValueError(f"{path}: {error}")
+
+    return list(zip(naturals.tolist(), prefix_lengths.tolist()))
+
+
+class AddressFilter:
+    """
+    Decides which IPs may be pinged.
+    An IP follows the longest exclude or include block it is in, so a /16 can be included back out of an excluded /8.
+    IPs in no block are allowed, unless there are include blocks, then only included IPs are allowed.
+
+    Usage:
+    >>> address_filter = AddressFilter([parse_cidr("10.0.0.0/8")], [parse_cidr("10.1.0.0/16")])
+    >>> address_filter.allows(IP(10,1,2,3)), address_filter.allows(IP(10,2,0,0))
+    (True, False)
+    >>> address_filter.allows_indexes(np.array([IP(10,2,0,0).to_index, IP(11,0,0,0).to_index]))
+    array([False,  True])
+    """
+
+    def __init__(self, excluded: list[tuple[int, int]], included: list[tuple[int, int]] | None = None) -> None:
+        """
+        Parameters:
+            excluded: list[tuple[int, int]] # The blocks to exclude, see parse_cidr
+            included: list[tuple[int, int]] | None = None # The blocks to include
+        """
+
+        included = included or []
+        rules = [(prefix_length, natural, False) for natural, prefix_length in excluded] + [(prefix_length, natural, True) for natural, prefix_length in included]
+
+        # Split the space at every block edge
+        edges = np.unique(np.array([0] + [natural for _, natural, _ in rules] + [natural + cidr_size(prefix_length) for prefix_length, natural, _ in rules], dtype=np.uint64))
+        edges = edges[edges < 1 << 32]
+        allowed = np.full(len(edges), not included, dtype=bool)
+
+        # Paint the blocks from shortest to longest prefix, so the longest prefix wins
+        for prefix_length, natural, allow in sorted(rules, key=lambda rule: rule[0]):
+            first, last = np.searchsorted(edges, [natural, natural + cidr_size(prefix_length)])
+            allowed[first:last] = allow
+
+        # Merge neighbouring intervals with the same decision
+        keep = np.concatenate(([True], allowed[1:] != allowed[:-1]))
+        self.starts = edges[keep]
+        self.allowed = allowed[keep]
+        self._starts_list = self.starts.tolist()
+
+
+    def allows(self, ip: IP) -> bool:
+        """Returns if an IP may be pinged"""
+
+        natural = ip.a << 24 | ip.b << 16 | ip.c << 8 | ip.d
+        return bool(self.allowed[bisect_right(self._starts_list, natural) - 1])
+
+
+    def allows_naturals(self, naturals: np.ndarray) -> np.ndarray:
+        """Returns which natural order IPs may be pinged"""
+
+        return self.allowed[np.searchsorted(self.starts, np.asarray(naturals, dtype=np.uint64), side='right') - 1]
+
+
+    def allows_indexes(self, indexes: np.ndarray) -> np.ndarray:
+        """Returns which IP indexes may be pinged"""
+
+        return self.allows_naturals(index_to_natural(np.asarray(indexes, dtype=np.uint32)))
+
+
+    @property
+    def excluded_amount(self) -> int:
+        """The amount of IPs that may not be pinged"""
+
+        sizes = np.diff(np.append(self.starts, np.uint64(1 << 32)))
+        return int(sizes[~self.allowed].sum())
+
+
+def from_settings(exclusion_settings: dict) -> AddressFilter | None:
+    """Returns the address filter described by the exclusion settings, or None if nothing is excluded"""
+
+    excluded = [parse_cidr(cidr) for cidr in RESERVED_CIDRS] if exclusion_settings["reserved"] else []
+    for path in exclusion_settings["exclude_files"]:
+        excluded += load_cidr_file(path)
+
+    included = []
+    for path in exclusion_settings["include_files"]:
+        included += load_cidr_file(path)
+
+    if not excluded and not included:
+        return None
+
+    return AddressFilter(excluded, included)
@@ -0,0 +1,202 @@
+# export.py
+# Streams the IPs that responded out of the result store, in index order
+# The store is read a chunk at a time and every chunk is turned into text or binary with array operations,
+# so memory stays the same however much responded
+#
+# text    One dotted IP per line
+# csv     ip,rtt_ms
+# binary  The natural value of every IP as a big endian uint32
+
+
+# Imports
+from __future__ import annotations
+
+import sys
+from collections.abc import Iterator
+from typing import BinaryIO
+
+import numpy as np
+
+from src.cidr import GRID_SIZE, cidrs_to_intervals, dotted_parts, join_parts, merge_intervals, parse_cidr_lines
+from src.layout import index_to_natural
+from src.store import NO_RESPONSE, RTT_PATH, SCAN_CHUNK, ResultStore, dequantize_rtt, nonzero_offsets
+
+
+# Definitions
+FORMATS = ("text", "csv", "binary")
+WRITE_BATCH = 1 << 20 # IPs formatted at once
+
+# The round trip time in ms of every bucket as text, zero padded, and its length
+_RTT_TEXT = [f"{rtt * 1000:.3f}".encode() if bucket != NO_RESPONSE else b"" for bucket, rtt in enumerate(dequantize_rtt(np.arange(256)).tolist())]
+_RTT_WIDTH = max(len(text) for text in _RTT_TEXT)
+_RTT_CHARS = np.array([list(text.ljust(_RTT_WIDTH, b"\0")) for text in _RTT_TEXT], dtype=np.uint8)
+_RTT_LENGTHS = np.array([len(text) for text in _RTT_TEXT], dtype=np.int64)
+
+
+def rtt_parts(buckets: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """Returns the round trip times in ms of buckets as a part of text, see join_parts"""
+
+    return _RTT_CHARS[buckets], _RTT_LENGTHS[buckets]
+
+
+class CidrFilter:
+    """
+    The IPs of a set of CIDR blocks, as sorted natural intervals and the grid columns they touch.
+    Blocks of /16 or larger are whole columns of the index grid, so only the touched columns of the store are read.
+
+    Usage:
+    >>> cidr_filter = CidrFilter(["10.0.0.0/8", "192.168.1.0/24"])
+    >>> cidr_filter.columns
+    [(2560, 2816), (49320, 49321)]
+    """
+
+    def __init__(self, cidrs: list[str]) -> None:
+        """
+        Raises:
+            ValueError # If a block is not a CIDR block or has host bits set
+        """
+
+        naturals, prefix_lengths = parse_cidr_lines("\n".join(cidrs).encode())
+        self.starts, self.stops = merge_intervals(*cidrs_to_intervals(naturals, prefix_lengths))
+
+        # The columns are the top 16 bits of the natural values
+        column_starts = self.starts >> np.uint64(16)
+        column_stops = (self.stops + np.uint64(GRID_SIZE - 1)) >> np.uint64(16)
+        column_starts, column_stops = merge_intervals(column_starts, column_stops)
+        self.columns = list(zip(column_starts.tolist(), column_stops.tolist()))
+
+
+    def contains(self, naturals: np.ndarray) -> np.ndarray:
+        """Returns which natural order IPs are in the blocks"""
+
+        naturals = np.asarray(naturals, dtype=np.uint64)
+        positions = np.searchsorted(self.starts, naturals, side='right') - 1
+        return (positions >= 0) & (naturals < self.stops[np.maximum(positions, 0)])
+
+
+def responded(store: ResultStore, cidr_filter: CidrFilter | None = None) -> Iterator[tuple[np.ndarray, np.ndarray]]:
+    """
+    Yields the indexes and buckets of every IP that responded, in index order, a chunk of the store at a time
+
+    Parameters:
+        store: ResultStore # The result store
+        cidr_filter: CidrFilter | None = None # Only yield IPs in these blocks, if any
+    """
+
+    rows_per_chunk = SCAN_CHUNK // GRID_SIZE
+
+    for start in range(0, len(store.rtts), SCAN_CHUNK):
+        grid = store.read(start, start + SCAN_CHUNK).reshape(rows_per_chunk, GRID_SIZE)
+        first_row = start // GRID_SIZE
+
+        # Every column, fast path for exports without a filter
+        if cidr_filter == None:
+            offsets = nonzero_offsets(grid.ravel())
+            if len(offsets) > 0:
+                yield offsets.astype(np.uint32) + np.uint32(start), grid.ravel()[offsets]
+            continue
+
+        # Read only the touched columns of each row
+        indexes, buckets = [], []
+        for first_column, stop_column in cidr_filter.columns:
+            part = grid[:, first_column:stop_column]
+            rows, part_columns = np.nonzero(part)
+            if len(rows) == 0:
+                continue
+            indexes.append((rows.astype(np.uint32) + np.uint32(first_row)) << np.uint32(16) | (part_columns.astype(np.uint32) + np.uint32(first_column)))
+            buckets.append(part[rows, part_columns])
+
+        if not indexes:
+            continue
+
+        indexes, buckets = np.concatenate(indexes), np.concatenate(buckets)
+        if len(cidr_filter.columns) > 1:
+            order = np.argsort(indexes)
+            indexes, buckets = indexes[order], buckets[order]
+
+        # Blocks smaller than a /16 only cover part of their column
+        inside = cidr_filter.contains(index_to_natural(indexes))
+        yield indexes[inside], buckets[inside]
+
+
+def format_results(format_: str, indexes: np.ndarray, buckets: np.ndarray) -> bytes:
+    """Returns the exported bytes of responded IPs in one of the FORMATS"""
+
+    naturals = index_to_natural(indexes)
+    match format_:
+        case "text":
+            return join_parts(dotted_parts(naturals) + [b"\n"], len(naturals))
+        case "csv":
+            return join_parts(dotted_parts(naturals) + [b",", rtt_parts(buckets), b"\n"], len(naturals))
+        case "binary":
+            return naturals.astype('>u4').tobytes()
+        case other:
+            raise ValueError(f"Unknown format {format_!r}, expected one of {', '.join(FORMATS)}")
+
+
+def export(store: ResultStore, file: BinaryIO, format_: str = "text", cidr_filter: CidrFilter | None = None) -> int:
+    """
+    Writes every IP that responded to a file
+
+    Parameters:
+        store: ResultStore # The result store
+        file: BinaryIO # The file to write to
+        format_: str = "text" # One of FORMATS
+        cidr_filter: CidrFilter | None = None # Only export IPs in these blocks, if any
+
+    Returns:
+        int # The amount of IPs written
+    """
+
+    if format_ not in FORMATS:
+        raise ValueError(f"Unknown format {format_!r}, expected one of {', '.join(FORMATS)}")
+
+    if format_ == "csv":
+        file.write(b"ip,rtt_ms\n")
+
+    written = 0
+    for indexes, buckets in responded(store, cidr_filter):
+        for start in range(0, len(indexes), WRITE_BATCH):
+            file.write(format_results(format_, indexes[start:start + WRITE_BATCH], buckets[start:start + WRITE_BATCH]))
+        written += len(indexes)
+
+    return written
+
+
+def main(format_: str, path: str, cidrs: list[str] | None = None) -> None:
+    """
+    Exports the IPs that responded
+
+    Parameters:
+        format_: str # One of FORMATS
+        path: str # The file to write, - writes to stdout
+        cidrs: list[str] | None = None # Only export IPs in these CIDR blocks, if any
+
+    Raises:
+        ValueError # If the format is unknown, before the file is opened
+    """
+
+    # Check the format first, so a typo doesn't truncate the file
+    if format_ not in FORMATS:
+        raise ValueError(f"Unknown format {format_!r}, expected one of {', '.join(FORMATS)}")
+
+    store = ResultStore(RTT_PATH, readonly=True)
+    cidr_filter = CidrFilter(cidrs) if cidrs else None
+
+    if path == "-":
+        written = export(store, sys.stdout.buffer, format_, cidr_filter)
+        sys.stdout.buffer.flush()
+    else:
+        with open(path, 'wb') as file:
+            written = export(store, file, format_, cidr_filter)
+
+    # Keep stdout clean for the exported IPs
+    print(f"Exported {written} ips", file=sys.stderr)
+
+
+# Run
+if __name__ == "__main__":
+    if len(sys.argv) < 3 or sys.argv[1] not in FORMATS:
+        print(f"Usage: python -m src.export <{'|'.join(FORMATS)}> <path | -> [cidr]...")
+    else:
+        main(sys.argv[1], sys.argv[2], sys.argv[3:])
@@ -0,0 +1,280 @@
+# history.py
+# Keeps the responded bitmap of every scan as an epoch, so old scans can be looked at after the maps are overwritten
+# Each epoch only stores the chunks that changed since the last epoch, XORed against it and zlib compressed
+# Every few epochs is a keyframe with the full chunks, so reconstructing an epoch never replays the whole history
+
+
+# Imports
+from __future__ import annotations
+
+import json
+import os
+import sys
+import zlib
+from collections.abc import Iterator
+from time import time
+
+import numpy as np
+
+from src.ip import IP
+from src.store import INDEX_SPACE, NO_RESPONSE, SCAN_CHUNK, ResultStore
+
+
+# Definitions
+HISTORY_DIR = "history"
+MANIFEST_NAME = "manifest.json"
+HEAD_NAME = "head.bits"
+HEAD_EPOCH_NAME = "head.epoch" # The epoch head.bits holds, missing while the head is being changed
+
+CHUNK_BITS = 1 << 20 # IPs per history chunk, 128KB packed
+CHUNK_BYTES = CHUNK_BITS // 8
+CHUNK_AMOUNT = INDEX_SPACE // CHUNK_BITS
+
+
+class EpochStore:
+    """
+    A history of responded bitmaps.
+    head.bits holds the latest epoch unpacked from the deltas, so recording an epoch doesn't replay anything.
+    head.epoch says which epoch the head holds, a head that isn't at the last listed epoch is rebuilt from the deltas.
+    Each epoch is a data file of compressed chunks and an index of (chunk, offset, length).
+
+    Usage:
+    >>> history = EpochStore()
+    >>> epoch = history.record(ResultStore(readonly=True), "weekly scan")
+    >>> history.responded_at(epoch, np.array([IP(1,1,1,1).to_index]))
+    array([ True])
+    >>> history.address_history(IP(1,1,1,1).to_index)
+    [(0, False), (1, True)]
+    """
+
+    def __init__(self, path: str = HISTORY_DIR, keyframe_interval: int = 16) -> None:
+        """
+        Opens the epoch store, creating it if it doesn't exist
+
+        Parameters:
+            path: str = HISTORY_DIR # The history directory
+            keyframe_interval: int = 16 # Epochs between keyframes
+        """
+
+        self.path = path
+        self.keyframe_interval = keyframe_interval
+        os.makedirs(path, exist_ok=True)
+
+        try:
+            with open(os.path.join(path, MANIFEST_NAME), 'rt') as file:
+                self.epochs = json.load(file)
+        except FileNotFoundError:
+            self.epochs = [] # {"time", "label", "keyframe", "changed"} per epoch
+
+        self._indexes = {} # Epoch: {chunk: (offset, length)}
+
+
+    def _epoch_path(self, epoch: int, extension: str) -> str:
+        return os.path.join(self.path, f"{epoch:06}.{extension}")
+
+
+    def _chunk_index(self, epoch: int) -> dict[int, tuple[int, int]]:
+        """Returns where each stored chunk of an epoch is in its data file"""
+
+        if epoch not in self._indexes:
+            table = np.load(self._epoch_path(epoch, "idx.npy"))
+            self._indexes[epoch] = {int(chunk): (int(offset), int(length)) for chunk, offset, length in table}
+
+        return self._indexes[epoch]
+
+
+    def _read_chunk(self, epoch: int, chunk: int) -> np.ndarray | None:
+        """Returns a stored chunk of an epoch, or None if the epoch doesn't have it"""
+
+        location = self._chunk_index(epoch).get(chunk)
+        if location == None:
+            return None
+
+        offset, length = location
+        with open(self._epoch_path(epoch, "dat"), 'rb') as file:
+            file.seek(offset)
+            return np.frombuffer(zlib.decompress(file.read(length)), dtype=np.uint8)
+
+
+    def _keyframe_before(self, epoch: int) -> int:
+        """Returns the last keyframe at or before an epoch"""
+
+        return max(num for num in range(epoch + 1) if self.epochs[num]["keyframe"])
+
+
+    def record(self, store: ResultStore, label: str = "") -> int:
+        """
+        Records the responded bitmap of a result store as a new epoch
+
+        Parameters:
+            store: ResultStore # The result store
+            label: str = "" # A label for the epoch
+
+        Returns:
+            int # The epoch number
+        """
+
+        epoch = len(self.epochs)
+        keyframe = epoch % self.keyframe_interval == 0
+
+        # A head that is lost, or ahead of the manifest after an interrupted record, is rebuilt from the last epoch
+        head_path = os.path.join(self.path, HEAD_NAME)
+        head_epoch_path = os.path.join(self.path, HEAD_EPOCH_NAME)
+        rebuild = epoch == 0 or not os.path.exists(head_path) or self._head_epoch() != epoch - 1
+        if rebuild:
+            with open(head_path, 'wb') as file:
+                file.truncate(INDEX_SPACE // 8)
+        head = np.memmap(head_path, dtype=np.uint8, mode='r+', shape=(INDEX_SPACE // 8,))
+
+        if rebuild and epoch > 0:
+            for start, bits in self.reconstruct(epoch - 1):
+                head[start // 8:start // 8 + CHUNK_BYTES] = bits
+
+        # The head is about to move past the listed epochs
+        if os.path.exists(head_epoch_path):
+            os.remove(head_epoch_path)
+
+        table = []
+        with open(self._epoch_path(epoch, "dat"), 'wb') as data_file:
+            for start in range(0, INDEX_SPACE, SCAN_CHUNK):
+                bits = np.packbits(store.read(start, start + SCAN_CHUNK) != NO_RESPONSE).reshape(-1, CHUNK_BYTES)
+                old_bits = head[start // 8:(start + SCAN_CHUNK) // 8].reshape(-1, CHUNK_BYTES)
+                changed = (bits != old_bits).any(axis=1)
+
+                # Keyframes store every chunk that holds something, other epochs only changed chunks
+                stored = bits.any(axis=1) if keyframe else changed
+                for row in np.flatnonzero(stored).tolist():
+                    blob = zlib.compress((bits[row] if keyframe else bits[row] ^ old_bits[row]).tobytes())
+                    table.append((start // CHUNK_BITS + row, data_file.tell(), len(blob)))
+                    data_file.write(blob)
+
+                # Only write changed chunks to the head, so it stays sparse
+                for row in np.flatnonzero(changed).tolist():
+                    old_bits[row] = bits[row]
+
+                print(f"Recorded {(start + SCAN_CHUNK) // SCAN_CHUNK}/{INDEX_SPACE // SCAN_CHUNK} chunks of epoch {epoch}", end='\r')
+
+        print()
+        head.flush()
+        del head
+        np.save(self._epoch_path(epoch, "idx.npy"), np.array(table, dtype=np.int64).reshape(-1, 3))
+
+        # Add to the manifest last, so an interrupted epoch is never listed
+        self.epochs.append({"time": time(), "label": label, "keyframe": keyframe, "changed": len(table)})
+        tmp_path = os.path.join(self.path, MANIFEST_NAME + ".tmp")
+        with open(tmp_path, 'wt') as file:
+            json.dump(self.epochs, file, indent=4)
+        os.replace(tmp_path, os.path.join(self.path, MANIFEST_NAME))
+
+        # The head matches the manifest again
+        with open(head_epoch_path, 'wt') as file:
+            file.write(str(epoch))
+
+        return epoch
+
+
+    def _head_epoch(self) -> int | None:
+        """Returns the epoch head.bits holds, None if it is unknown"""
+
+        try:
+            with open(os.path.join(self.path, HEAD_EPOCH_NAME), 'rt') as file:
+                return int(file.read())
+        except (FileNotFoundError, ValueError):
+            return None
+
+
+    def chunk_at(self, epoch: int, chunk: int) -> np.ndarray:
+        """Returns the packed bits of one chunk at an epoch, only that chunk is decompressed"""
+
+        keyframe = self._keyframe_before(epoch)
+        base = self._read_chunk(keyframe, chunk)
+        bits = np.zeros(CHUNK_BYTES, dtype=np.uint8) if base is None else base.copy()
+
+        for num in range(keyframe + 1, epoch + 1):
+            delta = self._read_chunk(num, chunk)
+            if delta is not None:
+                bits ^= delta
+
+        return bits
+
+
+    def reconstruct(self, epoch: int) -> Iterator[tuple[int, np.ndarray]]:
+        """Yields the first index and packed bits of every chunk of an epoch that holds something"""
+
+        keyframe = self._keyframe_before(epoch)
+        chunks = set(self._chunk_index(keyframe))
+        for num in range(keyframe + 1, epoch + 1):
+            chunks |= set(self._chunk_index(num))
+
+        for chunk in sorted(chunks):
+            bits = self.chunk_at(epoch, chunk)
+            if bits.any():
+                yield chunk * CHUNK_BITS, bits
+
+
+    def responded_at(self, epoch: int, indexes: np.ndarray) -> np.ndarray:
+        """Returns if each IP responded at an epoch"""
+
+        indexes = np.asarray(indexes, dtype=np.uint32)
+        out = np.zeros(indexes.shape, dtype=bool)
+        chunks = indexes // np.uint32(CHUNK_BITS)
+
+        for chunk in np.unique(chunks).tolist():
+            in_chunk = chunks == chunk
+            offsets = indexes[in_chunk] % np.uint32(CHUNK_BITS)
+            out[in_chunk] = np.unpackbits(self.chunk_at(epoch, chunk))[offsets]
+
+        return out
+
+
+    def address_history(self, index: int) -> list[tuple[int, bool]]:
+        """Returns if an IP responded at every epoch, only its chunk is decompressed"""
+
+        chunk, offset = divmod(index, CHUNK_BITS)
+        byte, mask = offset // 8, 0x80 >> (offset % 8)
+
+        history = []
+        value = False
+        for num, epoch in enumerate(self.epochs):
+            stored = self._read_chunk(num, chunk)
+            if epoch["keyframe"]:
+                value = stored is not None and bool(stored[byte] & mask)
+            elif stored is not None and stored[byte] & mask:
+                value = not value
+            history.append((num, value))
+
+        return history
+
+
+def main(args: list[str]) -> None:
+    """
+    Command line interface
+
+    Usage:
+    python -m src.history list
+    python -m src.history record [label]
+    python -m src.history address <ip>
+    """
+
+    history = EpochStore()
+    match args:
+        case ["list"]:
+            for num, epoch in enumerate(history.epochs):
+                print(f"{num}: {epoch['label'] or '-'} ({'keyframe, ' if epoch['keyframe'] else ''}{epoch['changed']} chunks stored)")
+
+        case ["record", *label]:
+            epoch = history.record(ResultStore(readonly=True), " ".join(label))
+            print(f"Recorded epoch {epoch}")
+
+        case ["address", ip]:
+            index = IP(*map(int, ip.split('.'))).to_index
+            for num, responded in history.address_history(index):
+                print(f"{num}: {'responded' if responded else '-'}")
+
+        case other:
+            print(main.__doc__)
+
+
+# Run
+if __name__ == "__main__":
+    main(sys.argv[1:])
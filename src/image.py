@@ -3,6 +3,9 @@
 
 
 # Imports
+import os
+
+import numpy as np
 from PIL import Image
 from PIL.PngImagePlugin import PngImageFile
 from PIL.PyAccess import PyAccess
@@ -10,13 +13,28 @@ from PIL.PyAccess import PyAccess
 import src.threads as threads
 from src.global_methods import flatten_iter, lazy_split
 from src.ip import IP
+from src.layout import Layout, OctetLayout
 
 
 # Definitions
+MAPS_DIR = "maps"
+TILE_SIZE = 8192
+TILE_AMOUNT = 64
+BLANK_COLOR = (18, 18, 18)
+RESPONSE_COLOR = (255, 255, 255)
+NO_RESPONSE_COLOR = (0, 0, 0)
+
+
+def map_path(out_num: int) -> str:
+    """Returns the path of the map image with the given number"""
+
+    return os.path.join(MAPS_DIR, f"map{out_num}.png")
+
+
 def get_images() -> list[PngImageFile]:
     """Returns all 64 image objects"""
 
-    return [Image.open(f".\\maps\\map{i}.png") for i in range(1, 65)]
+    return [Image.open(map_path(i)) for i in range(1, TILE_AMOUNT + 1)]
 
 
 def get_pix_maps(imgs: list[PngImageFile], load_thread_amount: int) -> list[PyAccess]:
@@ -52,40 +70,69 @@ def get_img_n_pix_maps(load_thread_amount: int) -> tuple[list[PngImageFile], lis
     return (imgs := get_images()), get_pix_maps(imgs, load_thread_amount)
 
 
-def write_pix(pix_maps: list[PyAccess], result: tuple[IP, bool]) -> None:
+def write_pix(pix_maps: list[PyAccess], result: tuple[IP, bool], layout: Layout = None) -> None:
     """Writes the ping result to the pixel access objects"""
 
-    # Initialize vars
     ip, response = result
-    out_img = 1
-    a, b, c, d = tuple(ip)
+    write_pixels(pix_maps, np.array([ip.to_index], dtype=np.uint32), np.array([bool(response)]), layout)
+
+
+def write_pixels(pix_maps: list[PyAccess], indexes: np.ndarray, responses: np.ndarray, layout: Layout = None) -> None:
+    """
+    Writes a batch of ping results to the pixel access objects
+
+    Parameters:
+        pix_maps: list[PyAccess] # All 64 pixel access objects
+        indexes: np.ndarray # The IP indexes that were pinged
+        responses: np.ndarray # If each IP responded
+        layout: Layout = None # The layout of the maps, defaults to the octet layout
+    """
+
+    if layout == None:
+        layout = OctetLayout()
+
+    # Get all the coordinates at once
+    tiles, xs, ys = layout.forward(indexes)
+
+    # Write to pixel maps
+    for tile, x, y, response in zip(tiles.tolist(), xs.tolist(), ys.tolist(), np.asarray(responses).tolist()):
+        pix_maps[tile][x, y] = RESPONSE_COLOR if response else NO_RESPONSE_COLOR
+
+
+def update_tiles(indexes: np.ndarray, responses: np.ndarray, layout: Layout = None) -> None:
+    """
+    Writes a batch of ping results straight to the map files.
+    Only one tile is loaded at a time, and each tile is replaced atomically.
+
+    Parameters:
+        indexes: np.ndarray # The IP indexes that were pinged
+        responses: np.ndarray # If each IP responded
+        layout: Layout = None # The layout of the maps, defaults to the octet layout
+    """
+
+    if layout == None:
+        layout = OctetLayout()
 
-    # Set out image
-    while True:
-        if a in range(32):
-            break
-        else:
-            a -= 32
-            out_img += 1
+    tiles, xs, ys = layout.forward(np.asarray(indexes, dtype=np.uint32))
+    colors = np.where(np.asarray(responses, dtype=bool)[:, None], RESPONSE_COLOR, NO_RESPONSE_COLOR).astype(np.uint8)
 
-    while True:
-        if c in range(32):
-            break
-        else:
-            c -= 32
-            out_img += 8
+    for tile in np.unique(tiles).tolist():
+        in_tile = tiles == tile
+        path = map_path(tile + 1)
 
-    # Set coordinates
-    x, y = (a*256)+b, (c*256)+d
+        with Image.open(path) as img:
+            pixels = np.array(img.convert('RGB'))
+        pixels[ys[in_tile], xs[in_tile]] = colors[in_tile]
 
-    # Write to pixel map
-    pix_maps[out_img-1][x, y] = (255, 255, 255) if response else (0, 0, 0)
+        tmp_path = path + ".tmp"
+        Image.fromarray(pixels, mode='RGB').save(tmp_path, format="PNG")
+        os.replace(tmp_path, path)
 
 
-def save(img: PngImageFile, out_num: int) -> None:
-    """Save pix_maps to their images"""
+def save(img: PngImageFile, out_num: int, path: str | None = None) -> None:
+    """Save pix_maps to their images, to path instead of the maps directory if given"""
 
-    img.save(f"maps\\map{out_num}.png")
+    img.save(map_path(out_num) if path == None else path)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,458 @@
+# ingest.py
+# Imports results of other scanners into the result store and maps, without pinging anything
+# Reads CSV and JSON lines files of responding IPs, and pcap captures of ICMP echo replies
+# Files are streamed in chunks and every chunk is parsed with array operations, so large files import at about disk speed
+
+
+# Imports
+from __future__ import annotations
+
+import os
+import re
+import sys
+from collections.abc import Iterator
+from itertools import chain
+from typing import BinaryIO
+
+import numpy as np
+
+import src.settings as settings
+from src.aggregates import PrefixCounts
+from src.checkpoint import add_checked_ranges, load_checked_ranges, save_checked_ranges
+from src.cidr import iter_line_chunks, parse_dotted
+from src.ip import ComplexIPrange
+from src.layout import get_layout, natural_to_index
+from src.metrics import REGISTRY
+from src.profiling import Profiler
+from src.rank import RankIndex
+from src.store import RTT_MAX, ResultStore, quantize_rtt
+from src.writer import BatchWriter
+
+
+# Definitions
+FORMATS = ("csv", "jsonl", "pcap")
+IP_WIDTH = 15     # Longest dotted IP
+NUMBER_WIDTH = 32 # Longest round trip time field
+PAD_CHARS = b' \t\r"\''
+
+# pcap
+PCAP_MAGICS = {0xa1b2c3d4: (False, 1e-6), 0xd4c3b2a1: (True, 1e-6), 0xa1b23c4d: (False, 1e-9), 0x4d3cb2a1: (True, 1e-9)}
+PCAPNG_MAGIC = 0x0a0d0d0a
+MAX_RECORD = 1 << 20
+LINKTYPE_NULL, LINKTYPE_ETHERNET, LINKTYPE_RAW, LINKTYPE_SLL, LINKTYPE_IPV4, LINKTYPE_SLL2 = 0, 1, 101, 113, 228, 276
+ICMP_ECHO_REPLY, ICMP_ECHO_REQUEST = 0, 8
+
+
+def _u16(data: np.ndarray, positions: np.ndarray) -> np.ndarray:
+    """Returns the big endian uint16 at each position"""
+
+    return data[positions].astype(np.uint32) << 8 | data[positions + 1]
+
+
+def _u32(data: np.ndarray, positions: np.ndarray, big: bool = True) -> np.ndarray:
+    """Returns the uint32 at each position"""
+
+    parts = [data[positions + offset].astype(np.uint32) for offset in range(4)]
+    if not big:
+        parts.reverse()
+    return parts[0] << 24 | parts[1] << 16 | parts[2] << 8 | parts[3]
+
+
+def _trim(chars: np.ndarray, starts: np.ndarray, stops: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """Moves field bounds past spaces and quotes at either end"""
+
+    is_pad = np.isin(chars, np.frombuffer(PAD_CHARS, dtype=np.uint8))
+    while True:
+        move_start = (starts < stops) & is_pad[np.minimum(starts, len(chars) - 1)]
+        move_stop = (starts < stops) & ~move_start & is_pad[np.maximum(stops - 1, 0)]
+        if not (move_start.any() or move_stop.any()):
+            return starts, stops
+        starts = starts + move_start
+        stops = stops - move_stop
+
+
+def _gather(chars: np.ndarray, starts: np.ndarray, stops: np.ndarray, width: int) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Copies fields into the rows of a zero padded matrix
+
+    Returns:
+        tuple[np.ndarray, np.ndarray] # The (fields, width) uint8 matrix and which fields fit in it
+    """
+
+    positions = starts[:, None] + np.arange(width)[None, :]
+    inside = positions < stops[:, None]
+    fields = np.where(inside, chars[np.minimum(positions, len(chars) - 1)], 0).astype(np.uint8)
+    return fields, stops - starts <= width
+
+
+def parse_numbers(fields: np.ndarray) -> np.ndarray:
+    """Parses a matrix of zero padded numbers, one per row, NaN for empty or invalid rows"""
+
+    if len(fields) == 0:
+        return np.zeros(0)
+
+    texts = np.ascontiguousarray(fields).view(f"S{fields.shape[1]}").ravel()
+    texts = np.where((texts == b"") | (texts == b"null"), b"nan", texts)
+    try:
+        return texts.astype(np.float64)
+    except ValueError:
+        out = np.full(len(texts), np.nan)
+        for num, text in enumerate(texts.tolist()):
+            try:
+                out[num] = float(text)
+            except ValueError:
+                pass
+        return out
+
+
+def _line_bounds(chars: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """Returns the start and stop of every line"""
+
+    newlines = np.flatnonzero(chars == ord('\n'))
+    starts = np.concatenate(([0], newlines + 1))
+    stops = np.concatenate((newlines, [len(chars)]))
+    return starts[starts < len(chars)], stops[starts < len(chars)]
+
+
+def _csv_field(chars: np.ndarray, line_starts: np.ndarray, line_stops: np.ndarray, column: int, delimiter: int) -> tuple[np.ndarray, np.ndarray]:
+    """Returns the bounds of one column in every line, empty if a line has too few columns"""
+
+    delimiters = np.flatnonzero(chars == delimiter)
+    line_of = np.searchsorted(line_starts, delimiters, side='right') - 1
+    first = np.searchsorted(line_of, np.arange(len(line_starts)))
+    amount = np.bincount(line_of, minlength=len(line_starts))
+    padded = np.append(delimiters, len(chars))
+
+    starts = line_starts if column == 0 else padded[np.minimum(first + column - 1, len(delimiters))] + 1
+    stops = np.where(column < amount, padded[np.minimum(first + column, len(delimiters))], line_stops)
+    present = column <= amount
+    return np.where(present, starts, line_stops), np.where(present, stops, line_stops)
+
+
+def read_csv(file: BinaryIO, ip_column: str = "ip", rtt_column: str = "rtt", chunk_size: int = 1 << 24) -> Iterator[tuple[np.ndarray, np.ndarray]]:
+    """
+    Reads IPs and round trip times from a CSV file.
+    The columns are found by name in the header, a file without a header has the IP first and the round trip time second.
+    Quoted fields can't hold the delimiter.
+
+    Parameters:
+        file: BinaryIO # The CSV file
+        ip_column: str = "ip" # The name of the IP column
+        rtt_column: str = "rtt" # The name of the round trip time column, missing is fine
+        chunk_size: int = 1 << 24 # Bytes read at once
+
+    Returns:
+        Iterator[tuple[np.ndarray, np.ndarray]] # Chunks of uint32 natural IPs and their round trip times, NaN if unknown
+    """
+
+    header = file.readline()
+    delimiter = b'\t' if header.count(b'\t') > header.count(b',') else b','
+    names = [name.strip(PAD_CHARS + b'\n').decode(errors='replace') for name in header.split(delimiter)]
+
+    chunks = iter_line_chunks(file, chunk_size)
+    if ip_column in names:
+        ip_index = names.index(ip_column)
+        rtt_index = names.index(rtt_column) if rtt_column in names else None
+    else:
+        # No header, the first line is data
+        ip_index, rtt_index = 0, 1 if len(names) > 1 else None
+        chunks = chain([(header, 1)], chunks)
+
+    for data, _ in chunks:
+        chars = np.frombuffer(data, dtype=np.uint8)
+        line_starts, line_stops = _line_bounds(chars)
+
+        fields, fits = _gather(chars, *_trim(chars, *_csv_field(chars, line_starts, line_stops, ip_index, delimiter[0])), IP_WIDTH)
+        naturals, valid = parse_dotted(fields)
+        valid &= fits
+
+        if rtt_index != None:
+            fields, fits = _gather(chars, *_trim(chars, *_csv_field(chars, line_starts, line_stops, rtt_index, delimiter[0])), NUMBER_WIDTH)
+            rtts = np.where(fits, parse_numbers(fields), np.nan)
+        else:
+            rtts = np.full(len(naturals), np.nan)
+
+        REGISTRY.counter("ingest_skipped").inc(int((~valid).sum()))
+        yield naturals[valid], rtts[valid]
+
+
+def read_jsonl(file: BinaryIO, ip_field: str = "ip", rtt_field: str = "rtt", chunk_size: int = 1 << 24) -> Iterator[tuple[np.ndarray, np.ndarray]]:
+    """
+    Reads IPs and round trip times from a JSON lines file, one object per line.
+    The fields are found with a regex over the whole chunk instead of decoding every object.
+
+    Parameters:
+        file: BinaryIO # The JSON lines file
+        ip_field: str = "ip" # The key of the IP
+        rtt_field: str = "rtt" # The key of the round trip time, missing is fine
+        chunk_size: int = 1 << 24 # Bytes read at once
+
+    Returns:
+        Iterator[tuple[np.ndarray, np.ndarray]] # Chunks of uint32 natural IPs and their round trip times, NaN if unknown
+    """
+
+    ip_pattern = re.compile(rb'"' + re.escape(ip_field.encode()) + rb'"\s*:\s*"([^"]{0,64})"')
+    rtt_pattern = re.compile(rb'"' + re.escape(rtt_field.encode()) + rb'"\s*:\s*"?(-?[0-9.eE+\-]{1,32}|null)"?')
+
+    def matches(pattern: re.Pattern, data: bytes, line_starts: np.ndarray, width: int) -> tuple[np.ndarray, np.ndarray]:
+        """Returns the line and the zero padded value of the first match in each line"""
+
+        found = [(match.start(), match.group(1)) for match in pattern.finditer(data)]
+        if not found:
+            return np.zeros(0, dtype=np.int64), np.zeros((0, width), dtype=np.uint8)
+
+        positions, values = zip(*found)
+        lines = np.searchsorted(line_starts, np.array(positions), side='right') - 1
+        lines, first = np.unique(lines, return_index=True)
+        values = np.array(values, dtype=f"S{width + 1}")[first]
+        return lines, values.view(np.uint8).reshape(len(values), width + 1)
+
+    for data, _ in iter_line_chunks(file, chunk_size):
+        line_starts, _ = _line_bounds(np.frombuffer(data, dtype=np.uint8))
+
+        lines, fields = matches(ip_pattern, data, line_starts, IP_WIDTH)
+        naturals, valid = parse_dotted(fields)
+        rtts = np.full(len(line_starts), np.nan)
+        rtt_lines, rtt_fields = matches(rtt_pattern, data, line_starts, NUMBER_WIDTH)
+        rtts[rtt_lines] = parse_numbers(rtt_fields)
+
+        REGISTRY.counter("ingest_skipped").inc(len(line_starts) - int(valid.sum()))
+        yield naturals[valid], rtts[lines[valid]]
+
+
+def _record_offsets(data: np.ndarray, big: bool) -> tuple[np.ndarray, int]:
+    """
+    Returns the offsets of every whole pcap record in a buffer, and where the first incomplete record starts.
+    Captures are usually runs of records of the same length, so each run is guessed at once and then checked.
+    """
+
+    offsets = []
+    position = 0
+    while position + 16 <= len(data):
+        length = int(_u32(data, np.array([position + 8]), big)[0])
+        if length > MAX_RECORD:
+            raise ValueError(f"pcap record of {length} bytes, the capture is corrupt")
+
+        stride = 16 + length
+        amount = (len(data) - position) // stride
+        if amount == 0:
+            break
+
+        guesses = position + stride * np.arange(amount, dtype=np.int64)
+        same = _u32(data, np.minimum(guesses + 8, len(data) - 4), big) == length
+        run = amount if same.all() else int(np.argmin(same))
+        offsets.append(guesses[:run])
+        position = int(guesses[run - 1]) + stride
+
+    return np.concatenate(offsets) if offsets else np.zeros(0, dtype=np.int64), position
+
+
+def _ip_offsets(data: np.ndarray, packets: np.ndarray, linktype: int, big: bool) -> tuple[np.ndarray, np.ndarray]:
+    """Returns where the IPv4 header of each packet starts and which packets are IPv4"""
+
+    if linktype == LINKTYPE_ETHERNET:
+        ethertype = _u16(data, packets + 12)
+        tagged = ethertype == 0x8100
+        ethertype = np.where(tagged, _u16(data, packets + 16), ethertype)
+        return packets + np.where(tagged, 18, 14), ethertype == 0x0800
+    if linktype == LINKTYPE_SLL:
+        return packets + 16, _u16(data, packets + 14) == 0x0800
+    if linktype == LINKTYPE_SLL2:
+        return packets + 20, _u16(data, packets) == 0x0800
+    if linktype == LINKTYPE_NULL:
+        family = _u32(data, packets, big)
+        return packets + 4, (family == 2) | (family == 0x02000000)
+    if linktype in (LINKTYPE_RAW, LINKTYPE_IPV4, 12, 14):
+        return packets, np.ones(len(packets), dtype=bool)
+
+    raise ValueError(f"Unsupported pcap link type: {linktype}")
+
+
+def read_pcap(file: BinaryIO, chunk_size: int = 1 << 24) -> Iterator[tuple[np.ndarray, np.ndarray]]:
+    """
+    Reads ICMP echo replies from a pcap capture.
+    The round trip time of a reply is measured from the echo request with the same address, id and sequence number,
+    if the capture has it. Requests are only kept for RTT_MAX seconds, so memory stays bounded.
+
+    Parameters:
+        file: BinaryIO # The pcap file, pcapng isn't supported
+        chunk_size: int = 1 << 24 # Bytes read at once
+
+    Returns:
+        Iterator[tuple[np.ndarray, np.ndarray]] # Chunks of uint32 natural IPs that replied and their round trip times, NaN if unknown
+
+    Raises:
+        ValueError # If the file is not a pcap capture or has an unsupported link type
+    """
+
+    header = file.read(24)
+    if len(header) < 24:
+        raise ValueError("Not a pcap capture, the file is too short")
+
+    magic = int.from_bytes(header[:4], 'little')
+    if magic == PCAPNG_MAGIC:
+        raise ValueError("pcapng captures aren't supported, convert with: editcap -F pcap in.pcapng out.pcap")
+    if magic not in PCAP_MAGICS:
+        raise ValueError("Not a pcap capture")
+
+    big, resolution = PCAP_MAGICS[magic]
+    linktype = int.from_bytes(header[20:24], 'big' if big else 'little') & 0xFFFF
+
+    pending_keys = np.zeros(0, dtype=np.uint64)
+    pending_times = np.zeros(0)
+    leftover = b""
+    while chunk := file.read(chunk_size):
+        buffer = leftover + chunk
+        data = np.frombuffer(buffer, dtype=np.uint8)
+        records, end = _record_offsets(data, big)
+        leftover = buffer[end:]
+        if len(records) == 0:
+            continue
+
+        # Find ICMP echo packets
+        times = _u32(data, records, big) + _u32(data, records + 4, big) * resolution
+        lengths = _u32(data, records + 8, big).astype(np.int64)
+        packets = records + 16
+        last = len(data) - 1
+        ips, is_ipv4 = _ip_offsets(data, np.minimum(packets, last - 20), linktype, big)
+        ips = np.minimum(ips, last - 20)
+        header_lengths = (data[ips] & 15).astype(np.int64) * 4
+        icmps = np.minimum(ips + header_lengths, last - 8)
+        echo = is_ipv4 & (data[ips] >> 4 == 4) & (data[ips + 9] == 1) & (ips + header_lengths + 8 <= packets + lengths)
+        types = data[icmps]
+        sources, destinations = _u32(data, ips + 12), _u32(data, ips + 16)
+        ids_seqs = _u16(data, icmps + 4) << 16 | _u16(data, icmps + 6)
+
+        # Remember requests, newest last
+        requests = echo & (types == ICMP_ECHO_REQUEST)
+        keys = np.concatenate((pending_keys, destinations[requests].astype(np.uint64) << np.uint64(32) | ids_seqs[requests]))
+        request_times = np.concatenate((pending_times, times[requests]))
+        order = np.lexsort((request_times, keys))
+        keys, request_times = keys[order], request_times[order]
+
+        # Match replies to the latest request before them
+        replies = echo & (types == ICMP_ECHO_REPLY)
+        reply_keys = sources[replies].astype(np.uint64) << np.uint64(32) | ids_seqs[replies]
+        positions = np.searchsorted(keys, reply_keys, side='right') - 1
+        matched = (positions >= 0) & (keys[np.maximum(positions, 0)] == reply_keys) if len(keys) else np.zeros(len(reply_keys), dtype=bool)
+        rtts = np.where(matched, times[replies] - request_times[np.maximum(positions, 0)] if len(keys) else np.nan, np.nan)
+        rtts[rtts < 0] = np.nan
+
+        # Forget requests too old to be answered
+        keep = request_times >= times.max() - RTT_MAX
+        pending_keys, pending_times = keys[keep], request_times[keep]
+
+        yield sources[replies], rtts
+
+    if leftover:
+        print(f"Ignored {len(leftover)} bytes of a cut off record at the end of the capture")
+
+
+def read_results(format_: str, file: BinaryIO, ingest_settings: dict) -> Iterator[tuple[np.ndarray, np.ndarray]]:
+    """Reads a file of one of the FORMATS with the ingest settings"""
+
+    match format_:
+        case "csv":
+            return read_csv(file, ingest_settings["ip_field"], ingest_settings["rtt_field"], ingest_settings["chunk_size"])
+        case "jsonl":
+            return read_jsonl(file, ingest_settings["ip_field"], ingest_settings["rtt_field"], ingest_settings["chunk_size"])
+        case "pcap":
+            return read_pcap(file, ingest_settings["chunk_size"])
+        case other:
+            raise ValueError(f"Unknown format {format_!r}, expected one of {', '.join(FORMATS)}")
+
+
+def ingest(chunks: Iterator[tuple[np.ndarray, np.ndarray]], writer: BatchWriter, rtt_scale: float = 1.0, default_rtt: float = 0.1) -> int:
+    """
+    Writes imported results, every imported IP responded
+
+    Parameters:
+        chunks: Iterator[tuple[np.ndarray, np.ndarray]] # Chunks of natural IPs and round trip times, see read_results
+        writer: BatchWriter # Writes the results
+        rtt_scale: float = 1.0 # Seconds per unit of the round trip times
+        default_rtt: float = 0.1 # Round trip time in seconds of IPs without one
+
+    Returns:
+        int # The amount of IPs written
+    """
+
+    imported = REGISTRY.counter("ingest_records")
+    written = 0
+    for naturals, rtts in chunks:
+        rtts = np.asarray(rtts, dtype=np.float64) * rtt_scale
+        buckets = quantize_rtt(np.where(rtts > 0, rtts, default_rtt))
+
+        # Keep the last record of each IP
+        indexes = natural_to_index(np.asarray(naturals, dtype=np.uint32))[::-1]
+        indexes, last = np.unique(indexes, return_index=True)
+        writer.write(indexes, buckets[::-1][last])
+
+        imported.inc(len(naturals))
+        written += len(indexes)
+        print(f"Imported {written} ips", end='\r')
+
+    print()
+    writer.flush()
+    return written
+
+
+def main(format_: str, path: str, checked: list[str] | None = None, profile: bool = False) -> None:
+    """
+    Imports a file of results
+
+    Parameters:
+        format_: str # One of FORMATS
+        path: str # The file, - reads stdin
+        checked: list[str] | None = None # CIDR blocks, or files of them, the other scanner covered, added to the checked ranges
+        profile: bool = False # Profile each phase
+    """
+
+    settings_ = settings.load_settings()
+    layout = get_layout(settings.get_setting(settings_, "layout"))
+    ingest_settings = settings.get_setting(settings_, "ingest")
+    profile_settings = settings.get_setting(settings_, "profile")
+    profiler = Profiler(profile or profile_settings["enabled"], profile_settings["dir"])
+
+    store = ResultStore()
+    counts = PrefixCounts.load(store=store)
+    rank = RankIndex.load(store)
+    writer = BatchWriter(store, counts, rank, layout, ingest_settings["map_batch"])
+
+    with profiler.phase("import"):
+        file = sys.stdin.buffer if path == "-" else open(path, 'rb')
+        try:
+            written = ingest(read_results(format_, file, ingest_settings), writer, ingest_settings["rtt_scale"], ingest_settings["default_rtt"])
+        finally:
+            if file is not sys.stdin.buffer:
+                file.close()
+
+    with profiler.phase("checkpoint"):
+        counts.save()
+        rank.save()
+
+        # Only space the other scanner covered is checked, the imported IPs alone say nothing about the rest
+        if checked:
+            cidrs = []
+            for cidr in checked:
+                if os.path.exists(cidr):
+                    with open(cidr, 'rt') as cidr_file:
+                        cidrs += cidr_file.readlines()
+                else:
+                    cidrs.append(cidr)
+            save_checked_ranges(add_checked_ranges(load_checked_ranges(), ComplexIPrange.from_cidrs(cidrs)))
+
+    store.close()
+    print(f"Imported {written} ips")
+    profiler.print_summary()
+
+
+# Run
+if __name__ == "__main__":
+    args = [arg for arg in sys.argv[1:] if arg != "--profile"]
+    checked = [args[num + 1] for num, arg in enumerate(args[:-1]) if arg == "--checked"]
+    args = [arg for num, arg in enumerate(args) if arg != "--checked" and (num == 0 or args[num - 1] != "--checked")]
+
+    if len(args) != 2 or args[0] not in FORMATS:
+        print(f"Usage: python -m src.ingest <{'|'.join(FORMATS)}> <path | -> [--checked <cidr | file>]... [--profile]")
+    else:
+        main(args[0], args[1], checked, "--profile" in sys.argv)
@@ -7,13 +7,89 @@
 from __future__ import annotations
 
 from collections.abc import Iterable
-from typing import Any
+from multiprocessing.shared_memory import SharedMemory
+from typing import Any, BinaryIO
 
+import numpy as np
+
+from src.cidr import cidrs_to_intervals, dotted_parts, format_cidr, intervals_to_cidrs, iter_cidr_file, join_parts, merge_intervals, parse_cidr_lines, parse_dotted, rotate_intervals
 from src.global_methods import isntinstance, iter_2_items, staticproperty
+from src.layout import index_to_natural, natural_to_index
 from src.typing_ import IndexTypeError, IPOverflowError, IPValueError, OctetIndexError, SliceError
 
 
 # Definitions
+CIDR_BATCH = 65536 # Lines parsed at once when reading CIDR blocks from an iterable
+
+
+def _ranges_to_cidrs(starts: np.ndarray, stops: np.ndarray) -> list[str]:
+    """Returns the fewest CIDR blocks that cover index ranges"""
+
+    naturals, prefix_lengths = intervals_to_cidrs(*rotate_intervals(starts, stops))
+    return [format_cidr(natural, prefix_length) for natural, prefix_length in zip(naturals.tolist(), prefix_lengths.tolist())]
+
+
+def _ips_from_indexes(indexes: np.ndarray) -> list[IP]:
+    """Returns the IPs of many indexes, the index 4294967296 is IP.last_ip"""
+
+    indexes = np.asarray(indexes, dtype=np.uint64)
+    octets = ((indexes >> np.uint64(8)) & np.uint64(255), indexes & np.uint64(255), indexes >> np.uint64(24), (indexes >> np.uint64(16)) & np.uint64(255))
+    return [IP(a, b, c, d, _force_create=True) for a, b, c, d in zip(*(octet.tolist() for octet in octets))]
+
+
+def _iter_blocks(starts: np.ndarray, stops: np.ndarray, block_size: int, aligned: bool, ip_arrays: bool) -> Iterable[tuple[int, int] | IPArray]:
+    """Yields the blocks of index ranges, see ComplexIPrange.iter_blocks"""
+
+    if block_size < 1:
+        raise ValueError(f"Block size must be at least 1, not {block_size}")
+    if aligned and block_size & (block_size - 1):
+        raise ValueError(f"Aligned block size must be a power of two, not {block_size}")
+
+    return _blocks(starts, stops, block_size, aligned, ip_arrays)
+
+
+def _blocks(starts: np.ndarray, stops: np.ndarray, block_size: int, aligned: bool, ip_arrays: bool) -> Iterable[tuple[int, int] | IPArray]:
+    """The generator of _iter_blocks, so bad arguments raise right away"""
+
+    # Pieces of the IPArray block being filled
+    pieces, amount, window = [], 0, None
+
+    for start, stop in zip(starts.tolist(), stops.tolist()):
+        while start < stop:
+            if aligned:
+                end = min(stop, (start // block_size + 1) * block_size)
+            else:
+                end = min(stop, start + block_size - amount)
+
+            if not ip_arrays:
+                yield start, end - start
+                start = end
+                continue
+
+            # An aligned block ends where its window does, even if it isn't full
+            if aligned and pieces and start // block_size != window:
+                yield _expand_pieces(pieces)
+                pieces, amount = [], 0
+
+            pieces.append((start, end))
+            amount += end - start
+            window = start // block_size
+            if amount == block_size:
+                yield _expand_pieces(pieces)
+                pieces, amount = [], 0
+
+            start = end
+
+    if pieces:
+        yield _expand_pieces(pieces)
+
+
+def _expand_pieces(pieces: list[tuple[int, int]]) -> IPArray:
+    """Returns the IPs of index ranges"""
+
+    return IPArray(np.concatenate([np.arange(start, stop, dtype=np.int64) for start, stop in pieces]).astype(np.uint32))
+
+
 class IP:
     """An IP object"""
 
@@ -371,6 +447,32 @@ class IPrange:
             raise IPValueError(f"Start ip cannot be ahead in range than stop ip: ({str(start_ip)} > {str(stop_ip)})")
 
 
+    @staticmethod
+    def from_cidr(cidr: str) -> IPrange | ComplexIPrange:
+        """
+        Returns the IPs of a CIDR block.
+        Only /0 and /32 blocks are one range in index order, other blocks are a ComplexIPrange.
+
+        Parameters:
+            cidr: str # The CIDR block, like "10.0.0.0/8", a lone IP is a /32
+
+        Returns:
+            IPrange | ComplexIPrange # The IPs of the block
+
+        Raises:
+            ValueError # If the text is not a CIDR block or has host bits set
+
+        Usage:
+        >>> IPrange.from_cidr("1.2.3.4")
+        IPrange(IP(1,2,3,4), IP(1,3,3,4))
+        >>> len(IPrange.from_cidr("10.0.0.0/8").ranges)
+        65536
+        """
+
+        out = ComplexIPrange.from_cidrs([cidr])
+        return out.ranges[0] if len(out.ranges) == 1 else out
+
+
     # Properties and similar methods
     @property
     def start_ip(self) -> IP:
@@ -386,6 +488,12 @@ class IPrange:
         return f"IPrange({repr(self._start_ip)}, {repr(self._stop_ip)})"
 
 
+    def to_arrays(self) -> tuple[np.ndarray, np.ndarray]:
+        """Returns the start and stop index of the range as uint64 arrays of one element, see ComplexIPrange.to_arrays"""
+
+        return np.array([self._start_ip.to_index], dtype=np.uint64), np.array([self._stop_ip.to_index], dtype=np.uint64)
+
+
     # Comparison
     def __eq__(self, other: IPrange) -> bool:
         try:
@@ -420,15 +528,25 @@ class IPrange:
         self.iter_index += 1
 
         # Stop iteration if end
-        if len(self) == 0:
-            raise StopIteration
-        if self.stop_ip == self[self.iter_index]:
+        if self.iter_index >= len(self):
             raise StopIteration
 
         # Return IP
         return self[self.iter_index]
 
 
+    def iter_blocks(self, block_size: int, aligned: bool = False, ip_arrays: bool = False) -> Iterable[tuple[int, int] | IPArray]:
+        """
+        Yields the range in blocks of up to block_size IPs in index order, see ComplexIPrange.iter_blocks
+
+        Usage:
+        >>> list(IPrange(IP(0,0,0,0), IP(0,2,0,0)).iter_blocks(1, aligned=True))
+        [(0, 1), (1, 1)]
+        """
+
+        return _iter_blocks(*self.to_arrays(), block_size, aligned, ip_arrays)
+
+
     # List-like methods
     def __getitem__(self, other: int | slice) -> IP | IPrange:
         # Index
@@ -490,10 +608,26 @@ class IPrange:
         return self._stop_ip - self._start_ip
 
 
+    def to_cidrs(self) -> list[str]:
+        """
+        Returns the fewest CIDR blocks that cover the range
+
+        Usage:
+        >>> IPrange(IP(0,0,10,0), IP(0,0,11,0)).to_cidrs()
+        ['0.0.10.0/24', '0.1.10.0/24', ..., '255.255.10.0/24']
+        """
+
+        return _ranges_to_cidrs(*self.to_arrays())
+
+
 class ComplexIPrange:
-    """A complex range of multiple IPranges"""
+    """
+    A complex range of multiple IPranges.
+    It can also be kept as two arrays of start and stop indexes, see from_arrays, the IPranges are then only made when they are needed.
+    """
 
-    _ranges = []
+    _range_list = None # The IPranges, None until they are needed if the range was made from arrays
+    _arrays = None     # The start and stop indexes, None until they are needed
 
     # Init
     def __init__(self, ranges: list[IPrange], *, _trust_contain=False) -> None:
@@ -549,12 +683,186 @@ class ComplexIPrange:
         self._merge()
 
 
+    @staticmethod
+    def from_cidrs(cidrs: Iterable[str] | BinaryIO) -> ComplexIPrange:
+        """
+        Returns the IPs of many CIDR blocks, which may overlap.
+        The blocks are parsed in chunks and kept as merged intervals, so memory depends on the blocks left after merging.
+
+        Parameters:
+            cidrs: Iterable[str] | BinaryIO # The CIDR blocks or lone IPs, or a binary file of them, one per line. Everything after a # is a comment.
+
+        Returns:
+            ComplexIPrange # The IPs of the blocks
+
+        Raises:
+            ValueError # If a line is not a CIDR block or an IP, or has host bits set
+
+        Usage:
+        >>> ComplexIPrange.from_cidrs(["10.0.0.0/9", "10.128.0.0/9"]).to_cidrs()
+        ['10.0.0.0/8']
+        >>> with open("blocks.txt", 'rb') as file:
+        ...     blocks = ComplexIPrange.from_cidrs(file)
+        """
+
+        def chunks() -> Iterable[tuple[np.ndarray, np.ndarray]]:
+            if hasattr(cidrs, 'read'):
+                yield from iter_cidr_file(cidrs)
+                return
+
+            batch, line = [], 1
+            for cidr in cidrs:
+                batch.append(cidr.strip())
+                if len(batch) == CIDR_BATCH:
+                    yield parse_cidr_lines("\n".join(batch).encode(), line)
+                    batch, line = [], line + CIDR_BATCH
+
+            if batch:
+                yield parse_cidr_lines("\n".join(batch).encode(), line)
+
+        # Merge the blocks in natural order, where they are contiguous
+        starts, stops = np.zeros(0, dtype=np.uint64), np.zeros(0, dtype=np.uint64)
+        for naturals, prefix_lengths in chunks():
+            new_starts, new_stops = cidrs_to_intervals(naturals, prefix_lengths)
+            starts, stops = merge_intervals(np.concatenate((starts, new_starts)), np.concatenate((stops, new_stops)))
+
+        return ComplexIPrange.from_arrays(*rotate_intervals(starts, stops))
+
+
+    @staticmethod
+    def from_arrays(starts: np.ndarray, stops: np.ndarray) -> ComplexIPrange:
+        """
+        Returns a range from the start and stop indexes of sorted ranges in O(n).
+        The arrays are used as they are unless ranges touch or are empty, so they can be views of shared memory.
+        The IPranges are only made when something needs them.
+
+        Parameters:
+            starts: np.ndarray # The start indexes of the ranges
+            stops: np.ndarray # The stop indexes of the ranges, 4294967296 is IP.last_ip
+
+        Returns:
+            ComplexIPrange # The range
+
+        Raises:
+            IPValueError # If the ranges aren't sorted, overlap or a range starts after it stops
+            IndexError # If an index is over 4294967296
+
+        Usage:
+        >>> ComplexIPrange.from_arrays(np.array([0, 512]), np.array([256, 1024]))
+        ComplexIPrange([IPrange(IP(0,0,0,0), IP(1,0,0,0)), IPrange(IP(2,0,0,0), IP(4,0,0,0))])
+        """
+
+        starts, stops = np.asarray(starts, dtype=np.uint64), np.asarray(stops, dtype=np.uint64)
+        if len(starts) != len(stops):
+            raise ValueError(f"There are {len(starts)} starts but {len(stops)} stops")
+
+        if len(starts) > 0:
+            if np.any(starts > stops):
+                raise IPValueError("Start index cannot be ahead of stop index")
+            if np.any(starts[1:] < stops[:-1]):
+                raise IPValueError("Ranges must be sorted and cannot contain each other or parts of each other")
+            if stops[-1] > 1 << 32:
+                raise IndexError(f"Index expected to be in range 0-4294967296, not {stops[-1]}")
+
+        # Drop empty ranges and merge ranges that touch
+        if np.any(starts == stops):
+            starts, stops = starts[starts != stops], stops[starts != stops]
+        apart = starts[1:] != stops[:-1]
+        if not apart.all():
+            starts, stops = starts[np.concatenate(([True], apart))], stops[np.concatenate((apart, [True]))]
+
+        out = object.__new__(ComplexIPrange)
+        out._arrays = (starts.view(), stops.view())
+        for array in out._arrays:
+            array.flags.writeable = False
+        return out
+
+
+    @staticmethod
+    def from_shared_memory(shm: SharedMemory) -> ComplexIPrange:
+        """
+        Returns a range backed by a shared memory block made by to_shared_memory, without copying the indexes.
+        The block must stay open while the range is used.
+
+        Usage:
+        >>> shm = SharedMemory(name)
+        >>> range_ = ComplexIPrange.from_shared_memory(shm)
+        """
+
+        block = np.ndarray((shm.size // 8,), dtype=np.uint64, buffer=shm.buf)
+        amount = int(block[0])
+        return ComplexIPrange.from_arrays(block[1:1 + amount], block[1 + amount:1 + 2 * amount])
+
+
     # Properties and similar methods
     @property
     def ranges(self) -> list[IPrange]:
         return self._ranges
 
 
+    @property
+    def _ranges(self) -> list[IPrange]:
+        if self._range_list == None:
+            starts, stops = self._arrays
+            self._range_list = [IPrange(start_ip, stop_ip) for start_ip, stop_ip in zip(_ips_from_indexes(starts), _ips_from_indexes(stops))]
+        return self._range_list
+
+
+    @_ranges.setter
+    def _ranges(self, ranges: list[IPrange]) -> None:
+        self._range_list = ranges
+        self._arrays = None
+
+
+    def to_arrays(self) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Returns the start and stop indexes of the ranges in O(n), they are read only.
+        Stop indexes can be 4294967296 for IP.last_ip, so both are uint64.
+
+        Returns:
+            tuple[np.ndarray, np.ndarray] # The uint64 start and stop indexes
+
+        Usage:
+        >>> ComplexIPrange([IPrange(IP(1,0,0,0), IP(1,0,2,0))]).to_arrays()
+        (array([256], dtype=uint64), array([33554688], dtype=uint64))
+
+        A CIDR block is a run of natural values, not of indexes, so a /16 is 65536 runs of one IP:
+        >>> starts, stops = ComplexIPrange.from_cidrs(["1.0.0.0/16"]).to_arrays()
+        >>> starts[:3], stops[:3], len(starts)
+        (array([   256,  65792, 131328], dtype=uint64), array([   257,  65793, 131329], dtype=uint64), 65536)
+        """
+
+        if self._arrays == None:
+            ranges = self._ranges
+            starts = np.fromiter((range_.start_ip.to_index for range_ in ranges), dtype=np.uint64, count=len(ranges))
+            stops = np.fromiter((range_.stop_ip.to_index for range_ in ranges), dtype=np.uint64, count=len(ranges))
+            starts.flags.writeable = stops.flags.writeable = False
+            self._arrays = (starts, stops)
+
+        return self._arrays
+
+
+    def to_shared_memory(self) -> SharedMemory:
+        """
+        Copies the ranges into a new shared memory block, so other processes can use them with from_shared_memory.
+        The block is the amount of ranges, the start indexes then the stop indexes, all uint64.
+        The caller closes and unlinks the block.
+
+        Usage:
+        >>> shm = range_.to_shared_memory()
+        >>> process = Process(target=work, args=(shm.name,))
+        """
+
+        starts, stops = self.to_arrays()
+        shm = SharedMemory(create=True, size=(1 + 2 * len(starts)) * 8)
+        block = np.ndarray((1 + 2 * len(starts),), dtype=np.uint64, buffer=shm.buf)
+        block[0] = len(starts)
+        block[1:1 + len(starts)] = starts
+        block[1 + len(starts):] = stops
+        del block
+        return shm
+
+
     def __repr__(self) -> str:
         return f"ComplexIPrange([{', '.join([repr(range_) for range_ in self._ranges])}])"
 
@@ -580,6 +888,38 @@ class ComplexIPrange:
         return out
 
 
+    def iter_blocks(self, block_size: int, aligned: bool = False, ip_arrays: bool = False) -> Iterable[tuple[int, int] | IPArray]:
+        """
+        Yields the range in blocks of up to block_size IPs in index order, each in O(1) from the range arrays.
+        Aligned blocks never cross a multiple of block_size in index order, the boundaries the result store, the rank index and shards are cut at.
+        A CIDR block smaller than /0 isn't one run in index order, so aligned blocks are aligned in index order, not to CIDR blocks.
+
+        Parameters:
+            block_size: int # The most IPs in a block, a power of two if aligned
+            aligned: bool = False # Cut the blocks at multiples of block_size
+            ip_arrays: bool = False # Yield an IPArray per block instead of (start_index, count)
+
+        Yields:
+            tuple[int, int] # The start index and amount of IPs of a run of the range, runs never span two ranges
+            IPArray # Or the IPs of a block, exactly block_size IPs taken across ranges except for the last block,
+                    # or the IPs of the range in one aligned window of block_size if aligned
+
+        Raises:
+            ValueError # If block_size is below 1, or not a power of two when aligned
+
+        Usage:
+        >>> range_ = ComplexIPrange.from_arrays(np.array([0, 10]), np.array([6, 12]))
+        >>> list(range_.iter_blocks(4))
+        [(0, 4), (4, 2), (10, 2)]
+        >>> [ips.indexes.tolist() for ips in range_.iter_blocks(4, ip_arrays=True)]
+        [[0, 1, 2, 3], [4, 5, 10, 11]]
+        >>> list(range_.iter_blocks(4, aligned=True))
+        [(0, 4), (4, 2), (10, 2)]
+        """
+
+        return _iter_blocks(*self.to_arrays(), block_size, aligned, ip_arrays)
+
+
     # List-like methods
     def __getitem__(self, other: int | slice) -> IP | IPrange | ComplexIPrange:
         # Index
@@ -724,7 +1064,20 @@ class ComplexIPrange:
 
 
     def __len__(self) -> int:
-        return sum(len(range_) for range_ in self._ranges)
+        starts, stops = self.to_arrays()
+        return int((stops - starts).sum())
+
+
+    def to_cidrs(self) -> list[str]:
+        """
+        Returns the fewest CIDR blocks that cover the range
+
+        Usage:
+        >>> ComplexIPrange.from_cidrs(["10.0.0.0/8", "11.0.0.0/8"]).to_cidrs()
+        ['10.0.0.0/7']
+        """
+
+        return _ranges_to_cidrs(*self.to_arrays())
 
 
     def _merge(self) -> None:
@@ -775,14 +1128,217 @@ class ComplexIPrange:
         crange1 = ComplexIPrange(IPrange(IP(1,0,0,0), IP(2,0,0,0)), IPrange(IP(3,0,0,0), IP(4,0,0,0)))
         """
 
-        out_ranges = []
-        if self._ranges[0].start_ip != IP(0,0,0,0):
-            out_ranges.append(IPrange(IP(0,0,0,0), self._ranges[0][0]))
+        # The gaps between the ranges, and before the first and after the last
+        starts, stops = self.to_arrays()
+        return ComplexIPrange.from_arrays(np.concatenate(([0], stops)), np.concatenate((starts, [1 << 32])))
+
+
+class IPArray:
+    """
+    Many IPs in one uint32 array of their indexes, see IP.to_index.
+    Octets, dotted text, comparisons and range checks work on the whole array at once, without an IP object per address.
+
+    Usage:
+    >>> ips = IPArray.from_strings(["1.2.3.4", "8.8.8.8"])
+    >>> ips.a
+    array([1, 8], dtype=uint8)
+    >>> ips.to_strings()
+    ['1.2.3.4', '8.8.8.8']
+    >>> ips.in_range(IPrange.from_cidr("8.0.0.0/8"))
+    array([False,  True])
+    """
+
+    __hash__ = None # Comparisons are per IP, like numpy arrays
+
+    # Init
+    def __init__(self, indexes: np.ndarray | Iterable[int] = ()) -> None:
+        """
+        Parameters:
+            indexes: np.ndarray | Iterable[int] = () # The indexes of the IPs, an array that is already uint32 is not copied
+
+        Raises:
+            IndexError # If an index is not in range 0-4294967295
+        """
+
+        if isinstance(indexes, np.ndarray) and indexes.dtype == np.uint32:
+            self._indexes = indexes
+            return
+
+        indexes = np.asarray(indexes if isinstance(indexes, np.ndarray) else list(indexes), dtype=np.int64)
+        if len(indexes) > 0 and (indexes.min() < 0 or indexes.max() >= 1 << 32):
+            raise IndexError("Index expected to be in range 0-4294967295")
+        self._indexes = indexes.astype(np.uint32)
+
+
+    @staticmethod
+    def from_ips(ips: Iterable[IP]) -> IPArray:
+        """Returns the array of IP objects"""
+
+        return IPArray(np.fromiter((ip.to_index for ip in ips), dtype=np.uint32))
+
+
+    @staticmethod
+    def from_naturals(naturals: np.ndarray) -> IPArray:
+        """Returns the array of natural integer values of IPs, where 1.2.3.4 is 0x01020304"""
+
+        return IPArray(natural_to_index(naturals))
+
+
+    @staticmethod
+    def from_strings(strings: Iterable[str]) -> IPArray:
+        """
+        Parses dotted IPs all at once
+
+        Raises:
+            ValueError # If a string is not a dotted IP
+
+        Usage:
+        >>> IPArray.from_strings(["1.2.3.4", "10.0.0.1"])
+        IPArray(['1.2.3.4', '10.0.0.1'])
+        """
+
+        # One more column than the longest IP, so longer strings are caught
+        try:
+            fields = np.char.strip(np.array(list(strings), dtype="S16"))
+        except UnicodeEncodeError:
+            raise ValueError("IPs can only contain digits and dots")
+        fields = fields.astype("S16").view(np.uint8).reshape(len(fields), 16)
+
+        naturals, valid = parse_dotted(fields[:, :15])
+        valid &= fields[:, 15] == 0
+        if not valid.all():
+            bad = int(np.argmin(valid))
+            raise ValueError(f"Not a dotted IP: {fields[bad].tobytes().rstrip(bytes(1)).decode()!r}")
+
+        return IPArray.from_naturals(naturals)
+
+
+    # Properties and similar methods
+    @property
+    def indexes(self) -> np.ndarray:
+        return self._indexes
+
+
+    @property
+    def naturals(self) -> np.ndarray:
+        """The natural integer values of the IPs, where 1.2.3.4 is 0x01020304"""
+
+        return index_to_natural(self._indexes)
+
+
+    @property
+    def octets(self) -> np.ndarray:
+        """The octets of every IP as a (n, 4) uint8 array, in the order a, b, c, d"""
+
+        return self.naturals.astype('>u4').view(np.uint8).reshape(len(self), 4)
+
+
+    @property
+    def a(self) -> np.ndarray:
+        return ((self._indexes >> np.uint32(8)) & np.uint32(255)).astype(np.uint8)
+
+
+    @property
+    def b(self) -> np.ndarray:
+        return (self._indexes & np.uint32(255)).astype(np.uint8)
+
+
+    @property
+    def c(self) -> np.ndarray:
+        return (self._indexes >> np.uint32(24)).astype(np.uint8)
+
+
+    @property
+    def d(self) -> np.ndarray:
+        return ((self._indexes >> np.uint32(16)) & np.uint32(255)).astype(np.uint8)
+
+
+    def to_bytes(self, separator: bytes = b"\n") -> bytes:
+        """Returns the dotted IPs, each followed by the separator"""
+
+        return join_parts(dotted_parts(self.naturals) + [separator], len(self))
+
+
+    def to_strings(self) -> list[str]:
+        """Returns the dotted IPs"""
+
+        return self.to_bytes().decode().split("\n")[:-1]
+
+
+    def to_ips(self) -> list[IP]:
+        """Returns an IP object per IP"""
+
+        return _ips_from_indexes(self._indexes)
+
+
+    def in_range(self, range_: IPrange | ComplexIPrange) -> np.ndarray:
+        """Returns which IPs are in a range, with one binary search per IP"""
+
+        starts, stops = range_.to_arrays()
+        positions = np.searchsorted(starts, self._indexes, side='right') - 1
+        return (positions >= 0) & (self._indexes < stops[np.maximum(positions, 0)])
+
+
+    def __repr__(self) -> str:
+        return f"IPArray({self.to_strings()})"
+
+
+    def __len__(self) -> int:
+        return len(self._indexes)
+
+
+    # Iteration methods
+    def __iter__(self) -> Iterable:
+        return iter(self.to_ips())
+
+
+    # List-like methods
+    def __getitem__(self, other: int | slice | np.ndarray) -> IP | IPArray:
+        if isinstance(other, (int, np.integer)):
+            return IP.from_index(int(self._indexes[other]))
+
+        return IPArray(self._indexes[other])
+
+
+    def __contains__(self, other: IP) -> bool:
+        # Other must be an IP
+        if isntinstance(other, IP):
+            raise TypeError(f"IPArray can only check for IP inside of itself, not {other.__class__.__name__}")
+
+        return bool(np.any(self._indexes == other.to_index))
+
+
+    # Comparison, per IP against an IP, an index or an IPArray of the same length
+    def _other_indexes(self, other: IP | int | IPArray) -> np.ndarray | int:
+        if isinstance(other, IP):
+            return other.to_index
+        if isinstance(other, IPArray):
+            return other._indexes
+        if isinstance(other, (int, np.integer)):
+            return int(other)
+
+        raise TypeError(f"IPArray can only be compared to an IP, an index or an IPArray, not {other.__class__.__name__}")
+
+
+    def __eq__(self, other: IP | int | IPArray) -> np.ndarray:
+        return self._indexes == self._other_indexes(other)
+
+
+    def __ne__(self, other: IP | int | IPArray) -> np.ndarray:
+        return self._indexes != self._other_indexes(other)
+
+
+    def __lt__(self, other: IP | int | IPArray) -> np.ndarray:
+        return self._indexes < self._other_indexes(other)
+
+
+    def __le__(self, other: IP | int | IPArray) -> np.ndarray:
+        return self._indexes <= self._other_indexes(other)
+
 
-        for range1, range2 in iter_2_items(self._ranges):
-            out_ranges.append(IPrange(range1[-1] + 1, range2[0]))
+    def __gt__(self, other: IP | int | IPArray) -> np.ndarray:
+        return self._indexes > self._other_indexes(other)
 
-        if self._ranges[-1].stop_ip != IP.last_ip:
-            out_ranges.append(IPrange(self._ranges[-1][-1] + 1, IP.last_ip))
 
-        return ComplexIPrange(out_ranges)
\ No newline at end of file
+    def __ge__(self, other: IP | int | IPArray) -> np.ndarray:
+        return self._indexes >= self._other_indexes(other)
@@ -0,0 +1,276 @@
+# layout.py
+# Maps IP indexes to pixels on the maps and back
+# Every function here works on whole numpy arrays at once, so millions of coordinates can be converted in one call
+
+
+# Imports
+from __future__ import annotations
+
+import numpy as np
+
+from src.typing_ import SettingsError
+
+
+# Definitions
+MAP_SIZE = 65536    # Width and height of the whole map in pixels
+TILE_SIZE = 8192    # Width and height of a single map image
+TILES_PER_ROW = MAP_SIZE // TILE_SIZE
+TILE_AMOUNT = TILES_PER_ROW ** 2
+
+
+def index_to_natural(indexes: np.ndarray) -> np.ndarray:
+    """
+    Converts IP indexes (see IP.to_index) to natural integer values of the IPs.
+    IP.to_index orders the octets (c, d, a, b), the natural value orders them (a, b, c, d),
+    so the conversion is a rotation by 16 bits.
+
+    Parameters:
+        indexes: np.ndarray # The indexes, any integer dtype
+
+    Returns:
+        np.ndarray[uint32] # The natural values
+
+    Usage:
+    >>> index_to_natural(np.array([IP(1,2,3,4).to_index]))
+    array([16909060], dtype=uint32)
+    """
+
+    indexes = np.asarray(indexes, dtype=np.uint32)
+    return (indexes << np.uint32(16)) | (indexes >> np.uint32(16))
+
+
+def natural_to_index(naturals: np.ndarray) -> np.ndarray:
+    """
+    Converts natural integer values of IPs to IP indexes.
+    The rotation by 16 bits is its own inverse.
+
+    Parameters:
+        naturals: np.ndarray # The natural values, any integer dtype
+
+    Returns:
+        np.ndarray[uint32] # The indexes
+    """
+
+    return index_to_natural(naturals)
+
+
+class Layout:
+    """
+    Base class for a layout, which places every IP index on a pixel of the 65536x65536 map.
+    Child classes define to_pixels and from_pixels, the tile handling is shared.
+    """
+
+    name = None
+
+
+    # Methods to be defined
+    def to_pixels(self, indexes: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Returns the x and y coordinates on the whole map for each index.
+        This must be defined in the child class.
+        """
+
+        raise NotImplementedError("This method should never be called. Define it in child class instead.")
+
+
+    def from_pixels(self, xs: np.ndarray, ys: np.ndarray) -> np.ndarray:
+        """
+        Returns the index for each pair of x and y coordinates on the whole map.
+        This must be defined in the child class.
+        """
+
+        raise NotImplementedError("This method should never be called. Define it in child class instead.")
+
+
+    # Tile methods
+    def forward(self, indexes: np.ndarray) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        Converts indexes to the tile they are on and the coordinates inside that tile
+
+        Parameters:
+            indexes: np.ndarray # The IP indexes
+
+        Returns:
+            tuple[np.ndarray, np.ndarray, np.ndarray] # Zero based tile numbers, x and y inside the tile
+
+        Usage:
+        >>> OctetLayout().forward(np.array([IP(32,0,0,1).to_index]))
+        (array([1], dtype=uint32), array([0], dtype=uint32), array([1], dtype=uint32))
+        """
+
+        xs, ys = self.to_pixels(indexes)
+        tiles = (ys // TILE_SIZE) * TILES_PER_ROW + xs // TILE_SIZE
+        return tiles, xs % TILE_SIZE, ys % TILE_SIZE
+
+
+    def inverse(self, tiles: np.ndarray, xs: np.ndarray, ys: np.ndarray) -> np.ndarray:
+        """
+        Converts tile numbers and coordinates inside the tiles back to indexes
+
+        Parameters:
+            tiles: np.ndarray # Zero based tile numbers
+            xs: np.ndarray # x inside the tile
+            ys: np.ndarray # y inside the tile
+
+        Returns:
+            np.ndarray[uint32] # The IP indexes
+        """
+
+        tiles = np.asarray(tiles, dtype=np.uint32)
+        xs = np.asarray(xs, dtype=np.uint32) + (tiles % TILES_PER_ROW) * TILE_SIZE
+        ys = np.asarray(ys, dtype=np.uint32) + (tiles // TILES_PER_ROW) * TILE_SIZE
+        return self.from_pixels(xs, ys)
+
+
+    @staticmethod
+    def tile_position(tile: int) -> tuple[int, int]:
+        """Returns the position of the top left corner of a zero based tile on the whole map"""
+
+        return (tile % TILES_PER_ROW) * TILE_SIZE, (tile // TILES_PER_ROW) * TILE_SIZE
+
+
+class OctetLayout(Layout):
+    """
+    The original layout.
+    Octets (a, b) are the x coordinate and octets (c, d) are the y coordinate,
+    so the map is simply the index space written row by row.
+    """
+
+    name = "octet"
+
+
+    def to_pixels(self, indexes: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        indexes = np.asarray(indexes, dtype=np.uint32)
+        return indexes & np.uint32(0xFFFF), indexes >> np.uint32(16)
+
+
+    def from_pixels(self, xs: np.ndarray, ys: np.ndarray) -> np.ndarray:
+        xs = np.asarray(xs, dtype=np.uint32)
+        ys = np.asarray(ys, dtype=np.uint32)
+        return (ys << np.uint32(16)) | xs
+
+
+class HilbertLayout(Layout):
+    """
+    Places the natural IP values along a Hilbert curve.
+    Every CIDR block with an even prefix length becomes a square on the map,
+    odd prefix lengths become a rectangle of two squares.
+
+    The curve is walked 8 levels (16 bits) at a time with lookup tables,
+    the tables hold the 8 level result for each of the 4 orientations of the curve.
+    """
+
+    name = "hilbert"
+
+    # Lookup tables, built on first use
+    _to_pixels_table = None   # Index: state << 16 | 16 bits of the value; Entry: x byte | y byte << 8 | new state << 16
+    _from_pixels_table = None # Index: state << 16 | x byte | y byte << 8; Entry: 16 bits of the value | new state << 16
+
+
+    def __init__(self) -> None:
+        if HilbertLayout._to_pixels_table is None:
+            HilbertLayout._to_pixels_table, HilbertLayout._from_pixels_table = self._build_tables()
+
+
+    @staticmethod
+    def _build_nibble_tables() -> tuple[np.ndarray, np.ndarray]:
+        """
+        Builds the tables for 4 levels (8 bits) of the curve.
+        The state is the orientation of the curve: bit 0 is if x and y are swapped, bit 1 if they are complemented.
+        """
+
+        to_pixels = np.zeros((4, 256), dtype=np.uint32)
+        from_pixels = np.zeros((4, 256), dtype=np.uint32)
+        for state in range(4):
+            for byte in range(256):
+                swapped, complemented = state & 1, state >> 1
+                x = y = 0
+                for level in range(3, -1, -1):
+                    # Get the quadrant of this level
+                    digit = (byte >> (2 * level)) & 3
+                    rx = digit >> 1
+                    ry = (digit ^ rx) & 1
+
+                    # Orient it
+                    if swapped:
+                        rx, ry = ry, rx
+                    if complemented:
+                        rx, ry = rx ^ 1, ry ^ 1
+                    x |= rx << level
+                    y |= ry << level
+
+                    # The first quadrant is swapped and the last one is swapped and complemented
+                    swapped ^= digit in (0, 3)
+                    complemented ^= digit == 3
+
+                new_state = swapped | complemented << 1
+                to_pixels[state, byte] = x | y << 4 | new_state << 8
+                from_pixels[state, x | y << 4] = byte | new_state << 8
+
+        return to_pixels, from_pixels
+
+
+    @classmethod
+    def _build_tables(cls) -> tuple[np.ndarray, np.ndarray]:
+        """Combines two 4 level tables into the 8 level tables"""
+
+        nibble_to_pixels, nibble_from_pixels = cls._build_nibble_tables()
+        states = np.repeat(np.arange(4, dtype=np.uint32), 65536)
+        words = np.tile(np.arange(65536, dtype=np.uint32), 4)
+
+        # Value to pixels, the high byte of the value comes first
+        high = nibble_to_pixels[states, words >> 8]
+        low = nibble_to_pixels[high >> 8, words & 0xFF]
+        x_bytes = (high & 0xF) << 4 | (low & 0xF)
+        y_bytes = ((high >> 4) & 0xF) << 4 | ((low >> 4) & 0xF)
+        to_pixels = x_bytes | y_bytes << 8 | (low >> 8) << 16
+
+        # Pixels to value, the high nibbles of x and y come first
+        x_bytes, y_bytes = words & 0xFF, words >> 8
+        high = nibble_from_pixels[states, (x_bytes >> 4) | (y_bytes >> 4) << 4]
+        low = nibble_from_pixels[high >> 8, (x_bytes & 0xF) | (y_bytes & 0xF) << 4]
+        from_pixels = (high & 0xFF) << 8 | (low & 0xFF) | (low >> 8) << 16
+
+        return to_pixels.astype(np.uint32), from_pixels.astype(np.uint32)
+
+
+    def to_pixels(self, indexes: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        naturals = index_to_natural(indexes)
+        table = self._to_pixels_table
+
+        high = table[naturals >> np.uint32(16)]
+        low = table[((high >> np.uint32(16)) << np.uint32(16)) | (naturals & np.uint32(0xFFFF))]
+
+        xs = ((high & np.uint32(0xFF)) << np.uint32(8)) | (low & np.uint32(0xFF))
+        ys = (high & np.uint32(0xFF00)) | ((low >> np.uint32(8)) & np.uint32(0xFF))
+        return xs, ys
+
+
+    def from_pixels(self, xs: np.ndarray, ys: np.ndarray) -> np.ndarray:
+        xs = np.asarray(xs, dtype=np.uint32)
+        ys = np.asarray(ys, dtype=np.uint32)
+        table = self._from_pixels_table
+
+        high = table[(xs >> np.uint32(8)) | ((ys >> np.uint32(8)) << np.uint32(8))]
+        low = table[((high >> np.uint32(16)) << np.uint32(16)) | (xs & np.uint32(0xFF)) | ((ys & np.uint32(0xFF)) << np.uint32(8))]
+
+        naturals = ((high & np.uint32(0xFFFF)) << np.uint32(16)) | (low & np.uint32(0xFFFF))
+        return natural_to_index(naturals)
+
+
+LAYOUTS = {layout_cls.name: layout_cls for layout_cls in (OctetLayout, HilbertLayout)}
+
+
+def get_layout(name: str) -> Layout:
+    """
+    Returns a layout object from its name
+
+    Raises:
+        SettingsError # If there is no layout with that name
+    """
+
+    try:
+        return LAYOUTS[name]()
+    except KeyError:
+        raise SettingsError(f"Unknown layout: {name}, must be one of: {', '.join(LAYOUTS)}")
+
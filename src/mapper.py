@@ -5,17 +5,72 @@
 
 # Imports
 import json
+import os
+import sys
 
 import src.image as image
+import src.layout as layout
+import src.metrics as metrics
 import src.settings as settings
 import src.threads as threads
+from src.aggregates import PrefixCounts
+from src.checkpoint import add_checked_ranges, load_checked_ranges, save_checked_ranges
+from src.exclusions import from_settings as exclusions_from_settings
 from src.global_methods import flatten_iter, lazy_split, transpose_iter
+from src.history import EpochStore
 from src.ip import IP, ComplexIPrange, IPrange
+from src.profiling import Profiler
+from src.rank import RankIndex
+from src.settings import get_setting
+from src.retry import RetryScheduler, merge_results, retry_candidates
+from src.sampling import AdaptiveSampler
+from src.store import NO_RESPONSE, RTT_PATH, ResultStore, results_to_arrays
+from src.timeout import from_settings as timeouts_from_settings
 
 
 # Definitions
-def main(settings: dict) -> None:
-    """Main"""
+def main(settings: dict, profile: bool = False) -> None:
+    """
+    Main
+
+    Parameters:
+        settings: dict # The loaded settings
+        profile: bool = False # Profile each phase, also turned on by the profile setting
+    """
+
+    # Start exporting metrics
+    metrics_settings = get_setting(settings, "metrics")
+    metrics_thrd = None
+    metrics_server = None
+    if metrics_settings["enabled"]:
+        metrics_thrd = threads.MetricsThread(metrics_settings["json_path"], metrics_settings["prometheus_path"], metrics_settings["interval"])
+        metrics_thrd.start()
+
+        if metrics_settings["http_port"] != None:
+            metrics_server = metrics.serve_http(metrics_settings["http_port"])
+
+    # Metrics are stopped even if the scan fails or is interrupted
+    try:
+        scan(settings, profile)
+
+    finally:
+        # Stop exporting metrics
+        if metrics_thrd != None:
+            metrics_thrd.end()
+            metrics_thrd.join()
+
+        if metrics_server != None:
+            metrics_server.shutdown()
+
+
+def scan(settings: dict, profile: bool = False) -> None:
+    """
+    Scans the range that isn't checked yet, saves the results and updates the maps
+
+    Parameters:
+        settings: dict # The loaded settings
+        profile: bool = False # Profile each phase, also turned on by the profile setting
+    """
 
     # Set thread amounts
     thread_amounts = {}
@@ -29,61 +84,133 @@ def main(settings: dict) -> None:
     result_thread_amount = thread_amounts["result"]
     save_thread_amount = thread_amounts["save"]
 
+    # Get map layout
+    layout_ = layout.get_layout(get_setting(settings, "layout"))
+
+    # Set up profiling
+    profile_settings = get_setting(settings, "profile")
+    profiler = Profiler(profile or profile_settings["enabled"], profile_settings["dir"])
+
     # Get last checked ips
-    try:
-        with open("checked_ranges.txt", 'rt') as file:
-            try:
-                checked_ranges: ComplexIPrange = eval(file.read())
-            except SyntaxError:
-                checked_ranges = None
-    except FileNotFoundError:
-        checked_ranges = None
+    checked_ranges = load_checked_ranges()
     
     if checked_ranges == None:
         ping_range = IPrange(IP(0,0,0,0), IP.last_ip)
     else:
         ping_range = checked_ranges.inverted()
     
-    # Divide up ranges
-    ranges = lazy_split(ping_range, ping_thread_amount)
+    timeouts = timeouts_from_settings(get_setting(settings, "timeout"))
+
+    # Load exclusion lists
+    exclusions = exclusions_from_settings(get_setting(settings, "exclusions"))
+    if exclusions != None:
+        print(f"Excluding {exclusions.excluded_amount} ips")
+
+    sampling_settings = get_setting(settings, "sampling")
+
+    # Adaptive sampling
+    if sampling_settings["enabled"]:
+        sampler = AdaptiveSampler(
+            sampling_settings["prefix_length"],
+            sampling_settings["sample_size"],
+            sampling_settings["hit_threshold"],
+            sampling_settings["prior_threshold"],
+            sampling_settings["batch_size"],
+            ResultStore(readonly=True) if os.path.exists(RTT_PATH) else None,
+            exclusions
+        )
+        input_thrd = threads.InputThread()
+
+        with profiler.phase("ping"):
+            print("Sampling blocks, press enter to stop...")
+            input_thrd.start()
+            results = sampler.run(ping_range, ping_thread_amount, timeouts, input_thrd)
+
+        # Sampled blocks are tracked per block by the sampler, a /24 would be 256 separate ranges in checked_ranges
+        pinged_ranges = []
 
-    # Create ping threads
-    ping_thrds = threads.ThreadsList([threads.PingThread(range_, num+1) for num, range_ in enumerate(ranges)])
-    
-    # Create stats thread
-    stats_thrd = threads.StatsThread(ping_thrds)
-
-    # Start threads
-    stats_thrd.start()
-    ping_thrds.start()
-    
-    # Wait to end
-    input()
-
-    # End threads and get thread results
-    stats_thrd.end()
-    ping_thrds.end()
-    print("Getting pinged range and results...")
-    results, pinged_ranges = transpose_iter(ping_thrds.join())
-    pinged_ranges: list[IPrange | ComplexIPrange]
-
-    results = flatten_iter(results)
+    else:
+        # Divide up ranges
+        ranges = lazy_split(ping_range, ping_thread_amount)
+
+        # Create ping threads
+        ping_thrds = threads.ThreadsList([threads.PingThread(range_, num+1, timeouts, exclusions) for num, range_ in enumerate(ranges)])
+        
+        # Create stats thread
+        stats_thrd = threads.StatsThread(ping_thrds)
+
+        # Start threads
+        with profiler.phase("ping"):
+            stats_thrd.start()
+            ping_thrds.start()
+            
+            # Wait to end
+            input()
+
+        # End threads and get thread results
+        with profiler.phase("collect"):
+            stats_thrd.end()
+            ping_thrds.end()
+            print("Getting pinged range and results...")
+            results, pinged_ranges = transpose_iter(ping_thrds.join())
+            pinged_ranges: list[IPrange | ComplexIPrange]
+
+            results = flatten_iter(results)
+
+    # Print time saved by adaptive timeouts, pings run in parallel so the wall time saved is split between the threads
+    if timeouts != None:
+        print(f"Adaptive timeouts saved about {timeouts.saved.value / ping_thread_amount:.0f}s of wall time")
+
+    # Ping IPs that didn't respond again
+    retry_settings = get_setting(settings, "retry")
+    if retry_settings["passes"] > 0:
+        with profiler.phase("retry"):
+            indexes, buckets = results_to_arrays(results)
+            pending = retry_candidates(indexes, buckets != NO_RESPONSE, retry_settings["live_blocks_only"])
+            scheduler = RetryScheduler(retry_settings["passes"], retry_settings["spacing"])
+            results = merge_results(results, scheduler.run(pending, ping_thread_amount, timeouts))
+
+    # Save results to the result store
+    with profiler.phase("store"):
+        print("Saving results to the result store...")
+        store = ResultStore()
+        counts = PrefixCounts.load(store=store)
+        indexes, buckets = results_to_arrays(results)
+        counts.update(indexes, store.write(indexes, buckets), buckets)
+        store.flush()
+        counts.save()
+
+        # Recount the written blocks of the rank index
+        rank = RankIndex.load(store)
+        rank.update(indexes)
+        rank.save()
+
+    # Record the scan in the history
+    history_settings = get_setting(settings, "history")
+    if history_settings["enabled"]:
+        with profiler.phase("history"):
+            print("Recording the scan in the history...")
+            EpochStore(history_settings["dir"], history_settings["keyframe_interval"]).record(store)
+
+    store.close()
 
     # Divide up results
     results_subs = lazy_split(results, result_thread_amount)
 
     # Get images and pix_maps
-    imgs, pix_maps = image.get_img_n_pix_maps(load_thread_amount)
+    with profiler.phase("load"):
+        imgs, pix_maps = image.get_img_n_pix_maps(load_thread_amount)
 
     # Create results threads
-    results_thrds = threads.ThreadsList([threads.ResultsThread(result_sub, pix_maps, num+1) for num, result_sub in enumerate(results_subs)])
+    results_thrds = threads.ThreadsList([threads.ResultsThread(result_sub, pix_maps, num+1, layout_) for num, result_sub in enumerate(results_subs)])
 
     # Start threads
-    print("Pasting results to images...")
-    results_thrds.start()
+    with profiler.phase("results"):
+        print("Pasting results to images...")
+        results_thrds.start()
 
-    # Wait for threads to finish
-    results_thrds.join()
+        # Wait for threads to finish
+        results_thrds.join()
 
     # Create img and out_num list
     imgs_n_out_nums = [(img, out_num+1) for out_num, img in enumerate(imgs)]
@@ -98,20 +225,26 @@ def main(settings: dict) -> None:
     stats_thrd = threads.StatsThread(save_thrds)
 
     # Start threads
-    stats_thrd.start()
-    save_thrds.start()
+    with profiler.phase("save"):
+        stats_thrd.start()
+        save_thrds.start()
+
+        # Wait for threads to finish
+        save_thrds.join()
+        stats_thrd.end()
 
-    # Wait for threads to finish
-    save_thrds.join()
-    stats_thrd.end()
+    if pinged_ranges != []:
+        with profiler.phase("checkpoint"):
+            # Merged as index arrays
+            out = checked_ranges
+            for range_ in pinged_ranges:
+                out = add_checked_ranges(out, range_)
+            save_checked_ranges(out)
 
-    out_ranges = flatten_iter([range_.ranges if isinstance(range_, ComplexIPrange) else [range_] for range_ in pinged_ranges] + [checked_ranges.ranges if checked_ranges != None else []])
-    out = ComplexIPrange(out_ranges)
-    with open("checked_ranges.txt", 'wt') as file:
-        file.write(repr(out))
+    profiler.print_summary()
 
 
 # Run
 if __name__ == "__main__":
     settings = settings.load_settings()
-    main(settings)
\ No newline at end of file
+    main(settings, "--profile" in sys.argv)
\ No newline at end of file
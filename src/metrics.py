@@ -0,0 +1,284 @@
+# metrics.py
+# Thread safe counters, histograms and rates for every stage of the pipeline
+# Exports them as json or prometheus text so they can be scraped
+
+
+# Imports
+from __future__ import annotations
+
+import json
+import os
+from bisect import bisect_left
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from threading import Lock, Thread
+from time import monotonic, time
+
+
+# Definitions
+RTT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.0)
+ENCODE_BUCKETS = (0.5, 1.0, 2.0, 5.0, 10.0, 20.0, 30.0, 60.0, 120.0)
+QUEUE_DEPTH_BUCKETS = (0, 1000, 10000, 100000, 1000000, 10000000)
+
+
+class Counter:
+    """A counter that only goes up"""
+
+    def __init__(self, name: str, help_: str = "") -> None:
+        self.name = name
+        self.help = help_
+        self._value = 0
+        self._lock = Lock()
+
+
+    def inc(self, amount: int | float = 1) -> None:
+        with self._lock:
+            self._value += amount
+
+
+    @property
+    def value(self) -> int | float:
+        return self._value
+
+
+class Gauge:
+    """A value that can go up and down"""
+
+    def __init__(self, name: str, help_: str = "") -> None:
+        self.name = name
+        self.help = help_
+        self._value = 0
+
+
+    def set(self, value: int | float) -> None:
+        self._value = value
+
+
+    @property
+    def value(self) -> int | float:
+        return self._value
+
+
+class Histogram:
+    """A histogram with fixed bucket upper bounds, like the prometheus one"""
+
+    def __init__(self, name: str, buckets: tuple[float], help_: str = "") -> None:
+        self.name = name
+        self.help = help_
+        self.buckets = tuple(sorted(buckets))
+        self._counts = [0] * (len(self.buckets) + 1) # Last one is +Inf
+        self._sum = 0
+        self._count = 0
+        self._lock = Lock()
+
+
+    def observe(self, value: int | float) -> None:
+        with self._lock:
+            self._counts[bisect_left(self.buckets, value)] += 1
+            self._sum += value
+            self._count += 1
+
+
+    def snapshot(self) -> dict:
+        """Returns the cumulative bucket counts, sum and count"""
+
+        with self._lock:
+            cumulative = []
+            total = 0
+            for count in self._counts:
+                total += count
+                cumulative.append(total)
+
+            return {
+                "buckets": dict(zip([str(bound) for bound in self.buckets] + ["+Inf"], cumulative)),
+                "sum": self._sum,
+                "count": self._count
+            }
+
+
+class RateWindow:
+    """
+    A rate over a sliding window of time.
+    Events are kept in one second slots, so memory stays constant no matter the rate.
+    """
+
+    def __init__(self, name: str, window: float = 10.0) -> None:
+        self.name = name
+        self.window = window
+        self._slots = deque() # (second, amount)
+        self._total = 0
+        self._start = monotonic()
+        self._lock = Lock()
+
+
+    def mark(self, amount: int = 1) -> None:
+        now = int(monotonic())
+        with self._lock:
+            self._total += amount
+            if self._slots and self._slots[-1][0] == now:
+                self._slots[-1][1] += amount
+            else:
+                self._slots.append([now, amount])
+            self._trim(now)
+
+
+    def _trim(self, now: float) -> None:
+        while self._slots and self._slots[0][0] <= now - self.window:
+            self._slots.popleft()
+
+
+    @property
+    def total(self) -> int:
+        return self._total
+
+
+    def rate(self) -> float:
+        """Returns the amount per second over the window"""
+
+        now = monotonic()
+        with self._lock:
+            self._trim(int(now))
+            amount = sum(slot[1] for slot in self._slots)
+
+        # Don't divide by the full window if it hasn't passed yet
+        elapsed = max(1.0, min(self.window, now - self._start))
+        return amount / elapsed
+
+
+class Registry:
+    """Holds every metric and exports them"""
+
+    def __init__(self) -> None:
+        self._metrics = {}
+        self._lock = Lock()
+
+
+    def _get(self, cls: type, name: str, *args) -> Counter | Gauge | Histogram | RateWindow:
+        with self._lock:
+            if name not in self._metrics:
+                self._metrics[name] = cls(name, *args)
+            return self._metrics[name]
+
+
+    def counter(self, name: str, help_: str = "") -> Counter:
+        return self._get(Counter, name, help_)
+
+
+    def gauge(self, name: str, help_: str = "") -> Gauge:
+        return self._get(Gauge, name, help_)
+
+
+    def histogram(self, name: str, buckets: tuple[float], help_: str = "") -> Histogram:
+        return self._get(Histogram, name, buckets, help_)
+
+
+    def rate(self, name: str, window: float = 10.0) -> RateWindow:
+        return self._get(RateWindow, name, window)
+
+
+    def stage(self, name: str, amount: int = 1) -> None:
+        """
+        Marks work done by a pipeline stage.
+        Every stage has a total and a sliding window rate.
+
+        Usage:
+        >>> REGISTRY.stage("ping")
+        """
+
+        self.rate(f"{name}_total").mark(amount)
+
+
+    def to_dict(self) -> dict:
+        """Returns every metric as a json serializable dict"""
+
+        with self._lock:
+            metrics = list(self._metrics.values())
+
+        out = {"timestamp": time(), "counters": {}, "gauges": {}, "histograms": {}, "stages": {}}
+        for metric in metrics:
+            if isinstance(metric, Counter):
+                out["counters"][metric.name] = metric.value
+            elif isinstance(metric, Gauge):
+                out["gauges"][metric.name] = metric.value
+            elif isinstance(metric, Histogram):
+                out["histograms"][metric.name] = metric.snapshot()
+            elif isinstance(metric, RateWindow):
+                out["stages"][metric.name.removesuffix("_total")] = {"total": metric.total, "rate": metric.rate()}
+
+        return out
+
+
+    def to_prometheus(self) -> str:
+        """Returns every metric in the prometheus text format"""
+
+        data = self.to_dict()
+        lines = []
+
+        for name, value in data["counters"].items():
+            lines += [f"# TYPE ip_mapper_{name} counter", f"ip_mapper_{name} {value}"]
+
+        for name, value in data["gauges"].items():
+            lines += [f"# TYPE ip_mapper_{name} gauge", f"ip_mapper_{name} {value}"]
+
+        for name, snapshot in data["histograms"].items():
+            lines.append(f"# TYPE ip_mapper_{name} histogram")
+            for bound, count in snapshot["buckets"].items():
+                lines.append(f'ip_mapper_{name}_bucket{{le="{bound}"}} {count}')
+            lines += [f"ip_mapper_{name}_sum {snapshot['sum']}", f"ip_mapper_{name}_count {snapshot['count']}"]
+
+        lines += ["# TYPE ip_mapper_stage_total counter", "# TYPE ip_mapper_stage_rate gauge"]
+        for name, stage in data["stages"].items():
+            lines.append(f'ip_mapper_stage_total{{stage="{name}"}} {stage["total"]}')
+            lines.append(f'ip_mapper_stage_rate{{stage="{name}"}} {stage["rate"]}')
+
+        return '\n'.join(lines) + '\n'
+
+
+    def write(self, json_path: str | None = None, prometheus_path: str | None = None) -> None:
+        """Atomically rewrites the export files"""
+
+        for path, text in ((json_path, lambda: json.dumps(self.to_dict(), indent=4)), (prometheus_path, self.to_prometheus)):
+            if path == None:
+                continue
+
+            tmp_path = path + ".tmp"
+            with open(tmp_path, 'wt') as file:
+                file.write(text())
+            os.replace(tmp_path, path)
+
+
+REGISTRY = Registry()
+
+
+def serve_http(port: int, registry: Registry = REGISTRY) -> ThreadingHTTPServer:
+    """
+    Serves the metrics on localhost in a daemon thread.
+    /metrics is the prometheus text format and /metrics.json is json.
+
+    Returns:
+        ThreadingHTTPServer # The server, call shutdown() on it to stop it
+    """
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self) -> None:
+            if self.path == "/metrics":
+                body, content_type = registry.to_prometheus().encode(), "text/plain; version=0.0.4"
+            elif self.path == "/metrics.json":
+                body, content_type = json.dumps(registry.to_dict()).encode(), "application/json"
+            else:
+                self.send_error(404)
+                return
+
+            self.send_response(200)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+
+        def log_message(self, *_) -> None:
+            pass # Don't print every scrape
+
+    server = ThreadingHTTPServer(("127.0.0.1", port), Handler)
+    Thread(target=server.serve_forever, name="MetricsServer", daemon=True).start()
+    return server
@@ -9,10 +9,13 @@ from src.ip import IP
 
 
 # Definitions
-def ping(ip: IP):
+DEFAULT_TIMEOUT = 2
+
+
+def ping(ip: IP, timeout: float = DEFAULT_TIMEOUT):
     """Ping the specified ip"""
     
     try:
-        return ping_("{}.{}.{}.{}".format(*tuple(ip)), 2)
+        return ping_("{}.{}.{}.{}".format(*tuple(ip)), timeout)
     except OSError:
         return False
@@ -0,0 +1,308 @@
+# pool.py
+# Pings with a pool of worker processes instead of threads, so pinging scales past the cores one interpreter can use
+# The range is pinged a batch at a time, every process owns a part of the batch and writes the buckets of its part into
+# a shared memory result buffer, the parent only adds up the counters and writes the finished batch to the result store
+
+
+# Imports
+from __future__ import annotations
+
+import multiprocessing as mp
+import os
+import queue
+import sys
+from multiprocessing.shared_memory import SharedMemory
+from time import perf_counter
+
+import numpy as np
+
+import src.settings as settings
+import src.threads as threads
+from src.aggregates import PrefixCounts
+from src.checkpoint import add_checked_ranges, load_checked_ranges, save_checked_ranges
+from src.cidr import merge_intervals
+from src.cluster import shard_indexes, split_runs, split_shards
+from src.exclusions import from_settings as exclusions_from_settings
+from src.history import EpochStore
+from src.ip import IP, ComplexIPrange, IPrange
+from src.layout import get_layout
+from src.metrics import REGISTRY
+from src.profiling import Profiler
+from src.rank import RankIndex
+from src.sampling import ping_indexes
+from src.store import NO_RESPONSE, ResultStore, results_to_arrays
+from src.timeout import from_settings as timeouts_from_settings
+from src.writer import BatchWriter
+
+
+# Definitions
+DONE, RESPONDED = 0, 1 # Columns of the counters, per process
+
+
+def probe_worker(buffer_name: str, counters_name: str, process_amount: int, tasks: mp.Queue, finished: mp.Queue, stop: mp.Event, thread_amount: int, timeout_settings: dict, exclusion_settings: dict, chunk_size: int) -> None:
+    """
+    Runs in every worker process, pings the parts of batches it is given until it gets None
+
+    Parameters:
+        buffer_name: str # The shared memory result buffer, one bucket per IP of the batch
+        counters_name: str # The shared memory counters, a row of DONE and RESPONDED per part of the batch
+        process_amount: int # The amount of worker processes
+        tasks: mp.Queue # (part, offset, starts, stops) of the parts to ping, the offset is the position of the part in the buffer
+        finished: mp.Queue # The process puts the part here when it is done with it
+        stop: mp.Event # Stops the part early when set, DONE says how far the process got
+        thread_amount: int # Ping threads of the process
+        timeout_settings: dict # The timeout settings, each process keeps its own adaptive timeout
+        exclusion_settings: dict # The exclusion settings
+        chunk_size: int # IPs pinged between counter updates
+    """
+
+    buffer_shm, counters_shm = SharedMemory(buffer_name), SharedMemory(counters_name)
+    buffer = np.ndarray((buffer_shm.size,), dtype=np.uint8, buffer=buffer_shm.buf)
+    counters = np.ndarray((process_amount, 2), dtype=np.int64, buffer=counters_shm.buf)
+    timeouts = timeouts_from_settings(timeout_settings)
+    exclusions = exclusions_from_settings(exclusion_settings)
+
+    try:
+        while (task := tasks.get()) != None:
+            part, offset, starts, stops = task
+            indexes = shard_indexes(starts, stops)
+
+            for start in range(0, len(indexes), chunk_size):
+                if stop.is_set():
+                    break
+
+                chunk = indexes[start:start + chunk_size]
+                if exclusions != None:
+                    chunk = chunk[exclusions.allows_indexes(chunk)]
+
+                # The results come back grouped by thread, put them where their IP is in the part
+                pinged, buckets = results_to_arrays(ping_indexes(chunk, thread_amount, timeouts, None))
+                buffer[offset + np.searchsorted(indexes, pinged)] = buckets
+
+                counters[part, RESPONDED] += int(np.count_nonzero(buckets != NO_RESPONSE))
+                counters[part, DONE] = start + len(indexes[start:start + chunk_size])
+
+            finished.put(part)
+
+    finally:
+        del buffer, counters
+        buffer_shm.close()
+        counters_shm.close()
+
+
+class ProbePool:
+    """
+    A pool of worker processes that ping batches of index runs
+
+    Usage:
+    >>> with ProbePool(8, 1 << 24, 16, timeout_settings, exclusion_settings) as pool:
+    ...     indexes, buckets, done = pool.ping(starts, stops)
+    """
+
+    def __init__(self, process_amount: int, batch_size: int, thread_amount: int, timeout_settings: dict, exclusion_settings: dict, chunk_size: int = 4096) -> None:
+        """
+        Parameters:
+            process_amount: int # The amount of worker processes
+            batch_size: int # Most IPs pinged at once, the size of the result buffer
+            thread_amount: int # Ping threads of each process
+            timeout_settings: dict # The timeout settings
+            exclusion_settings: dict # The exclusion settings
+            chunk_size: int = 4096 # IPs a process pings between counter updates
+        """
+
+        self.process_amount = process_amount
+        self.batch_size = batch_size
+
+        self.buffer_shm = SharedMemory(create=True, size=batch_size)
+        self.counters_shm = SharedMemory(create=True, size=process_amount * 2 * 8)
+        self.buffer = np.ndarray((batch_size,), dtype=np.uint8, buffer=self.buffer_shm.buf)
+        self.counters = np.ndarray((process_amount, 2), dtype=np.int64, buffer=self.counters_shm.buf)
+
+        self.tasks = mp.Queue()
+        self.finished = mp.Queue()
+        self.stop = mp.Event()
+        self.processes = [
+            mp.Process(
+                target=probe_worker,
+                args=(self.buffer_shm.name, self.counters_shm.name, process_amount, self.tasks, self.finished, self.stop, thread_amount, timeout_settings, exclusion_settings, chunk_size),
+                name=f"ProbeWorker-{num + 1}",
+                daemon=True
+            )
+            for num in range(process_amount)
+        ]
+        for process in self.processes:
+            process.start()
+
+        # Totals of the batches before the current one
+        self.done_total = 0
+        self.responded_total = 0
+
+
+    def __enter__(self) -> ProbePool:
+        return self
+
+
+    def __exit__(self, *_) -> None:
+        self.close()
+
+
+    @property
+    def done(self) -> int:
+        """IPs pinged so far"""
+
+        return self.done_total + int(self.counters[:, DONE].sum())
+
+
+    @property
+    def responded(self) -> int:
+        """IPs that responded so far"""
+
+        return self.responded_total + int(self.counters[:, RESPONDED].sum())
+
+
+    def ping(self, starts: np.ndarray, stops: np.ndarray, input_thrd: threads.InputThread | None = None, interval: float = 1.0) -> tuple[np.ndarray, np.ndarray, list[tuple[np.ndarray, np.ndarray]]]:
+        """
+        Pings a batch of sorted index runs of up to batch_size IPs, printing the progress every interval seconds
+
+        Parameters:
+            starts: np.ndarray # The start indexes of the runs
+            stops: np.ndarray # The stop indexes of the runs
+            input_thrd: threads.InputThread | None = None # Stops the processes early when this thread finishes, never if None
+            interval: float = 1.0 # Seconds between progress lines
+
+        Returns:
+            np.ndarray[uint32] # The pinged indexes, excluded IPs included
+            np.ndarray[uint8] # Their buckets
+            list[tuple[np.ndarray, np.ndarray]] # The runs that were pinged, less than the batch if stopped early
+        """
+
+        parts = split_runs(starts, stops, -(-int((np.asarray(stops, dtype=np.int64) - starts).sum()) // self.process_amount))
+        self.buffer[:] = NO_RESPONSE
+        self.counters[:] = 0
+
+        offset = 0
+        for part, (part_starts, part_stops) in enumerate(parts):
+            self.tasks.put((part, offset, part_starts, part_stops))
+            offset += int((part_stops - part_starts).sum())
+
+        # Only the counters cross over while the processes ping
+        started = perf_counter()
+        for _ in parts:
+            while True:
+                try:
+                    self.finished.get(timeout=interval)
+                    break
+                except queue.Empty:
+                    if input_thrd != None and not input_thrd.is_alive():
+                        self.stop.set()
+                    print(f"Pinged {self.done} ips; {(self.done - self.done_total) / (perf_counter() - started):.0f} ips/sec; {self.responded} responded")
+
+        # Every part is pinged up to DONE, keep those
+        indexes, buckets, pinged = [], [], []
+        offset = 0
+        for part, (part_starts, part_stops) in enumerate(parts):
+            done = int(self.counters[part, DONE])
+            if done > 0:
+                pinged.append(split_runs(part_starts, part_stops, done)[0])
+                indexes.append(shard_indexes(*pinged[-1]))
+                buckets.append(self.buffer[offset:offset + done].copy())
+            offset += int((part_stops - part_starts).sum())
+
+        REGISTRY.counter("pool_pinged").inc(int(self.counters[:, DONE].sum()))
+        self.done_total, self.responded_total = self.done, self.responded
+        self.counters[:] = 0
+
+        if not indexes:
+            return np.zeros(0, dtype=np.uint32), np.zeros(0, dtype=np.uint8), []
+        return np.concatenate(indexes), np.concatenate(buckets), pinged
+
+
+    def close(self) -> None:
+        """Stops the processes and frees the shared memory"""
+
+        for _ in self.processes:
+            self.tasks.put(None)
+        for process in self.processes:
+            process.join()
+
+        del self.buffer, self.counters
+        self.buffer_shm.close()
+        self.buffer_shm.unlink()
+        self.counters_shm.close()
+        self.counters_shm.unlink()
+
+
+def main(profile: bool = False) -> None:
+    """
+    Pings everything that isn't checked yet with a pool of processes, until it's all pinged or enter is pressed
+
+    Parameters:
+        profile: bool = False # Profile each phase
+    """
+
+    settings_ = settings.load_settings()
+    pool_settings = settings.get_setting(settings_, "pool")
+    exclusion_settings = settings.get_setting(settings_, "exclusions")
+    exclusions = exclusions_from_settings(exclusion_settings)
+    profile_settings = settings.get_setting(settings_, "profile")
+    profiler = Profiler(profile or profile_settings["enabled"], profile_settings["dir"])
+
+    checked_ranges = load_checked_ranges()
+    if checked_ranges == None:
+        ping_range = IPrange(IP(0,0,0,0), IP.last_ip)
+    else:
+        ping_range = checked_ranges.inverted()
+
+    store = ResultStore()
+    counts = PrefixCounts.load(store=store)
+    rank = RankIndex.load(store)
+    writer = BatchWriter(store, counts, rank, get_layout(settings.get_setting(settings_, "layout")), pool_settings["map_batch"])
+
+    process_amount = pool_settings["processes"] or os.cpu_count()
+    pinged_starts, pinged_stops = [], []
+
+    with ProbePool(process_amount, pool_settings["batch_size"], pool_settings["threads_per_process"], settings.get_setting(settings_, "timeout"), exclusion_settings, pool_settings["chunk_size"]) as pool:
+        print(f"Pinging with {process_amount} processes, press enter to stop...")
+        input_thrd = threads.InputThread()
+        input_thrd.start()
+
+        for starts, stops in split_shards(ping_range, pool_settings["batch_size"]):
+            with profiler.phase("ping"):
+                indexes, buckets, pinged = pool.ping(starts, stops, input_thrd)
+
+            # Excluded IPs were never pinged, leave what the store has for them
+            with profiler.phase("store"):
+                if exclusions != None:
+                    allowed = exclusions.allows_indexes(indexes)
+                    indexes, buckets = indexes[allowed], buckets[allowed]
+                writer.write(indexes, buckets)
+
+            pinged_starts += [part_starts for part_starts, _ in pinged]
+            pinged_stops += [part_stops for _, part_stops in pinged]
+            if not input_thrd.is_alive():
+                break
+
+        print(f"Pinged {pool.done} ips, {pool.responded} responded")
+
+    with profiler.phase("checkpoint"):
+        writer.flush()
+        counts.save()
+        rank.save()
+        if pinged_starts:
+            pinged_range = ComplexIPrange.from_arrays(*merge_intervals(np.concatenate(pinged_starts), np.concatenate(pinged_stops)))
+            save_checked_ranges(add_checked_ranges(checked_ranges, pinged_range))
+
+    # Record the scan in the history
+    history_settings = settings.get_setting(settings_, "history")
+    if history_settings["enabled"]:
+        with profiler.phase("history"):
+            print("Recording the scan in the history...")
+            EpochStore(history_settings["dir"], history_settings["keyframe_interval"]).record(store)
+
+    store.close()
+    profiler.print_summary()
+
+
+# Run
+if __name__ == "__main__":
+    main("--profile" in sys.argv)
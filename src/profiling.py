@@ -0,0 +1,182 @@
+# profiling.py
+# Profiles each phase of a run and writes the reports to a run directory
+# The main thread is profiled with cProfile, worker threads are sampled, and memory is traced with tracemalloc
+
+
+# Imports
+from __future__ import annotations
+
+import cProfile
+import os
+import pstats
+import sys
+import tracemalloc
+from collections import Counter
+from contextlib import contextmanager
+from datetime import datetime
+from threading import Event, Thread, get_ident, main_thread
+from time import perf_counter
+
+
+# Definitions
+class SamplingProfiler(Thread):
+    """
+    Samples the stacks of every other thread at a fixed interval.
+    Used for the worker threads, since cProfile only sees the thread it was enabled in.
+    """
+
+    def __init__(self, interval: float = 0.005) -> None:
+        super().__init__(name="SamplingProfiler", daemon=True)
+        self.interval = interval
+        self.samples = 0
+        self.self_counts = Counter()       # Leaf frames
+        self.cumulative_counts = Counter() # Every function on the stack
+        self._stop_event = Event()
+
+
+    def run(self) -> None:
+        ignored = {get_ident(), main_thread().ident}
+        while not self._stop_event.wait(self.interval):
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id in ignored:
+                    continue
+
+                self.samples += 1
+                self.self_counts[(frame.f_code.co_filename, frame.f_lineno, frame.f_code.co_name)] += 1
+
+                seen = set()
+                while frame != None:
+                    key = (frame.f_code.co_filename, frame.f_code.co_firstlineno, frame.f_code.co_name)
+                    if key not in seen:
+                        self.cumulative_counts[key] += 1
+                        seen.add(key)
+                    frame = frame.f_back
+
+
+    def stop(self) -> None:
+        self._stop_event.set()
+        self.join()
+
+
+    def report(self, top: int = 40) -> str:
+        """Returns the most sampled functions as text"""
+
+        if self.samples == 0:
+            return "No worker thread samples\n"
+
+        lines = [f"{self.samples} samples every {self.interval * 1000:g}ms", "", "Self:"]
+        for (filename, lineno, name), count in self.self_counts.most_common(top):
+            lines.append(f"{count / self.samples:7.2%} {count:8} {name} ({filename}:{lineno})")
+
+        lines += ["", "Cumulative:"]
+        for (filename, lineno, name), count in self.cumulative_counts.most_common(top):
+            lines.append(f"{count / self.samples:7.2%} {count:8} {name} ({filename}:{lineno})")
+
+        return '\n'.join(lines) + '\n'
+
+
+class Profiler:
+    """
+    Profiles the phases of a run.
+    When disabled every phase is a no-op, so callers can always wrap their phases.
+
+    Usage:
+    >>> profiler = Profiler(True)
+    >>> with profiler.phase("ping"):
+    ...     # Some code
+    >>> profiler.print_summary()
+    """
+
+    def __init__(self, enabled: bool, out_dir: str = "profiles") -> None:
+        self.enabled = enabled
+        self.run_dir = None
+        self.phases = [] # (name, wall time, peak memory)
+        self._depth = 0 # Phases running right now, phases can be nested
+        self._tracing = False # If tracemalloc was started by the profiler
+
+        if enabled:
+            self.run_dir = os.path.join(out_dir, datetime.now().strftime("%Y%m%d-%H%M%S"))
+            os.makedirs(self.run_dir, exist_ok=True)
+
+
+    @contextmanager
+    def phase(self, name: str):
+        """Profiles the code inside the with statement as one phase"""
+
+        if not self.enabled:
+            yield
+            return
+
+        # Start memory tracing
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._tracing = True
+        self._depth += 1
+        tracemalloc.reset_peak()
+        start_memory = tracemalloc.get_traced_memory()[0]
+
+        # Start profilers
+        sampler = SamplingProfiler()
+        sampler.start()
+        prof = cProfile.Profile()
+        start = perf_counter()
+        prof.enable()
+
+        try:
+            yield
+
+        finally:
+            prof.disable()
+            wall_time = perf_counter() - start
+            sampler.stop()
+            peak_memory = tracemalloc.get_traced_memory()[1] - start_memory
+            snapshot = tracemalloc.take_snapshot()
+
+            # Stop memory tracing after the last phase, unless something else started it
+            self._depth -= 1
+            if self._depth == 0 and self._tracing:
+                tracemalloc.stop()
+                self._tracing = False
+
+            self.phases.append((name, wall_time, peak_memory))
+            self._write_reports(len(self.phases), name, prof, sampler, snapshot)
+
+
+    def _write_reports(self, num: int, name: str, prof: cProfile.Profile, sampler: SamplingProfiler, snapshot: tracemalloc.Snapshot) -> None:
+        """Writes the pstats, sampled stacks and top allocations of a phase"""
+
+        base_path = os.path.join(self.run_dir, f"{num}-{name}")
+
+        # Main thread
+        prof.dump_stats(base_path + ".pstats")
+        with open(base_path + ".txt", 'wt') as file:
+            stats = pstats.Stats(prof, stream=file)
+            stats.sort_stats(pstats.SortKey.CUMULATIVE).print_stats(50)
+
+        # Worker threads
+        with open(base_path + ".threads.txt", 'wt') as file:
+            file.write(sampler.report())
+
+        # Allocations
+        with open(base_path + ".alloc.txt", 'wt') as file:
+            for stat in snapshot.statistics("lineno")[:25]:
+                file.write(f"{stat}\n")
+
+
+    def summary(self) -> str:
+        """Returns a table of the wall time and peak memory of each phase"""
+
+        lines = [f"{'Phase':<20}{'Wall time':>14}{'Peak memory':>16}"]
+        for name, wall_time, peak_memory in self.phases:
+            lines.append(f"{name:<20}{wall_time:>13.2f}s{peak_memory / 1024**2:>13.1f}MiB")
+
+        total = sum(wall_time for _, wall_time, _ in self.phases)
+        lines.append(f"{'Total':<20}{total:>13.2f}s")
+
+        return '\n'.join(lines)
+
+
+    def print_summary(self) -> None:
+        if self.enabled:
+            print(self.summary())
+            print(f"Profiles written to {self.run_dir}")
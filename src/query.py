@@ -0,0 +1,228 @@
+# query.py
+# A small local HTTP server that answers questions about the result store
+# The store is memory mapped read only, so answers are live while a scan writes to it
+#
+# GET  /lookup?ip=1.1.1.1&ip=8.8.8.8  Round trip times in ms of each IP, null if it didn't respond
+# POST /lookup                        Same, with one IP per line in the body
+# GET  /count?cidr=10.0.0.0/8         Responding IPs in a CIDR block
+# GET  /list?cidr=10.0.0.0/8[&rtt=1]  Every responding IP in a CIDR block, streamed one per line
+
+
+# Imports
+from __future__ import annotations
+
+import asyncio
+import json
+from collections.abc import Iterator
+from urllib.parse import parse_qs, urlsplit
+
+import numpy as np
+
+import src.settings as settings
+from src.cidr import GRID_SIZE, cidr_rect, cidr_size, dotted_parts, join_parts, parse_cidr, rect_indexes
+from src.export import rtt_parts
+from src.ip import IP
+from src.layout import index_to_natural
+from src.store import RTT_PATH, ResultStore, dequantize_rtt
+
+
+# Definitions
+LIST_ROWS = 256 # Grid rows listed per streamed chunk
+MAX_BODY = 16 << 20
+
+STATUS_TEXT = {200: "OK", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed", 413: "Payload Too Large"}
+
+
+class QueryError(Exception):
+    """An error in a query, answered with a status code"""
+
+    def __init__(self, status: int, message: str) -> None:
+        super().__init__(message)
+        self.status = status
+
+
+def _parse_ip(text: str) -> int:
+    """Returns the index of a dotted IP"""
+
+    octets = text.strip().split('.')
+    try:
+        return IP(*map(int, octets)).to_index
+    except (TypeError, ValueError):
+        raise QueryError(400, f"Invalid IP: {text!r}")
+
+
+def _cidr(query: dict[str, list[str]]) -> tuple[int, int]:
+    try:
+        return parse_cidr(query["cidr"][0])
+    except KeyError:
+        raise QueryError(400, "Missing cidr")
+    except ValueError as error:
+        raise QueryError(400, str(error))
+
+
+class QueryService:
+    """
+    Answers queries about a result store
+
+    Usage:
+    >>> service = QueryService(ResultStore(readonly=True))
+    >>> service.lookup(["1.1.1.1"])
+    {'1.1.1.1': 12.7}
+    """
+
+    def __init__(self, store: ResultStore) -> None:
+        self.store = store
+        self.grid = store.rtts.reshape(GRID_SIZE, GRID_SIZE)
+
+
+    def lookup(self, ips: list[str]) -> dict[str, float | None]:
+        """Returns the round trip time in ms of each IP, None if it didn't respond"""
+
+        indexes = np.array([_parse_ip(ip) for ip in ips], dtype=np.uint32)
+        rtts = dequantize_rtt(self.store.rtts[indexes]) * 1000
+        return {ip: None if np.isnan(rtt) else round(float(rtt), 3) for ip, rtt in zip(ips, rtts.tolist())}
+
+
+    def count(self, natural: int, prefix_length: int) -> int:
+        """Returns the amount of responding IPs in a CIDR block"""
+
+        return int(np.count_nonzero(self.grid[cidr_rect(natural, prefix_length)]))
+
+
+    def list(self, natural: int, prefix_length: int, with_rtt: bool = False) -> Iterator[bytes]:
+        """Yields the responding IPs of a CIDR block, a few lines at a time, formatted all at once"""
+
+        rows, columns = cidr_rect(natural, prefix_length)
+        for row in range(rows.start, rows.stop, LIST_ROWS):
+            part_rows = slice(row, min(row + LIST_ROWS, rows.stop))
+            part = self.grid[part_rows, columns]
+            row_offsets, column_offsets = np.nonzero(part)
+            if len(row_offsets) == 0:
+                continue
+
+            parts = dotted_parts(index_to_natural(rect_indexes(part_rows, columns, row_offsets, column_offsets)))
+            if with_rtt:
+                parts += [b" ", rtt_parts(part[row_offsets, column_offsets])]
+            yield join_parts(parts + [b"\n"], len(row_offsets))
+
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        """Handles one connection, with keep alive"""
+
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+
+                # Read the request
+                method, target, version = request_line.decode('latin-1').split()
+                headers = {}
+                while (line := await reader.readline()) not in (b"\r\n", b"\n", b""):
+                    name, _, value = line.decode('latin-1').partition(':')
+                    headers[name.strip().lower()] = value.strip()
+
+                length = int(headers.get("content-length", 0))
+                body = await reader.readexactly(length) if 0 < length <= MAX_BODY else b""
+                keep_alive = headers.get("connection", "").lower() != "close" and version == "HTTP/1.1"
+
+                try:
+                    if length > MAX_BODY:
+                        raise QueryError(413, "Body too large")
+                    await self._respond(writer, method, target, body, keep_alive)
+                except QueryError as error:
+                    self._send(writer, error.status, json.dumps({"error": str(error)}).encode(), "application/json", keep_alive)
+
+                await writer.drain()
+                if not keep_alive:
+                    break
+
+        except (ConnectionError, ValueError, asyncio.IncompleteReadError):
+            pass
+
+        finally:
+            writer.close()
+
+
+    @staticmethod
+    def _send(writer: asyncio.StreamWriter, status: int, body: bytes, content_type: str, keep_alive: bool) -> None:
+        writer.write(
+            f"HTTP/1.1 {status} {STATUS_TEXT[status]}\r\nContent-Type: {content_type}\r\nContent-Length: {len(body)}\r\n"
+            f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n".encode() + body
+        )
+
+
+    async def _respond(self, writer: asyncio.StreamWriter, method: str, target: str, body: bytes, keep_alive: bool) -> None:
+        url = urlsplit(target)
+        query = parse_qs(url.query)
+
+        match (method, url.path):
+            case ("GET", "/lookup"):
+                self._send(writer, 200, json.dumps(self.lookup(query.get("ip", []))).encode(), "application/json", keep_alive)
+
+            case ("POST", "/lookup"):
+                ips = [line for line in body.decode().splitlines() if line.strip()]
+                self._send(writer, 200, json.dumps(self.lookup(ips)).encode(), "application/json", keep_alive)
+
+            case ("GET", "/count"):
+                natural, prefix_length = _cidr(query)
+                # Large blocks take a while to count, so count off the event loop
+                responded = await asyncio.to_thread(self.count, natural, prefix_length)
+                out = {"cidr": query["cidr"][0], "responded": responded, "size": cidr_size(prefix_length)}
+                self._send(writer, 200, json.dumps(out).encode(), "application/json", keep_alive)
+
+            case ("GET", "/list"):
+                natural, prefix_length = _cidr(query)
+                await self._stream(writer, self.list(natural, prefix_length, query.get("rtt", ["0"])[0] == "1"), keep_alive)
+
+            case (_, "/lookup" | "/count" | "/list"):
+                raise QueryError(405, f"{method} is not allowed on {url.path}")
+
+            case other:
+                raise QueryError(404, f"No such path: {url.path}")
+
+
+    @staticmethod
+    async def _stream(writer: asyncio.StreamWriter, parts: Iterator[bytes], keep_alive: bool) -> None:
+        """
+        Sends parts as a chunked response, waiting for the client after each part so memory stays bounded.
+        Parts are made off the event loop, since finding them can scan much of the store.
+        """
+
+        writer.write(
+            f"HTTP/1.1 200 OK\r\nContent-Type: text/plain\r\nTransfer-Encoding: chunked\r\n"
+            f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n".encode()
+        )
+        while (data := await asyncio.to_thread(next, parts, None)) != None:
+            writer.write(f"{len(data):x}\r\n".encode() + data + b"\r\n")
+            await writer.drain()
+        writer.write(b"0\r\n\r\n")
+
+
+async def serve(service: QueryService, host: str = "127.0.0.1", port: int = 8642, unix_socket: str | None = None) -> None:
+    """Serves queries until cancelled, on a Unix socket if one is given, otherwise on host:port"""
+
+    if unix_socket != None:
+        server = await asyncio.start_unix_server(service.handle, unix_socket)
+        print(f"Answering queries on {unix_socket}")
+    else:
+        server = await asyncio.start_server(service.handle, host, port)
+        print(f"Answering queries on http://{host}:{port}")
+
+    async with server:
+        await server.serve_forever()
+
+
+def main() -> None:
+    query_settings = settings.get_setting(settings.load_settings(), "query")
+    service = QueryService(ResultStore(RTT_PATH, readonly=True))
+
+    try:
+        asyncio.run(serve(service, query_settings["host"], query_settings["port"], query_settings["unix_socket"]))
+    except KeyboardInterrupt:
+        pass
+
+
+# Run
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,159 @@
+# rank.py
+# Rank and select over the IPs that responded in the result store
+# Counts per block of 4096 IPs and their prefix sums answer range counts and k-th lookups
+# with one partial block read, instead of a scan of the store
+
+
+# Imports
+from __future__ import annotations
+
+import os
+
+import numpy as np
+
+from src.ip import IP, ComplexIPrange, IPrange
+from src.store import INDEX_SPACE, NO_RESPONSE, SCAN_CHUNK, STORE_DIR, ResultStore
+
+
+# Definitions
+RANK_PATH = os.path.join(STORE_DIR, "rank.npy")
+BLOCK_BITS = 12
+BLOCK_SIZE = 1 << BLOCK_BITS
+BLOCK_AMOUNT = INDEX_SPACE // BLOCK_SIZE
+
+
+class RankIndex:
+    """
+    A rank/select index over the result store.
+    The store itself is the bitmap, an IP is set if its byte isn't NO_RESPONSE.
+    Block counts take 2MB and their prefix sums 8MB.
+    After writing to the store, update() recounts only the blocks that were written to.
+
+    Usage:
+    >>> rank = RankIndex.load(store)
+    >>> rank.count(IPrange(IP(0,0,0,0), IP.last_ip))
+    41233
+    >>> rank.select(0)
+    IP(1,0,0,1)
+    """
+
+    def __init__(self, store: ResultStore, block_counts: np.ndarray | None = None) -> None:
+        """
+        Parameters:
+            store: ResultStore # The result store
+            block_counts: np.ndarray | None = None # Responding IPs per block, counted from the store if None
+        """
+
+        self.store = store
+        self.block_counts = self._count_all() if block_counts is None else block_counts
+        self._cumulative = None
+
+
+    def _count_all(self) -> np.ndarray:
+        """Counts every block of the store"""
+
+        block_counts = np.empty(BLOCK_AMOUNT, dtype=np.uint16)
+        blocks_per_chunk = SCAN_CHUNK // BLOCK_SIZE
+        for start in range(0, INDEX_SPACE, SCAN_CHUNK):
+            responded = self.store.read(start, start + SCAN_CHUNK).reshape(blocks_per_chunk, BLOCK_SIZE) != NO_RESPONSE
+            block_counts[start // BLOCK_SIZE:start // BLOCK_SIZE + blocks_per_chunk] = responded.sum(axis=1)
+
+        return block_counts
+
+
+    @property
+    def cumulative(self) -> np.ndarray:
+        """Responding IPs before each block, rebuilt after updates"""
+
+        if self._cumulative is None:
+            self._cumulative = np.zeros(BLOCK_AMOUNT + 1, dtype=np.int64)
+            np.cumsum(self.block_counts, out=self._cumulative[1:])
+
+        return self._cumulative
+
+
+    def update(self, indexes: np.ndarray) -> None:
+        """Recounts the blocks of written IP indexes"""
+
+        blocks = np.unique(np.asarray(indexes, dtype=np.uint32) >> np.uint32(BLOCK_BITS))
+        if len(blocks) == 0:
+            return
+
+        block_indexes = (blocks.astype(np.int64)[:, None] << BLOCK_BITS) + np.arange(BLOCK_SIZE)[None, :]
+        self.block_counts[blocks] = (self.store.rtts[block_indexes] != NO_RESPONSE).sum(axis=1)
+        self._cumulative = None
+
+
+    def rank(self, index: int) -> int:
+        """Returns the amount of responding IPs before an index"""
+
+        block, offset = divmod(index, BLOCK_SIZE)
+        out = int(self.cumulative[block])
+        if offset:
+            out += int(np.count_nonzero(self.store.read(block * BLOCK_SIZE, index)))
+        return out
+
+
+    def count(self, range_: IPrange | ComplexIPrange) -> int:
+        """Returns the amount of responding IPs in a range"""
+
+        return sum(self.rank(stop) - self.rank(start) for start, stop in zip(*(array.tolist() for array in range_.to_arrays())))
+
+
+    def select(self, k: int) -> IP:
+        """
+        Returns the k-th responding IP, counting from 0 in index order
+
+        Raises:
+            IndexError # If less than k + 1 IPs responded
+        """
+
+        if not 0 <= k < self.cumulative[-1]:
+            raise IndexError(f"Only {self.cumulative[-1]} IPs responded, there is no IP number {k}")
+
+        block = int(np.searchsorted(self.cumulative, k, side='right')) - 1
+        in_block = np.flatnonzero(self.store.read(block * BLOCK_SIZE, (block + 1) * BLOCK_SIZE))
+        return IP.from_index(block * BLOCK_SIZE + int(in_block[k - self.cumulative[block]]))
+
+
+    def select_in(self, range_: IPrange | ComplexIPrange, k: int) -> IP:
+        """
+        Returns the k-th responding IP of a range, counting from 0 in index order
+
+        Raises:
+            IndexError # If less than k + 1 IPs in the range responded
+        """
+
+        for start, stop in zip(*(array.tolist() for array in range_.to_arrays())):
+            start_rank = self.rank(start)
+            amount = self.rank(stop) - start_rank
+            if k < amount:
+                return self.select(start_rank + k)
+            k -= amount
+
+        raise IndexError("Not enough IPs in the range responded")
+
+
+    @staticmethod
+    def load(store: ResultStore, path: str = RANK_PATH) -> RankIndex:
+        """Loads the saved block counts, or counts the store if there are none"""
+
+        try:
+            return RankIndex(store, np.load(path))
+        except FileNotFoundError:
+            return RankIndex(store)
+
+
+    def save(self, path: str = RANK_PATH) -> None:
+        """Atomically saves the block counts"""
+
+        tmp_path = path + ".tmp.npy"
+        np.save(tmp_path, self.block_counts)
+        os.replace(tmp_path, path)
+
+
+def reset_rank(path: str = RANK_PATH) -> None:
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
@@ -0,0 +1,276 @@
+# refresh.py
+# Re-pings space that responded before, densest /24s first, and updates the store and maps in place
+# Keeping the map fresh this way only costs a small part of a full scan, and doesn't need a reset
+
+
+# Imports
+from __future__ import annotations
+
+import os
+import sys
+from time import monotonic
+
+import numpy as np
+from PIL import Image
+
+import src.image as image
+import src.settings as settings
+import src.threads as threads
+from src.aggregates import PrefixCounts
+from src.bitmap import IndexBitmap
+from src.exclusions import from_settings as exclusions_from_settings
+from src.history import EpochStore
+from src.ip import IP
+from src.layout import Layout, get_layout, index_to_natural, natural_to_index
+from src.metrics import REGISTRY
+from src.profiling import Profiler
+from src.rank import RankIndex
+from src.retry import RetryScheduler
+from src.sampling import ping_indexes
+from src.store import NO_RESPONSE, SCAN_CHUNK, STORE_DIR, ResultStore, nonzero_offsets, results_to_arrays
+from src.timeout import AdaptiveTimeout
+from src.timeout import from_settings as timeouts_from_settings
+
+
+# Definitions
+WENT_DARK_PATH = os.path.join(STORE_DIR, "went_dark.txt")
+
+
+def live_from_store(store: ResultStore) -> np.ndarray:
+    """Returns the sorted indexes of every IP that responded in the result store"""
+
+    return np.concatenate([
+        nonzero_offsets(store.read(start, start + SCAN_CHUNK)).astype(np.uint32) + np.uint32(start)
+        for start in range(0, len(store.rtts), SCAN_CHUNK)
+    ])
+
+
+def live_from_tiles(layout: Layout) -> np.ndarray:
+    """Returns the sorted indexes of every IP that responded in the map files, for maps from before the result store"""
+
+    live = []
+    for tile in range(image.TILE_AMOUNT):
+        with Image.open(image.map_path(tile + 1)) as img:
+            pixels = np.asarray(img.convert('RGB'))
+
+        ys, xs = np.nonzero((pixels == image.RESPONSE_COLOR).all(axis=2))
+        live.append(layout.inverse(np.full(xs.shape, tile, dtype=np.uint32), xs.astype(np.uint32), ys.astype(np.uint32)))
+
+    return np.sort(np.concatenate(live))
+
+
+def prioritize(live: np.ndarray, whole_blocks: bool = False) -> np.ndarray:
+    """
+    Orders IPs to refresh by the amount of IPs that responded in their /24, densest first
+
+    Parameters:
+        live: np.ndarray # The indexes of the IPs that responded before
+        whole_blocks: bool = False # Also refresh the rest of each /24, after all the IPs that responded before
+
+    Returns:
+        np.ndarray[uint32] # The indexes to ping, in order
+    """
+
+    live = np.asarray(live, dtype=np.uint32)
+    blocks, block_of_live, counts = np.unique(index_to_natural(live) >> np.uint32(8), return_inverse=True, return_counts=True)
+
+    # Rank blocks by density, ties stay in address order
+    block_order = np.argsort(-counts, kind='stable')
+    ranks = np.empty(len(blocks), dtype=np.int64)
+    ranks[block_order] = np.arange(len(blocks))
+
+    out = live[np.argsort(ranks[block_of_live], kind='stable')]
+    if not whole_blocks:
+        return out
+
+    # The rest of the blocks, densest block first
+    naturals = (blocks[block_order].astype(np.uint32)[:, None] << np.uint32(8)) | np.arange(256, dtype=np.uint32)[None, :]
+    rest = natural_to_index(naturals.ravel())
+    rest = rest[~np.isin(rest, live, assume_unique=True)]
+    return np.concatenate((out, rest))
+
+
+class Refresher:
+    """
+    Pings a prioritized list of IPs batch by batch, writes every result to the result store right away,
+    and keeps track of the IPs that responded before but not anymore.
+
+    Usage:
+    >>> refresher = Refresher(ResultStore())
+    >>> went_dark = refresher.run(prioritize(live_from_store(store)), 16, None, input_thrd)
+    """
+
+    def __init__(self, store: ResultStore, batch_size: int = 65536, scheduler: RetryScheduler | None = None, counts: PrefixCounts | None = None) -> None:
+        """
+        Parameters:
+            store: ResultStore # The result store to update
+            batch_size: int = 65536 # IPs pinged per batch
+            scheduler: RetryScheduler | None = None # Pings IPs that went dark again before flagging them, if any
+            counts: PrefixCounts | None = None # Per prefix counts to keep up to date, if any
+        """
+
+        self.store = store
+        self.counts = counts
+        self.batch_size = batch_size
+        self.scheduler = scheduler
+
+        # Everything that was pinged and if it responded, for the maps
+        self.pinged = []
+        self.responded = []
+
+
+    def run(self, indexes: np.ndarray, ping_thread_amount: int, timeouts: AdaptiveTimeout | None, input_thrd: threads.InputThread, live: np.ndarray | None = None) -> np.ndarray:
+        """
+        Refreshes IPs until they are all pinged or the user presses enter
+
+        Parameters:
+            indexes: np.ndarray # The indexes to ping, in order
+            ping_thread_amount: int # The amount of ping threads
+            timeouts: AdaptiveTimeout | None # The adaptive timeout to use, if any
+            input_thrd: threads.InputThread # Stops the refresh when this thread finishes
+            live: np.ndarray | None = None # The sorted indexes that responded before, the result store is used if None
+
+        Returns:
+            np.ndarray[uint32] # The indexes of the IPs that went dark
+        """
+
+        probes = REGISTRY.counter("refresh_probes")
+        came_back_counter = REGISTRY.counter("refresh_came_back")
+        went_dark = []
+
+        for start in range(0, len(indexes), self.batch_size):
+            if not input_thrd.is_alive():
+                break
+
+            # Ping and write to the store
+            batch_indexes, buckets = results_to_arrays(ping_indexes(indexes[start:start + self.batch_size], ping_thread_amount, timeouts, input_thrd))
+            old = self.store.write(batch_indexes, buckets)
+            if self.counts != None:
+                self.counts.update(batch_indexes, old, buckets)
+            responded = buckets != NO_RESPONSE
+            self.pinged.append(batch_indexes)
+            self.responded.append(responded)
+
+            # Compare to the old results, the live set can come from the maps instead of the store
+            if live is None:
+                was_live = old != NO_RESPONSE
+            else:
+                positions = np.minimum(np.searchsorted(live, batch_indexes), max(len(live) - 1, 0))
+                was_live = live[positions] == batch_indexes if len(live) > 0 else np.zeros(len(batch_indexes), dtype=bool)
+            went_dark.append(batch_indexes[was_live & ~responded])
+            came_back_counter.inc(int((~was_live & responded).sum()))
+            probes.inc(len(batch_indexes))
+
+            print(f"Refreshed {start + len(batch_indexes)}/{len(indexes)} ips; {sum(len(dark) for dark in went_dark)} went dark so far")
+
+        went_dark = np.concatenate(went_dark) if went_dark else np.zeros(0, dtype=np.uint32)
+
+        # Ping IPs that went dark again, they may have just dropped a packet
+        if self.scheduler != None and len(went_dark) > 0:
+            pending = IndexBitmap(went_dark)
+            recovered = self.scheduler.run(pending, ping_thread_amount, timeouts, monotonic())
+            if recovered:
+                recovered_indexes, recovered_buckets = results_to_arrays(recovered)
+                old = self.store.write(recovered_indexes, recovered_buckets)
+                if self.counts != None:
+                    self.counts.update(recovered_indexes, old, recovered_buckets)
+                self.pinged.append(recovered_indexes)
+                self.responded.append(np.ones(len(recovered_indexes), dtype=bool))
+            went_dark = pending.to_indexes()
+
+        REGISTRY.counter("refresh_went_dark").inc(len(went_dark))
+        return went_dark
+
+
+    def update_maps(self, layout: Layout) -> None:
+        """Writes everything that was pinged to the map files, later results of an IP win"""
+
+        if not self.pinged:
+            return
+
+        image.update_tiles(np.concatenate(self.pinged), np.concatenate(self.responded), layout)
+
+
+def save_went_dark(went_dark: np.ndarray, path: str = WENT_DARK_PATH) -> None:
+    """Atomically writes the IPs that went dark, one per line"""
+
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, 'wt') as file:
+        file.writelines(f"{IP.from_index(int(index))}\n" for index in went_dark)
+    os.replace(tmp_path, path)
+
+
+def main(profile: bool = False) -> None:
+    """
+    Refreshes the space that responded before
+
+    Parameters:
+        profile: bool = False # Profile each phase
+    """
+
+    settings_ = settings.load_settings()
+    layout = get_layout(settings.get_setting(settings_, "layout"))
+    ping_thread_amount = settings.get_setting(settings_, "thread_amounts")["ping"]
+    refresh_settings = settings.get_setting(settings_, "refresh")
+    retry_settings = settings.get_setting(settings_, "retry")
+    timeouts = timeouts_from_settings(settings.get_setting(settings_, "timeout"))
+    profile_settings = settings.get_setting(settings_, "profile")
+    profiler = Profiler(profile or profile_settings["enabled"], profile_settings["dir"])
+
+    store = ResultStore()
+
+    # Find what responded before
+    with profiler.phase("find"):
+        print("Finding ips that responded before...")
+        if refresh_settings["source"] == "tiles":
+            live = live_from_tiles(layout)
+        else:
+            live = live_from_store(store)
+        indexes = prioritize(live, refresh_settings["whole_blocks"])
+
+        # Drop IPs that were excluded since they were scanned
+        exclusions = exclusions_from_settings(settings.get_setting(settings_, "exclusions"))
+        if exclusions != None:
+            indexes = indexes[exclusions.allows_indexes(indexes)]
+        print(f"Found {len(live)} ips, refreshing {len(indexes)}")
+
+    # Refresh
+    scheduler = RetryScheduler(retry_settings["passes"], retry_settings["spacing"]) if retry_settings["passes"] > 0 else None
+    counts = PrefixCounts.load(store=store)
+    refresher = Refresher(store, refresh_settings["batch_size"], scheduler, counts)
+    input_thrd = threads.InputThread()
+
+    with profiler.phase("ping"):
+        print("Refreshing, press enter to stop...")
+        input_thrd.start()
+        went_dark = refresher.run(indexes, ping_thread_amount, timeouts, input_thrd, live)
+        store.flush()
+        counts.save()
+
+        # Recount the written blocks of the rank index
+        rank = RankIndex.load(store)
+        for pinged in refresher.pinged:
+            rank.update(pinged)
+        rank.save()
+
+    with profiler.phase("save"):
+        print("Updating maps...")
+        refresher.update_maps(layout)
+        save_went_dark(went_dark)
+
+    # Record the refresh in the history
+    history_settings = settings.get_setting(settings_, "history")
+    if history_settings["enabled"]:
+        with profiler.phase("history"):
+            print("Recording the refresh in the history...")
+            EpochStore(history_settings["dir"], history_settings["keyframe_interval"]).record(store, "refresh")
+
+    store.close()
+    print(f"{len(went_dark)} ips went dark, see {WENT_DARK_PATH}")
+    profiler.print_summary()
+
+
+# Run
+if __name__ == "__main__":
+    main("--profile" in sys.argv)
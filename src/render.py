@@ -0,0 +1,123 @@
+# render.py
+# Renders map tiles from the result store
+# Colors are looked up from a table indexed by the stored byte, so a whole tile is colored at once
+
+
+# Imports
+from __future__ import annotations
+
+import os
+import sys
+
+import numpy as np
+from PIL import Image
+
+import src.image as image
+import src.settings as settings
+from src.layout import Layout, get_layout
+from src.profiling import Profiler
+from src.store import NO_RESPONSE, ResultStore
+
+
+# Definitions
+STRIP_ROWS = 1024 # Rows of a tile rendered at once, the arrays of a strip take about 220MB next to the 192MB tile
+
+# Colors of the latency map, from fast to slow
+LATENCY_COLORS = (
+    (0, 0, 255),    # 0.1ms
+    (0, 255, 255),
+    (0, 255, 0),
+    (255, 255, 0),
+    (255, 128, 0),
+    (255, 0, 0),
+    (255, 0, 255)   # 10s
+)
+
+
+def latency_lut() -> np.ndarray:
+    """
+    Returns the color table of the latency map.
+    Bucket 0 (no response) is black, buckets 1-255 go through LATENCY_COLORS.
+
+    Returns:
+        np.ndarray[uint8] # Shape (256, 3)
+    """
+
+    anchors = np.linspace(1, 255, len(LATENCY_COLORS))
+    colors = np.array(LATENCY_COLORS, dtype=np.float64)
+    buckets = np.arange(256)
+
+    lut = np.stack([np.interp(buckets, anchors, colors[:, channel]) for channel in range(3)], axis=1)
+    lut[NO_RESPONSE] = image.NO_RESPONSE_COLOR
+    return np.rint(lut).astype(np.uint8)
+
+
+def response_lut() -> np.ndarray:
+    """Returns the color table of the normal responded/didn't respond map"""
+
+    lut = np.empty((256, 3), dtype=np.uint8)
+    lut[:] = image.RESPONSE_COLOR
+    lut[NO_RESPONSE] = image.NO_RESPONSE_COLOR
+    return lut
+
+
+LUTS = {"latency": latency_lut, "response": response_lut}
+
+
+def render_tile(values: np.ndarray, layout: Layout, tile: int, lut: np.ndarray) -> Image.Image:
+    """
+    Renders one tile from the result store, or anything else with one byte per IP
+
+    Parameters:
+        values: np.ndarray # The bytes to color in index order, like ResultStore.rtts
+        layout: Layout # The layout of the maps
+        tile: int # The zero based tile number
+        lut: np.ndarray # The color table
+
+    Returns:
+        Image.Image # The rendered tile
+    """
+
+    pixels = np.empty((image.TILE_SIZE, image.TILE_SIZE, 3), dtype=np.uint8)
+    xs = np.tile(np.arange(image.TILE_SIZE, dtype=np.uint32), STRIP_ROWS)
+
+    # Render strip by strip
+    for row in range(0, image.TILE_SIZE, STRIP_ROWS):
+        ys = np.repeat(np.arange(row, row + STRIP_ROWS, dtype=np.uint32), image.TILE_SIZE)
+        indexes = layout.inverse(np.full(xs.shape, tile, dtype=np.uint32), xs, ys)
+        pixels[row:row+STRIP_ROWS] = lut[values[indexes]].reshape(STRIP_ROWS, image.TILE_SIZE, 3)
+
+    return Image.fromarray(pixels, mode='RGB')
+
+
+def main(mode: str = "latency", profile: bool = False) -> None:
+    """
+    Renders all 64 tiles from the result store to maps/<mode><num>.png
+
+    Parameters:
+        mode: str = "latency" # The color table to use, see LUTS
+        profile: bool = False # Profile each phase
+    """
+
+    settings_ = settings.load_settings()
+    layout = get_layout(settings.get_setting(settings_, "layout"))
+    profile_settings = settings.get_setting(settings_, "profile")
+    profiler = Profiler(profile or profile_settings["enabled"], profile_settings["dir"])
+
+    store = ResultStore(readonly=True)
+    lut = LUTS[mode]()
+    os.makedirs(image.MAPS_DIR, exist_ok=True)
+
+    with profiler.phase("render"):
+        for tile in range(image.TILE_AMOUNT):
+            img = render_tile(store.rtts, layout, tile, lut)
+            img.save(os.path.join(image.MAPS_DIR, f"{mode}{tile + 1}.png"))
+            print(f"Rendered {tile + 1}/{image.TILE_AMOUNT} images", end='\r')
+
+    print()
+    profiler.print_summary()
+
+
+# Run
+if __name__ == "__main__":
+    main(next((arg for arg in sys.argv[1:] if arg in LUTS), "latency"), "--profile" in sys.argv)
@@ -3,50 +3,97 @@
 
 
 # Imports
+import os
+import shutil
+import sys
+
 from PIL import Image
 
+import src.image as image
 import src.settings as settings
-import src.threads as threads
-from src.global_methods import lazy_split
+from src.aggregates import reset_aggregates
+from src.checkpoint import save_checked_ranges
+from src.profiling import Profiler
+from src.rank import reset_rank
+from src.sampling import reset_sampled
+from src.store import reset_store
+from src.targets import reset_targets
+
+try:
+    from fcntl import ioctl
+except ImportError: # Not available on windows
+    ioctl = None
 
 
 # Definitions
-def main() -> None:
-    print("Creating images...")
-    imgs = [Image.new(mode='RGB', size=(8192,8192), color=(18,18,18)) for _ in range(64)]
+FICLONE = 0x40049409 # Linux ioctl for copy-on-write clones (btrfs, xfs, ...)
+
+
+def clone_file(src: str, dst: str) -> None:
+    """
+    Copies a file, using a copy-on-write reflink when the filesystem supports it.
+    Falls back to a normal (kernel side) file copy otherwise.
+
+    Hard links are not used on purpose, saving a tile opens it for writing,
+    which would overwrite every tile linked to it.
 
-    # Create img and out_num list
-    imgs_n_out_nums = [(img, out_num+1) for out_num, img in enumerate(imgs)]
+    Parameters:
+        src: str # The file to copy
+        dst: str # Where to copy it to
+    """
 
-    # Divide up list
+    if ioctl != None:
+        try:
+            with open(src, 'rb') as src_file, open(dst, 'wb') as dst_file:
+                ioctl(dst_file.fileno(), FICLONE, src_file.fileno())
+            return
+        except OSError:
+            pass
+
+    shutil.copyfile(src, dst)
+
+
+def main(profile: bool = False) -> None:
+    # Set up profiling
     settings_ = settings.load_settings()
-    thrd_amount = 0
-    if settings_["default_settings"]:
-        thrd_amount = settings_["default"]["thread_amounts"]["save"]
-    else:
-        thrd_amount = settings_["user_defined"]["thread_amounts"]["save"]
-    
-    imgs_n_out_nums_subs = lazy_split(imgs_n_out_nums, thrd_amount)
+    profile_settings = settings.get_setting(settings_, "profile")
+    profiler = Profiler(profile or profile_settings["enabled"], profile_settings["dir"])
+
+    os.makedirs(image.MAPS_DIR, exist_ok=True)
 
-    # Create save threads
-    save_thrds = threads.ThreadsList([threads.SaveThread(imgs_n_out_nums_sub, num+1) for num, imgs_n_out_nums_sub in enumerate(imgs_n_out_nums_subs)])
+    # Encode a single blank tile, every tile is the same so there is no reason to encode 64 of them
+    with profiler.phase("encode"):
+        print("Creating blank tile...")
+        blank_path = os.path.join(image.MAPS_DIR, "blank.png.tmp")
+        blank = Image.new(mode='RGB', size=(image.TILE_SIZE, image.TILE_SIZE), color=image.BLANK_COLOR)
+        blank.save(blank_path, format="PNG")
+        del blank
 
-    # Create stats thread
-    stats_thrd = threads.StatsThread(save_thrds)
+    # Replicate the blank tile, each tile is replaced atomically
+    with profiler.phase("copy"):
+        print("Copying blank tile...")
+        for out_num in range(1, image.TILE_AMOUNT + 1):
+            out_path = image.map_path(out_num)
+            tmp_path = out_path + ".tmp"
+            clone_file(blank_path, tmp_path)
+            os.replace(tmp_path, out_path)
+            print(f"Reset {out_num}/{image.TILE_AMOUNT} images", end='\r')
 
-    # Start threads
-    stats_thrd.start()
-    save_thrds.start()
+        print()
+        os.remove(blank_path)
 
-    # Wait for threads to finish
-    save_thrds.join()
-    stats_thrd.end()
+    # Reset checked ranges and results
+    with profiler.phase("checkpoint"):
+        save_checked_ranges(None)
+        reset_store()
+        reset_sampled()
+        reset_aggregates()
+        reset_rank()
+        reset_targets()
 
-    # Reset checked ranges
-    with open("checked_ranges.txt", 'wt') as file:
-        file.write("None")
+    profiler.print_summary()
 
 
 # Run
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    main("--profile" in sys.argv)
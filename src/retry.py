@@ -0,0 +1,125 @@
+# retry.py
+# Re-pings IPs that didn't respond, so a single lost packet doesn't mark a host as dead forever
+
+
+# Imports
+from __future__ import annotations
+
+from time import monotonic, sleep
+
+import numpy as np
+
+import src.threads as threads
+from src.bitmap import IndexBitmap
+from src.global_methods import lazy_split
+from src.ip import IP
+from src.layout import index_to_natural
+from src.metrics import REGISTRY
+from src.timeout import AdaptiveTimeout
+
+
+# Definitions
+def retry_candidates(indexes: np.ndarray, responded: np.ndarray, live_blocks_only: bool = True) -> IndexBitmap:
+    """
+    Returns the IPs that should be pinged again
+
+    Parameters:
+        indexes: np.ndarray # The pinged IP indexes
+        responded: np.ndarray # If each IP responded
+        live_blocks_only: bool = True # Only retry IPs in a /24 where something else responded, dead space is not worth retrying
+
+    Returns:
+        IndexBitmap # The IPs to retry
+    """
+
+    indexes = np.asarray(indexes, dtype=np.uint32)
+    responded = np.asarray(responded, dtype=bool)
+    candidates = indexes[~responded]
+
+    if live_blocks_only:
+        live_blocks = np.unique(index_to_natural(indexes[responded]) >> np.uint32(8))
+        candidates = candidates[np.isin(index_to_natural(candidates) >> np.uint32(8), live_blocks)]
+
+    return IndexBitmap(candidates)
+
+
+class RetryScheduler:
+    """
+    Pings the IPs in a later pass set again in one or more passes.
+    IPs that respond are taken out of the set, so each pass only pings what is still missing.
+
+    Usage:
+    >>> scheduler = RetryScheduler(passes=2, spacing=10)
+    >>> recovered = scheduler.run(retry_candidates(indexes, responded), 16)
+    """
+
+    def __init__(self, passes: int = 1, spacing: float = 10) -> None:
+        """
+        Parameters:
+            passes: int = 1 # The amount of passes
+            spacing: float = 10 # Minimum seconds between the start of the scan or a pass and the next pass
+        """
+
+        self.passes = passes
+        self.spacing = spacing
+        self.stats = [] # (pass number, pinged, recovered)
+
+
+    def run(self, pending: IndexBitmap, ping_thread_amount: int, timeouts: AdaptiveTimeout | None = None, last_pass: float | None = None) -> list[tuple[IP, float]]:
+        """
+        Runs the retry passes
+
+        Parameters:
+            pending: IndexBitmap # The IPs to retry, responding IPs are removed from it
+            ping_thread_amount: int # The amount of ping threads per pass
+            timeouts: AdaptiveTimeout | None = None # The adaptive timeout to use, if any
+            last_pass: float | None = None # time.monotonic() of when the previous scan finished
+
+        Returns:
+            list[tuple[IP, float]] # The IPs that responded and their round trip times
+        """
+
+        probes = REGISTRY.counter("retry_probes")
+        recovered_counter = REGISTRY.counter("retry_recovered")
+        last_pass = monotonic() if last_pass == None else last_pass
+
+        recovered = []
+        for pass_num in range(1, self.passes + 1):
+            if not pending:
+                break
+
+            # Wait for the spacing, hosts that dropped a packet may just be busy
+            wait = self.spacing - (monotonic() - last_pass)
+            if wait > 0:
+                sleep(wait)
+
+            # Ping every pending IP
+            ips = [IP.from_index(int(index)) for index in pending.to_indexes()]
+            ips_subs = lazy_split(ips, min(ping_thread_amount, len(ips)))
+            ping_thrds = threads.ThreadsList([threads.PingThread(ips_sub, num+1, timeouts) for num, ips_sub in enumerate(ips_subs)])
+            ping_thrds.start()
+            results = [result for ping_thrd in ping_thrds for result in ping_thrd.join()[0]]
+            last_pass = monotonic()
+
+            # Take the responding IPs out of the pending set
+            pass_recovered = [(ip, rtt) for ip, rtt in results if rtt != None]
+            pending.remove(np.array([ip.to_index for ip, _ in pass_recovered], dtype=np.uint32))
+            recovered += pass_recovered
+
+            # Record stats
+            probes.inc(len(results))
+            recovered_counter.inc(len(pass_recovered))
+            self.stats.append((pass_num, len(results), len(pass_recovered)))
+            print(f"Retry pass {pass_num}: pinged {len(results)} ips, {len(pass_recovered)} responded ({len(pass_recovered) / max(1, len(results)):.2%})")
+
+        return recovered
+
+
+def merge_results(results: list[tuple[IP, float | None]], recovered: list[tuple[IP, float]]) -> list[tuple[IP, float | None]]:
+    """Replaces the results of IPs that responded in a retry pass"""
+
+    if not recovered:
+        return results
+
+    recovered_rtts = {ip.to_index: rtt for ip, rtt in recovered}
+    return [(ip, recovered_rtts.get(ip.to_index, rtt)) for ip, rtt in results]
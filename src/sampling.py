@@ -0,0 +1,232 @@
+# sampling.py
+# Adaptive sampling, pings a sample of every block first and only scans blocks that look alive
+# Sampled blocks are recorded per block instead of in checked_ranges, a /24 is 256 separate ranges in index order
+# Blocks that look dead are recorded as sampled-dead, and a normal scan can still fill them in later
+
+
+# Imports
+from __future__ import annotations
+
+import os
+from time import sleep
+
+import numpy as np
+
+import src.threads as threads
+from src.exclusions import AddressFilter
+from src.global_methods import lazy_split
+from src.ip import IP, ComplexIPrange, IPArray, IPrange
+from src.layout import natural_to_index
+from src.metrics import REGISTRY
+from src.store import NO_RESPONSE, STORE_DIR, ResultStore, results_to_arrays
+from src.timeout import AdaptiveTimeout
+
+
+# Definitions
+SAMPLED_DEAD_PATH = os.path.join(STORE_DIR, "sampled_dead.bits")
+SAMPLED_LIVE_PATH = os.path.join(STORE_DIR, "sampled_live.bits")
+
+
+def _in_ranges(indexes: np.ndarray, starts: np.ndarray, stops: np.ndarray) -> np.ndarray:
+    """Returns which indexes are inside of sorted, non overlapping ranges"""
+
+    positions = np.searchsorted(starts, indexes, side='right') - 1
+    return (positions >= 0) & (indexes < stops[np.maximum(positions, 0)])
+
+
+def ping_indexes(indexes: np.ndarray, ping_thread_amount: int, timeouts: AdaptiveTimeout | None, input_thrd: threads.InputThread | None) -> list[tuple[IP, float | None]]:
+    """
+    Pings a batch of IP indexes with ping threads
+
+    Parameters:
+        indexes: np.ndarray # The IP indexes to ping
+        ping_thread_amount: int # The amount of ping threads
+        timeouts: AdaptiveTimeout | None # The adaptive timeout to use, if any
+        input_thrd: threads.InputThread | None # The threads are ended early when this thread finishes, never if None
+
+    Returns:
+        list[tuple[IP, float | None]] # The results
+    """
+
+    if len(indexes) == 0:
+        return []
+
+    ips = IPArray(indexes).to_ips()
+    ping_thrds = threads.ThreadsList([threads.PingThread(ips_sub, num+1, timeouts) for num, ips_sub in enumerate(lazy_split(ips, min(ping_thread_amount, len(ips))))])
+    ping_thrds.start()
+
+    # End early if the user pressed enter
+    while any(ping_thrd.is_alive() for ping_thrd in ping_thrds):
+        if input_thrd != None and not input_thrd.is_alive():
+            ping_thrds.end()
+            break
+        sleep(0.2)
+
+    return [result for ping_thrd in ping_thrds for result in ping_thrd.join()[0]]
+
+
+class AdaptiveSampler:
+    """
+    Scans the address space block by block.
+    A sample of each block is pinged first, and the whole block is only scanned if enough of the sample responded,
+    or if enough of the block responded in earlier scans.
+
+    Usage:
+    >>> sampler = AdaptiveSampler(prefix_length=24, sample_size=8)
+    >>> results = sampler.run(ping_range, 16, None, input_thrd)
+    """
+
+    def __init__(self, prefix_length: int = 24, sample_size: int = 8, hit_threshold: float = 0.01, prior_threshold: float = 0.01, batch_size: int = 1048576, store: ResultStore | None = None, exclusions: AddressFilter | None = None) -> None:
+        """
+        Parameters:
+            prefix_length: int = 24 # The prefix length of a block
+            sample_size: int = 8 # IPs pinged per block as a sample
+            hit_threshold: float = 0.01 # Fraction of the sample that has to respond to scan the whole block
+            prior_threshold: float = 0.01 # Fraction of the block that has to have responded before to scan it without sampling
+            batch_size: int = 1048576 # IPs per batch of blocks, a batch is sampled at once
+            store: ResultStore | None = None # The result store with earlier scans, if any
+            exclusions: AddressFilter | None = None # IPs that may not be pinged, if any
+        """
+
+        self.prefix_length = prefix_length
+        self.block_size = 1 << (32 - prefix_length)
+        self.sample_size = min(sample_size, self.block_size)
+        self.hit_threshold = hit_threshold
+        self.prior_threshold = prior_threshold
+        self.batch_blocks = max(1, batch_size // self.block_size)
+        self.store = store
+        self.exclusions = exclusions
+
+        # Evenly spread sample offsets, away from the .0 and .255 of a block
+        step = self.block_size // self.sample_size
+        self.sample_offsets = (np.arange(self.sample_size, dtype=np.uint32) * step + step // 2).astype(np.uint32)
+
+        self.sampled_dead = load_block_bits(SAMPLED_DEAD_PATH, prefix_length)
+        self.sampled_live = load_block_bits(SAMPLED_LIVE_PATH, prefix_length)
+
+
+    def _block_indexes(self, blocks: np.ndarray, offsets: np.ndarray) -> np.ndarray:
+        """Returns the indexes of the given offsets inside each block, block by block"""
+
+        naturals = (blocks.astype(np.uint64)[:, None] << np.uint64(32 - self.prefix_length)) + offsets[None, :]
+        return natural_to_index(naturals.astype(np.uint32)).ravel()
+
+
+    def _prior_density(self, blocks: np.ndarray) -> np.ndarray:
+        """Returns the fraction of each block that responded in the store"""
+
+        if self.store == None:
+            return np.zeros(len(blocks))
+
+        indexes = self._block_indexes(blocks, np.arange(self.block_size, dtype=np.uint32))
+        responded = (self.store.rtts[indexes] != NO_RESPONSE).reshape(len(blocks), self.block_size)
+        return responded.mean(axis=1)
+
+
+    def run(self, ping_range: IPrange | ComplexIPrange, ping_thread_amount: int, timeouts: AdaptiveTimeout | None, input_thrd: threads.InputThread) -> list[tuple[IP, float | None]]:
+        """
+        Scans a range adaptively until it is done or the user presses enter.
+        Blocks that were scanned whole are marked as sampled-live, they aren't added to the checked ranges.
+
+        Returns:
+            list[tuple[IP, float | None]] # The results of every IP that was pinged
+        """
+
+        starts, stops = ping_range.to_arrays()
+        sampled_counter = REGISTRY.counter("sampled_blocks")
+        dead_counter = REGISTRY.counter("sampled_dead_blocks")
+        block_amount = 1 << self.prefix_length
+
+        is_sample = np.zeros(self.block_size, dtype=bool)
+        is_sample[self.sample_offsets] = True
+        rest_offsets = np.flatnonzero(~is_sample).astype(np.uint32)
+
+        results = []
+        for first_block in range(0, block_amount, self.batch_blocks):
+            if not input_thrd.is_alive():
+                break
+
+            # Get blocks that weren't already sampled and are in the range
+            blocks = np.arange(first_block, min(first_block + self.batch_blocks, block_amount), dtype=np.uint32)
+            blocks = blocks[~(self.sampled_dead[blocks] | self.sampled_live[blocks])]
+            block_indexes = self._block_indexes(blocks, np.arange(self.block_size, dtype=np.uint32))
+            block_in_range = _in_ranges(block_indexes, starts, stops)
+            if self.exclusions != None:
+                block_in_range &= self.exclusions.allows_indexes(block_indexes)
+            block_in_range = block_in_range.reshape(len(blocks), self.block_size)
+            blocks, block_in_range = blocks[block_in_range.any(axis=1)], block_in_range[block_in_range.any(axis=1)]
+            if len(blocks) == 0:
+                continue
+
+            # Ping the samples that are in the range
+            samples = self._block_indexes(blocks, self.sample_offsets)
+            sample_in_range = block_in_range[:, self.sample_offsets]
+            sample_results = ping_indexes(samples[sample_in_range.ravel()], ping_thread_amount, timeouts, input_thrd)
+            results += sample_results
+
+            # Stop before judging blocks whose samples weren't all pinged
+            if not input_thrd.is_alive():
+                break
+
+            # Get the hit rate of each block
+            _, buckets = results_to_arrays(sample_results)
+            hits = np.zeros(sample_in_range.shape, dtype=bool)
+            hits[sample_in_range] = buckets != NO_RESPONSE
+            sampled = sample_in_range.sum(axis=1)
+            hit_rates = hits.sum(axis=1) / np.maximum(sampled, 1)
+
+            # Decide which blocks to scan, blocks without a sample in the range can't be judged so they are scanned
+            live = (sampled == 0) | ((hit_rates > 0) & (hit_rates >= self.hit_threshold))
+            live |= self._prior_density(blocks) >= max(self.prior_threshold, 1 / self.block_size)
+            self.sampled_dead[blocks[~live]] = True
+            sampled_counter.inc(len(blocks))
+            dead_counter.inc(int((~live).sum()))
+
+            # Scan the rest of the live blocks
+            rest = self._block_indexes(blocks[live], rest_offsets)
+            rest_in_range = block_in_range[live][:, rest_offsets].ravel()
+            results += ping_indexes(rest[rest_in_range], ping_thread_amount, timeouts, input_thrd)
+            if not input_thrd.is_alive():
+                break
+            self.sampled_live[blocks[live]] = True
+
+            print(f"Sampled {min(first_block + self.batch_blocks, block_amount)}/{block_amount} blocks; {int(live.sum())} live and {int((~live).sum())} sampled-dead in this batch; {len(results)} ips pinged")
+
+        save_block_bits(SAMPLED_DEAD_PATH, self.sampled_dead)
+        save_block_bits(SAMPLED_LIVE_PATH, self.sampled_live)
+        return results
+
+
+def load_block_bits(path: str, prefix_length: int) -> np.ndarray:
+    """Returns a saved bool array with one entry per block, or all False if there is none"""
+
+    block_amount = 1 << prefix_length
+    try:
+        bits = np.fromfile(path, dtype=np.uint8)
+    except FileNotFoundError:
+        return np.zeros(block_amount, dtype=bool)
+
+    # A different prefix length makes the old blocks meaningless
+    if len(bits) * 8 != block_amount:
+        return np.zeros(block_amount, dtype=bool)
+
+    return np.unpackbits(bits).astype(bool)
+
+
+def save_block_bits(path: str, bits: np.ndarray) -> None:
+    """Atomically saves a bool array with one entry per block"""
+
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = path + ".tmp"
+    np.packbits(bits).tofile(tmp_path)
+    os.replace(tmp_path, path)
+
+
+def reset_sampled() -> None:
+    """Forgets which blocks were sampled"""
+
+    for path in (SAMPLED_DEAD_PATH, SAMPLED_LIVE_PATH):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
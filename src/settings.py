@@ -5,6 +5,7 @@
 # Imports
 import json
 from sys import exit as sys_exit
+from typing import Any
 
 
 # Definitions
@@ -23,6 +24,23 @@ def load_settings() -> dict:
     
     # Return settings
     return json_data
+
+
+def get_setting(settings: dict, key: str) -> Any:
+    """
+    Returns a setting from the settings currently in use.
+    Falls back to the default settings if the user defined settings do not have it yet.
+
+    Usage:
+    >>> settings = load_settings()
+    >>> get_setting(settings, "layout")
+    'octet'
+    """
+
+    if settings["default_settings"]:
+        return settings["default"][key]
+    else:
+        return settings["user_defined"].get(key, settings["default"][key])
     
 
 def main():
@@ -3,30 +3,46 @@
 
 
 # Imports
+import sys
+
 from PIL import Image
 
+import src.settings as settings
 from src.image import get_images
-from src.listb1 import Listb1
+from src.layout import MAP_SIZE, get_layout
+from src.profiling import Profiler
 
 
 # Definitions
-def main() -> None:
+def main(profile: bool = False) -> None:
+    # Get map layout
+    settings_ = settings.load_settings()
+    layout = get_layout(settings.get_setting(settings_, "layout"))
+
+    # Set up profiling
+    profile_settings = settings.get_setting(settings_, "profile")
+    profiler = Profiler(profile or profile_settings["enabled"], profile_settings["dir"])
+
     # Open all the images
-    imgs = Listb1(get_images())
+    with profiler.phase("open"):
+        imgs = get_images()
 
     # Initialize big map
-    big_map = Image.new('RGB', (65536, 65536))
+    big_map = Image.new('RGB', (MAP_SIZE, MAP_SIZE))
 
     # Paste sub-maps to big map
-    print("Pasting sub-maps...")
-    for i, y in enumerate(range(0, 64, 8)):
-        for j, x in enumerate(range(1, 9)):
-            big_map.paste(imgs[x + y], (8192*i, 8192*j))
+    with profiler.phase("paste"):
+        print("Pasting sub-maps...")
+        for tile, img in enumerate(imgs):
+            big_map.paste(img, layout.tile_position(tile))
 
     # Save the big map
-    print("Saving map...")
-    big_map.save("map.png")
+    with profiler.phase("save"):
+        print("Saving map...")
+        big_map.save("map.png")
+
+    profiler.print_summary()
 
 # Run
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main("--profile" in sys.argv)
\ No newline at end of file
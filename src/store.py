@@ -0,0 +1,177 @@
+# store.py
+# Compact on disk store of the ping results
+# Holds one byte per IP, ordered by IP.to_index: 0 if the IP did not respond, otherwise its quantized round trip time
+
+
+# Imports
+from __future__ import annotations
+
+import os
+
+import numpy as np
+
+from src.ip import IP
+
+
+# Definitions
+STORE_DIR = "results"
+RTT_PATH = os.path.join(STORE_DIR, "rtt.u8")
+INDEX_SPACE = 256**4
+SCAN_CHUNK = 1 << 26 # Bytes of the store handled at once by scans over the whole store, a multiple of 65536
+
+NO_RESPONSE = 0
+RTT_MIN = 0.0001 # Round trip time of bucket 1, in seconds
+RTT_MAX = 10.0   # Round trip time of bucket 255, in seconds
+_LOG_RANGE = np.log(RTT_MAX / RTT_MIN)
+
+
+def quantize_rtt(rtts: np.ndarray) -> np.ndarray:
+    """
+    Quantizes round trip times to log scale buckets.
+    Each bucket is about 4.6% wider than the last, from 0.1ms to 10s.
+
+    Parameters:
+        rtts: np.ndarray # Round trip times in seconds, NaN if the IP did not respond
+
+    Returns:
+        np.ndarray[uint8] # The buckets, 0 if the IP did not respond
+
+    Usage:
+    >>> quantize_rtt(np.array([np.nan, 0.0001, 0.05, 10.0]))
+    array([  0,   1, 138, 255], dtype=uint8)
+    """
+
+    rtts = np.asarray(rtts, dtype=np.float64)
+    responded = rtts >= 0 # NaN compares false, a 0.0s round trip is bucket 1
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        buckets = 1 + np.rint(np.log(rtts / RTT_MIN) / _LOG_RANGE * 254)
+
+    return np.where(responded, np.clip(buckets, 1, 255), NO_RESPONSE).astype(np.uint8)
+
+
+def dequantize_rtt(buckets: np.ndarray) -> np.ndarray:
+    """
+    Returns the round trip time in the middle of each bucket
+
+    Parameters:
+        buckets: np.ndarray # The buckets
+
+    Returns:
+        np.ndarray[float32] # Round trip times in seconds, NaN for no response
+    """
+
+    buckets = np.asarray(buckets, dtype=np.float64)
+    rtts = RTT_MIN * np.exp((buckets - 1) / 254 * _LOG_RANGE)
+    return np.where(buckets == NO_RESPONSE, np.nan, rtts).astype(np.float32)
+
+
+class ResultStore:
+    """
+    The result store, memory mapped from a sparse file.
+    Parts of the space that were never written take no disk space.
+
+    Usage:
+    >>> store = ResultStore()
+    >>> store.write(np.array([IP(1,1,1,1).to_index]), quantize_rtt(np.array([0.02])))
+    >>> store.read(IP(1,1,1,1).to_index, IP(1,1,1,2).to_index)
+    memmap([118], dtype=uint8)
+    """
+
+    def __init__(self, path: str = RTT_PATH, readonly: bool = False) -> None:
+        """
+        Opens the result store, creating it if it doesn't exist
+
+        Parameters:
+            path: str = RTT_PATH # The store file
+            readonly: bool = False # Open the store read only, for readers that run while a scan writes
+        """
+
+        self.path = path
+        self.readonly = readonly
+
+        if not os.path.exists(path):
+            if readonly:
+                raise FileNotFoundError(f"No result store at {path}")
+
+            # Create a sparse file
+            os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+            with open(path, 'wb') as file:
+                file.truncate(INDEX_SPACE)
+
+        self.rtts = np.memmap(path, dtype=np.uint8, mode='r' if readonly else 'r+', shape=(INDEX_SPACE,))
+
+
+    def write(self, indexes: np.ndarray, buckets: np.ndarray) -> np.ndarray:
+        """
+        Writes results to the store
+
+        Parameters:
+            indexes: np.ndarray # The IP indexes
+            buckets: np.ndarray # The quantized round trip times, see quantize_rtt
+
+        Returns:
+            np.ndarray[uint8] # The buckets that were there before
+        """
+
+        indexes = np.asarray(indexes, dtype=np.uint32)
+        old = self.rtts[indexes]
+        self.rtts[indexes] = buckets
+        return old
+
+
+    def read(self, start: int, stop: int) -> np.ndarray:
+        """Returns the buckets of the indexes from start up to stop, without copying"""
+
+        return self.rtts[start:stop]
+
+
+    def flush(self) -> None:
+        if not self.readonly:
+            self.rtts.flush()
+
+
+    def close(self) -> None:
+        self.flush()
+        del self.rtts
+
+
+def reset_store(path: str = RTT_PATH) -> None:
+    """Resets the store to nothing responding by replacing it with an empty sparse file"""
+
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, 'wb') as file:
+        file.truncate(INDEX_SPACE)
+    os.replace(tmp_path, path)
+
+
+def nonzero_offsets(chunk: np.ndarray) -> np.ndarray:
+    """
+    Returns the offsets of the bytes that aren't NO_RESPONSE in a chunk of the store, about 8 times faster than np.flatnonzero.
+    Words of 8 bytes are checked first, since most of the store is empty.
+
+    Parameters:
+        chunk: np.ndarray # A contiguous uint8 chunk with a length that's a multiple of 8
+    """
+
+    words = np.flatnonzero(chunk.view(np.uint64))
+    offsets = (words[:, None] * 8 + np.arange(8)[None, :]).ravel()
+    return offsets[chunk[offsets] != NO_RESPONSE]
+
+
+def results_to_arrays(results: list[tuple[IP, float | None]]) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Converts ping results to arrays
+
+    Parameters:
+        results: list[tuple[IP, float | None]] # The IPs and their round trip time, None if they did not respond
+
+    Returns:
+        tuple[np.ndarray, np.ndarray] # The uint32 indexes and the uint8 buckets
+    """
+
+    indexes = np.fromiter((ip.to_index for ip, _ in results), dtype=np.uint32, count=len(results))
+    rtts = np.fromiter((rtt if isinstance(rtt, float) else np.nan for _, rtt in results), dtype=np.float64, count=len(results))
+    return indexes, quantize_rtt(rtts)
+
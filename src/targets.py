@@ -0,0 +1,246 @@
+# targets.py
+# Pings a list of IPs and CIDR blocks from a file or stdin instead of ranges of the address space
+# The list is streamed in chunks and parsed in bulk, targets that were already pinged are skipped with a bitmap,
+# and results are written batch by batch, so memory doesn't grow with the list
+
+
+# Imports
+from __future__ import annotations
+
+import os
+import sys
+from collections.abc import Iterator
+from typing import BinaryIO
+
+import numpy as np
+
+import src.settings as settings
+import src.threads as threads
+from src.aggregates import PrefixCounts
+from src.cidr import iter_cidr_file
+from src.exclusions import AddressFilter
+from src.exclusions import from_settings as exclusions_from_settings
+from src.history import EpochStore
+from src.layout import get_layout, natural_to_index
+from src.metrics import REGISTRY
+from src.profiling import Profiler
+from src.rank import RankIndex
+from src.sampling import ping_indexes
+from src.store import INDEX_SPACE, NO_RESPONSE, STORE_DIR, ResultStore, results_to_arrays
+from src.timeout import AdaptiveTimeout
+from src.timeout import from_settings as timeouts_from_settings
+from src.writer import BatchWriter
+
+
+# Definitions
+TARGETS_DONE_PATH = os.path.join(STORE_DIR, "targets_done.bits")
+EXPAND_LIMIT = 1 << 22 # Most IPs expanded from CIDR blocks at once
+
+
+def expand_cidrs(naturals: np.ndarray, prefix_lengths: np.ndarray, limit: int = EXPAND_LIMIT) -> Iterator[np.ndarray]:
+    """
+    Yields the natural values of every IP in CIDR blocks, at most limit IPs at a time
+
+    Usage:
+    >>> [len(naturals) for naturals in expand_cidrs(np.array([167772160]), np.array([8]))]
+    [4194304, 4194304, 4194304, 4194304]
+    """
+
+    # Split blocks larger than the limit into pieces of the limit
+    sizes = np.int64(1) << (32 - np.asarray(prefix_lengths, dtype=np.int64))
+    piece_amounts = -(-sizes // limit)
+    pieces = np.arange(int(piece_amounts.sum())) - np.repeat(np.cumsum(piece_amounts) - piece_amounts, piece_amounts)
+    piece_starts = np.repeat(np.asarray(naturals, dtype=np.int64), piece_amounts) + pieces * limit
+    piece_sizes = np.repeat(np.minimum(sizes, limit), piece_amounts)
+
+    # Expand a group of pieces at a time
+    first = 0
+    ends = np.cumsum(piece_sizes)
+    while first < len(piece_sizes):
+        last = int(np.searchsorted(ends, (ends[first - 1] if first else 0) + limit, side='right'))
+        sizes_ = piece_sizes[first:last]
+        offsets = np.arange(int(sizes_.sum())) - np.repeat(np.cumsum(sizes_) - sizes_, sizes_)
+        yield (np.repeat(piece_starts[first:last], sizes_) + offsets).astype(np.uint32)
+        first = last
+
+
+class DoneBitmap:
+    """
+    One bit per IP index of the targets that were already pinged, memory mapped from a sparse file.
+    Kept between runs, so a stopped target scan picks up where it left off.
+    """
+
+    def __init__(self, path: str = TARGETS_DONE_PATH) -> None:
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+            with open(path, 'wb') as file:
+                file.truncate(INDEX_SPACE // 8)
+
+        self.bits = np.memmap(path, dtype=np.uint8, mode='r+', shape=(INDEX_SPACE // 8,))
+
+
+    def contains(self, indexes: np.ndarray) -> np.ndarray:
+        """Returns which indexes are done"""
+
+        indexes = np.asarray(indexes, dtype=np.uint32)
+        return (self.bits[indexes >> np.uint32(3)] & (np.uint8(128) >> (indexes & np.uint32(7)).astype(np.uint8))) != 0
+
+
+    def add(self, indexes: np.ndarray) -> None:
+        """Marks indexes as done"""
+
+        indexes = np.asarray(indexes, dtype=np.uint32)
+        np.bitwise_or.at(self.bits, indexes >> np.uint32(3), np.uint8(128) >> (indexes & np.uint32(7)).astype(np.uint8))
+
+
+    def close(self) -> None:
+        self.bits.flush()
+        del self.bits
+
+
+def reset_targets(path: str = TARGETS_DONE_PATH) -> None:
+    """Forgets which targets were pinged"""
+
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+class TargetScanner:
+    """
+    Pings the targets of a list batch by batch and writes every result with a batch writer right away
+
+    Usage:
+    >>> scanner = TargetScanner(BatchWriter(ResultStore(), layout=get_layout("octet")), DoneBitmap())
+    >>> with open("targets.txt", 'rb') as file:
+    ...     responded = scanner.run(file, 16, None, input_thrd)
+    """
+
+    def __init__(self, writer: BatchWriter, done: DoneBitmap, batch_size: int = 65536, chunk_size: int = 1 << 24, exclusions: AddressFilter | None = None) -> None:
+        """
+        Parameters:
+            writer: BatchWriter # Writes the results
+            done: DoneBitmap # The targets that were already pinged
+            batch_size: int = 65536 # IPs pinged per batch
+            chunk_size: int = 1 << 24 # Bytes of the list read at once
+            exclusions: AddressFilter | None = None # IPs that may not be pinged, if any
+        """
+
+        self.writer = writer
+        self.done = done
+        self.batch_size = batch_size
+        self.chunk_size = chunk_size
+        self.exclusions = exclusions
+
+
+    def targets(self, file: BinaryIO) -> Iterator[np.ndarray]:
+        """Yields the sorted indexes of targets that weren't pinged yet, in batches of at most EXPAND_LIMIT"""
+
+        skipped = REGISTRY.counter("targets_skipped")
+        for naturals, prefix_lengths in iter_cidr_file(file, self.chunk_size):
+            for expanded in expand_cidrs(naturals, prefix_lengths):
+                indexes = np.unique(natural_to_index(expanded))
+                keep = ~self.done.contains(indexes)
+                if self.exclusions != None:
+                    keep &= self.exclusions.allows_indexes(indexes)
+
+                skipped.inc(len(expanded) - int(keep.sum()))
+                if keep.any():
+                    yield indexes[keep]
+
+
+    def run(self, file: BinaryIO, ping_thread_amount: int, timeouts: AdaptiveTimeout | None, input_thrd: threads.InputThread | None) -> int:
+        """
+        Pings the targets until the list ends or the user presses enter, only the end of the list stops it if input_thrd is None
+
+        Returns:
+            int # The amount of targets that responded
+        """
+
+        probes = REGISTRY.counter("target_probes")
+        pinged_amount = responded_amount = 0
+        stopped = lambda: input_thrd != None and not input_thrd.is_alive()
+
+        for indexes in self.targets(file):
+            for start in range(0, len(indexes), self.batch_size):
+                if stopped():
+                    break
+
+                # Ping, write and mark as done
+                batch_indexes, buckets = results_to_arrays(ping_indexes(indexes[start:start + self.batch_size], ping_thread_amount, timeouts, input_thrd))
+                self.writer.write(batch_indexes, buckets)
+                self.done.add(batch_indexes)
+
+                probes.inc(len(batch_indexes))
+                pinged_amount += len(batch_indexes)
+                responded_amount += int((buckets != NO_RESPONSE).sum())
+                print(f"Pinged {pinged_amount} targets; {responded_amount} responded")
+
+            if stopped():
+                break
+
+        self.writer.flush()
+        return responded_amount
+
+
+def main(path: str, profile: bool = False) -> None:
+    """
+    Pings a list of targets
+
+    Parameters:
+        path: str # The file of IPs and CIDR blocks, one per line, - reads stdin
+        profile: bool = False # Profile each phase
+    """
+
+    settings_ = settings.load_settings()
+    layout = get_layout(settings.get_setting(settings_, "layout"))
+    ping_thread_amount = settings.get_setting(settings_, "thread_amounts")["ping"]
+    target_settings = settings.get_setting(settings_, "targets")
+    timeouts = timeouts_from_settings(settings.get_setting(settings_, "timeout"))
+    exclusions = exclusions_from_settings(settings.get_setting(settings_, "exclusions"))
+    profile_settings = settings.get_setting(settings_, "profile")
+    profiler = Profiler(profile or profile_settings["enabled"], profile_settings["dir"])
+
+    store = ResultStore()
+    done = DoneBitmap()
+    counts = PrefixCounts.load(store=store)
+    rank = RankIndex.load(store)
+    writer = BatchWriter(store, counts, rank, layout, target_settings["map_batch"])
+    scanner = TargetScanner(writer, done, target_settings["batch_size"], target_settings["chunk_size"], exclusions)
+
+    with profiler.phase("ping"):
+        # Stdin is the list, so it can't also be read for enter
+        if path == "-":
+            print("Pinging targets from stdin...")
+            responded = scanner.run(sys.stdin.buffer, ping_thread_amount, timeouts, None)
+        else:
+            print("Pinging targets, press enter to stop...")
+            input_thrd = threads.InputThread()
+            input_thrd.start()
+            with open(path, 'rb') as file:
+                responded = scanner.run(file, ping_thread_amount, timeouts, input_thrd)
+
+    with profiler.phase("checkpoint"):
+        done.close()
+        counts.save()
+        rank.save()
+
+    # Record the scan in the history
+    history_settings = settings.get_setting(settings_, "history")
+    if history_settings["enabled"]:
+        with profiler.phase("history"):
+            print("Recording the scan in the history...")
+            EpochStore(history_settings["dir"], history_settings["keyframe_interval"]).record(store, "targets")
+
+    store.close()
+    print(f"{responded} targets responded")
+    profiler.print_summary()
+
+
+# Run
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print("Usage: python -m src.targets <path | -> [--profile]")
+    else:
+        main(sys.argv[1], "--profile" in sys.argv)
@@ -7,16 +7,21 @@ from __future__ import annotations
 
 from datetime import datetime
 from threading import Thread
-from time import sleep
+from time import perf_counter, sleep
 from typing import Any
 
+import numpy as np
 from PIL.PngImagePlugin import PngImageFile
 from PIL.PyAccess import PyAccess
 
 import src.image as image
+from src.exclusions import AddressFilter
 from src.global_methods import all_equal, all_same_type, isntinstance
 from src.ip import IP, ComplexIPrange, IPrange
-from src.ping import ping
+from src.layout import Layout
+from src.metrics import ENCODE_BUCKETS, QUEUE_DEPTH_BUCKETS, REGISTRY, RTT_BUCKETS
+from src.ping import DEFAULT_TIMEOUT, ping
+from src.timeout import AdaptiveTimeout
 
 
 # Definitions   
@@ -70,23 +75,25 @@ class PingThread(ThreadWrap):
 
     # Variables
     check_range = IPrange # The range of ips to check
-    results = []          # The results of the pings
+    results = []          # The results of the pings, (ip, round trip time or None)
     total_pinged = 0      # The total amount of ips pinged this thread
     is_finished = False   # If the thread finished its range of IPs
 
 
     # Methods
-    def __init__(self, ip_range: IPrange | ComplexIPrange, name_num: int) -> None:
-        # Check if ip range is in fact, an ip range
-        if isntinstance(ip_range, (IPrange, ComplexIPrange)):
-            raise TypeError(f"ip range must be of type IPrange or ComplexIPrange, not {ip_range.__class__.__name__}")
+    def __init__(self, ip_range: IPrange | ComplexIPrange | list[IP], name_num: int, timeouts: AdaptiveTimeout | None = None, exclusions: AddressFilter | None = None) -> None:
+        # Check if ip range is in fact, an ip range or a list of ips
+        if isntinstance(ip_range, (IPrange, ComplexIPrange, list)):
+            raise TypeError(f"ip range must be of type IPrange, ComplexIPrange or list, not {ip_range.__class__.__name__}")
         
         super().__init__(f"PingThread-{name_num}")
         self.check_range = ip_range
+        self.timeouts = timeouts
+        self.exclusions = exclusions
     
 
     # Thread methods
-    def join(self) -> tuple[list[tuple[IP, bool]], IPrange]:
+    def join(self) -> tuple[list[tuple[IP, float | None]], IPrange]:
         super().join()
         
         return self.results, self.checked_range
@@ -94,12 +101,37 @@ class PingThread(ThreadWrap):
     
     # Function to be executed
     def main(self) -> None:        
+        rtt_hist = REGISTRY.histogram("probe_rtt_seconds", RTT_BUCKETS)
+        responded = REGISTRY.counter("probes_responded")
+        excluded = REGISTRY.counter("probes_excluded")
+
         # Ping loop
         results = []
+        iterated = 0
         for ip in self.check_range:
+            iterated += 1
+
+            # Skip excluded ips, they still count as checked
+            if self.exclusions != None and not self.exclusions.allows(ip):
+                excluded.inc()
+                if self.is_end:
+                    break
+                continue
+
             # Ping ip and append result
-            results.append((ip, bool(ping(ip))))
+            timeout = self.timeouts.timeout(ip) if self.timeouts != None else DEFAULT_TIMEOUT
+            rtt = ping(ip, timeout)
+            results.append((ip, rtt if isinstance(rtt, float) else None)) # ping3 gives False on errors and None on timeouts
+
+            if self.timeouts != None:
+                self.timeouts.observe(ip, rtt, timeout)
             self.total_pinged += 1
+
+            # Record metrics
+            REGISTRY.stage("ping")
+            if isinstance(rtt, float):
+                rtt_hist.observe(rtt)
+                responded.inc()
             
             # Break when thread end
             if self.is_end:
@@ -112,9 +144,14 @@ class PingThread(ThreadWrap):
         # Set results of self
         self.results = results
         
-        # Get checked range from results
-        bruh_ranges = [IPrange(ip, ip + 1) for ip, _ in self.results] # I could't think of a better name
-        self.checked_range = ComplexIPrange(bruh_ranges, _trust_contain = True)
+        # Get checked range, the ranges are checked in order so it's everything up to where the loop stopped
+        if isinstance(self.check_range, list):
+            bruh_ranges = [IPrange(ip, ip + 1) for ip, _ in self.results] # I could't think of a better name
+            self.checked_range = ComplexIPrange(bruh_ranges, _trust_contain = True)
+        elif iterated == 0:
+            self.checked_range = ComplexIPrange([])
+        else:
+            self.checked_range = self.check_range[:iterated]
 
 
 class LoadThread(ThreadWrap):
@@ -143,6 +180,7 @@ class LoadThread(ThreadWrap):
         for img in self.imgs:
             pix_maps.append(img.load())
             self.loaded_num += 1
+            REGISTRY.stage("load")
 
             if self.is_end:
                 break
@@ -156,19 +194,29 @@ class ResultsThread(ThreadWrap):
     # Variables
     results = []
     img_refs = []
+    layout = None
+    batch_size = 65536 # Results written between end checks
 
 
     # Init
-    def __init__(self, results: list[tuple[IP, bool]], img_refs: list[PyAccess], name_num: int) -> None:
+    def __init__(self, results: list[tuple[IP, float | None]], img_refs: list[PyAccess], name_num: int, layout: Layout = None) -> None:
         super().__init__(f"ResultsThread-{name_num}")
         self.results = results
         self.img_refs = img_refs
+        self.layout = layout
     
 
     # Function to be executed
     def main(self) -> None:
-        for result in self.results:
-            image.write_pix(self.img_refs, result)
+        queue_depth = REGISTRY.histogram("results_queue_depth", QUEUE_DEPTH_BUCKETS)
+
+        for i in range(0, len(self.results), self.batch_size):
+            queue_depth.observe(len(self.results) - i)
+            batch = self.results[i:i+self.batch_size]
+            indexes = np.fromiter((ip.to_index for ip, _ in batch), dtype=np.uint32, count=len(batch))
+            responses = np.fromiter((bool(response) for _, response in batch), dtype=bool, count=len(batch))
+            image.write_pixels(self.img_refs, indexes, responses, self.layout)
+            REGISTRY.stage("results", len(batch))
 
             if self.is_end:
                 break
@@ -190,9 +238,14 @@ class SaveThread(ThreadWrap):
 
     # Function to be executed
     def main(self) -> None:
+        encode_hist = REGISTRY.histogram("tile_encode_seconds", ENCODE_BUCKETS)
+
         for img, out_num in self.imgs_n_out_nums:
+            start = perf_counter()
             image.save(img, out_num)
+            encode_hist.observe(perf_counter() - start)
             self.saved_num += 1
+            REGISTRY.stage("save")
 
             if self.is_end:
                 break
@@ -249,9 +302,10 @@ class StatsThread(ThreadWrap):
                 except ZeroDivisionError:
                     print("0 ips/min; ", end='')
                 try:
-                    print(f"{int(total // (time_elapsed.total_seconds() / 3600))} ips/hour; ", end='\r')
+                    print(f"{int(total // (time_elapsed.total_seconds() / 3600))} ips/hour; ", end='')
                 except ZeroDivisionError:
-                    print("0 ips/hour; ", end='\r')
+                    print("0 ips/hour; ", end='')
+                print(f"{int(REGISTRY.rate('ping_total').rate())} ips/sec recently; ", end='\r')
 
                 # Delay
                 sleep(0.2)
@@ -319,6 +373,51 @@ class StatsThread(ThreadWrap):
             print(f"Saved 64/64 images; {time_elapsed} elapsed")
 
 
+class InputThread(ThreadWrap):
+    """Creates a thread that finishes when the user presses enter"""
+
+    # Init
+    def __init__(self) -> None:
+        super().__init__("InputThread")
+        self.daemon = True
+
+
+    # Function to be executed
+    def main(self) -> None:
+        input()
+
+
+class MetricsThread(ThreadWrap):
+    """Creates a thread that periodically writes the metrics to files"""
+
+    # Variables
+    json_path = None
+    prometheus_path = None
+    interval = 5
+
+
+    # Init
+    def __init__(self, json_path: str | None, prometheus_path: str | None, interval: float = 5) -> None:
+        super().__init__("MetricsThread")
+        self.json_path = json_path
+        self.prometheus_path = prometheus_path
+        self.interval = interval
+
+
+    # Function to be executed
+    def main(self) -> None:
+        last_write = 0
+        while not self.is_end:
+            if perf_counter() - last_write >= self.interval:
+                REGISTRY.write(self.json_path, self.prometheus_path)
+                last_write = perf_counter()
+
+            sleep(0.2)
+
+        # Write the final values
+        REGISTRY.write(self.json_path, self.prometheus_path)
+
+
 class ThreadsList(list):
     """Special immutable list of threads that can act on itself easily"""
 
@@ -0,0 +1,137 @@
+# timeout.py
+# Adaptive ping timeout based on the round trip times seen so far
+# Most of the address space never responds, so the time waited on timeouts is most of the scan time
+
+
+# Imports
+from __future__ import annotations
+
+from threading import Lock
+
+import numpy as np
+
+from src.ip import IP
+from src.metrics import REGISTRY
+from src.store import dequantize_rtt, quantize_rtt
+
+
+# Definitions
+PREFIX_BUCKET_SHIFT = 3 # Per /16 histograms use 32 buckets instead of 256 to keep them at 8MB
+GLOBAL_REFRESH = 256    # Observations between recalculating the global timeout
+
+
+class AdaptiveTimeout:
+    """
+    Keeps streaming histograms of round trip times, globally and per /16,
+    and sets the timeout to a high quantile plus a margin, between a floor and a ceiling.
+    The histograms use the log scale buckets of the result store, so quantiles are accurate to about 5%.
+
+    Usage:
+    >>> timeouts = AdaptiveTimeout()
+    >>> timeout = timeouts.timeout(ip)
+    >>> rtt = ping(ip, timeout)
+    >>> timeouts.observe(ip, rtt, timeout)
+    """
+
+    def __init__(self, quantile: float = 0.99, margin: float = 0.5, floor: float = 0.25, ceiling: float = 2.0, min_samples: int = 100) -> None:
+        """
+        Parameters:
+            quantile: float = 0.99 # The round trip time quantile to wait for
+            margin: float = 0.5 # Extra fraction of the quantile to wait
+            floor: float = 0.25 # The lowest timeout, in seconds
+            ceiling: float = 2.0 # The highest timeout, also used until there are enough samples
+            min_samples: int = 100 # Responses needed before a histogram is trusted
+        """
+
+        self.quantile = quantile
+        self.margin = margin
+        self.floor = floor
+        self.ceiling = ceiling
+        self.min_samples = min_samples
+
+        self._global_counts = np.zeros(256, dtype=np.uint64)
+        self._prefix_counts = np.zeros((65536, 256 >> PREFIX_BUCKET_SHIFT), dtype=np.uint32)
+        self._prefix_totals = np.zeros(65536, dtype=np.uint32)
+        self._global_timeout = ceiling
+        self._observed = 0
+        self._lock = Lock()
+
+        self.saved = REGISTRY.counter("timeout_saved_seconds", "Probe time saved compared to always waiting for the ceiling")
+        self.gauge = REGISTRY.gauge("adaptive_timeout_seconds", "The current global timeout")
+        self.gauge.set(ceiling)
+
+
+    @staticmethod
+    def _prefix(ip: IP) -> int:
+        """Returns the /16 (a.b) of an IP"""
+
+        return ip.a << 8 | ip.b
+
+
+    def _from_counts(self, counts: np.ndarray, shift: int = 0) -> float:
+        """Returns the timeout from a histogram"""
+
+        cumulative = np.cumsum(counts)
+        bucket = int(np.searchsorted(cumulative, cumulative[-1] * self.quantile))
+
+        # Use the top of the bucket
+        rtt = float(dequantize_rtt(min(255, (bucket + 1) << shift)))
+        return min(self.ceiling, max(self.floor, rtt * (1 + self.margin)))
+
+
+    def timeout(self, ip: IP) -> float:
+        """Returns the timeout to use for an IP"""
+
+        prefix = self._prefix(ip)
+        if self._prefix_totals[prefix] >= self.min_samples:
+            return self._from_counts(self._prefix_counts[prefix], PREFIX_BUCKET_SHIFT)
+
+        return self._global_timeout
+
+
+    def observe(self, ip: IP, rtt: float | None, timeout: float) -> None:
+        """
+        Records the result of a ping
+
+        Parameters:
+            ip: IP # The pinged IP
+            rtt: float | None # The round trip time, None if it timed out, False if the ping failed
+            timeout: float # The timeout that was used
+        """
+
+        # Count the time saved by not waiting for the ceiling, only a timeout waited for the adaptive timeout
+        if rtt == None:
+            self.saved.inc(self.ceiling - timeout)
+            return
+
+        # A failed ping didn't wait at all and says nothing about round trip times
+        if not isinstance(rtt, float):
+            return
+
+        bucket = int(quantize_rtt(rtt))
+        prefix = self._prefix(ip)
+        with self._lock:
+            self._global_counts[bucket] += 1
+            self._prefix_counts[prefix, bucket >> PREFIX_BUCKET_SHIFT] += 1
+            self._prefix_totals[prefix] += 1
+            self._observed += 1
+
+            # Recalculate the global timeout every once in a while
+            if self._observed == self.min_samples or (self._observed > self.min_samples and self._observed % GLOBAL_REFRESH == 0):
+                self._global_timeout = self._from_counts(self._global_counts)
+                self.gauge.set(self._global_timeout)
+
+
+def from_settings(timeout_settings: dict) -> AdaptiveTimeout | None:
+    """Returns the adaptive timeout described by the timeout settings, or None if it is off"""
+
+    if not timeout_settings["adaptive"]:
+        return None
+
+    return AdaptiveTimeout(
+        timeout_settings["quantile"],
+        timeout_settings["margin"],
+        timeout_settings["floor"],
+        timeout_settings["ceiling"],
+        timeout_settings["min_samples"]
+    )
@@ -0,0 +1,90 @@
+# writer.py
+# Writes batches of results to the result store, the prefix counts, the rank index and the maps
+# The store and counts are written right away, the maps only every map_batch IPs since each update rewrites whole tiles
+
+
+# Imports
+from __future__ import annotations
+
+import numpy as np
+
+import src.image as image
+from src.aggregates import PrefixCounts
+from src.layout import Layout
+from src.rank import RankIndex
+from src.store import NO_RESPONSE, ResultStore
+
+
+# Definitions
+class BatchWriter:
+    """
+    Writes batches of results everywhere results are kept
+
+    Usage:
+    >>> writer = BatchWriter(ResultStore(), PrefixCounts.load(), RankIndex.load(store), get_layout("octet"))
+    >>> writer.write(indexes, buckets)
+    >>> writer.flush()
+    """
+
+    def __init__(self, store: ResultStore, counts: PrefixCounts | None = None, rank: RankIndex | None = None, layout: Layout | None = None, map_batch: int = 1 << 24) -> None:
+        """
+        Parameters:
+            store: ResultStore # The result store to write to
+            counts: PrefixCounts | None = None # Per prefix counts to keep up to date, if any
+            rank: RankIndex | None = None # Rank index to keep up to date, if any
+            layout: Layout | None = None # The layout of the maps, the maps aren't updated if None
+            map_batch: int = 1 << 24 # Written IPs held before they are written to the maps
+        """
+
+        self.store = store
+        self.counts = counts
+        self.rank = rank
+        self.layout = layout
+        self.map_batch = map_batch
+
+        # Written IPs and if they responded, until the next flush
+        self.written = []
+        self.responded = []
+        self.held = 0
+
+
+    def write(self, indexes: np.ndarray, buckets: np.ndarray) -> np.ndarray:
+        """
+        Writes a batch of results, later results of an IP win
+
+        Parameters:
+            indexes: np.ndarray # The IP indexes, without duplicates
+            buckets: np.ndarray # The quantized round trip times, see quantize_rtt
+
+        Returns:
+            np.ndarray[uint8] # The buckets that were in the store before
+        """
+
+        indexes = np.asarray(indexes, dtype=np.uint32)
+        old = self.store.write(indexes, buckets)
+        if self.counts != None:
+            self.counts.update(indexes, old, buckets)
+
+        self.written.append(indexes)
+        self.responded.append(np.asarray(buckets) != NO_RESPONSE)
+        self.held += len(indexes)
+        if self.held >= self.map_batch:
+            self.flush()
+
+        return old
+
+
+    def flush(self) -> None:
+        """Writes the held results to the rank index and the maps"""
+
+        self.store.flush()
+        if not self.written:
+            return
+
+        written, responded = np.concatenate(self.written), np.concatenate(self.responded)
+        self.written, self.responded, self.held = [], [], 0
+
+        if self.rank != None:
+            self.rank.update(written)
+        if self.layout != None:
+            image.update_tiles(written, responded, self.layout)